@@ -0,0 +1,5 @@
+# make sure the Celery app (queues, routes, priorities from backend/celery.py) is
+# loaded when Django starts, so tasks published by the web process use it too
+from .celery import app as celery_app
+
+__all__ = ("celery_app",)
@@ -1,6 +1,7 @@
 import os
-from celery import Celery
+from celery import Celery, signals
 from celery.schedules import crontab
+from kombu import Exchange, Queue
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
@@ -9,10 +10,86 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+# 📬 Queues & routing
+# Transactional sends must not wait behind campaign traffic, so each kind of
+# work has its own queue (see mailplans/routing.py for per-plan selection):
+#   transactional - triggered single sends (send_mail_task)
+#   bulk          - campaign / scheduled sends (send_mail_batch_task)
+#   planning      - flow traversal and bulk imports (execute_flow_task, import_mailplans_task)
+#   scheduler     - periodic housekeeping (beat tasks)
+#   celery        - anything else
+MAX_PRIORITY = 9
+
+app.conf.task_queues = [
+    Queue(name, Exchange(name), routing_key=name, queue_arguments={'x-max-priority': MAX_PRIORITY + 1})
+    for name in ('transactional', 'bulk', 'planning', 'scheduler', 'celery')
+]
+app.conf.task_default_queue = 'celery'
+app.conf.task_routes = {
+    'mailplans.tasks.send_mail_task': {'queue': 'transactional'},
+    'mailplans.tasks.send_mail_batch_task': {'queue': 'bulk'},
+    'mailplans.tasks.execute_flow_task': {'queue': 'planning'},
+    'mailplans.tasks.import_mailplans_task': {'queue': 'planning'},
+    'mailplans.tasks.schedule_due_mailplans': {'queue': 'scheduler'},
+    'mailplans.tasks.dispatch_scheduled_sends': {'queue': 'scheduler'},
+    'mailplans.tasks.archive_email_logs_task': {'queue': 'scheduler'},
+}
+# message priorities within a queue (Redis emulates them with one list per step)
+app.conf.task_queue_max_priority = MAX_PRIORITY + 1
+# queues keep kombu's round-robin polling: a worker consuming several queues
+# (the 'all' profile) must not leave scheduler/celery waiting while the queues
+# listed before them have a backlog
+app.conf.broker_transport_options = {
+    'priority_steps': list(range(MAX_PRIORITY + 1)),
+    'sep': ':',
+}
+
+
+# 👷 Worker profiles
+# Start dedicated pools with CELERY_WORKER_PROFILE, e.g.
+#   CELERY_WORKER_PROFILE=transactional celery -A backend worker
+#   CELERY_WORKER_PROFILE=bulk celery -A backend worker
+# A profile picks the queues to consume and sensible concurrency / prefetch
+# defaults; -Q, -c and --prefetch-multiplier on the command line still win.
+WORKER_PROFILES = {
+    # many slots, no prefetch: a new triggered send never waits behind a reserved one
+    'transactional': {'queues': ['transactional'], 'concurrency': 16, 'prefetch_multiplier': 1},
+    'bulk': {'queues': ['bulk'], 'concurrency': 4, 'prefetch_multiplier': 2},
+    'planning': {'queues': ['planning'], 'concurrency': 2, 'prefetch_multiplier': 1},
+    'scheduler': {'queues': ['scheduler', 'celery'], 'concurrency': 1, 'prefetch_multiplier': 1},
+    'all': {'queues': ['transactional', 'bulk', 'planning', 'scheduler', 'celery'], 'concurrency': None,
+            'prefetch_multiplier': 1},
+}
+
+WORKER_PROFILE = os.getenv('CELERY_WORKER_PROFILE', '').strip()
+if WORKER_PROFILE:
+    if WORKER_PROFILE not in WORKER_PROFILES:
+        raise ValueError(f"Unknown CELERY_WORKER_PROFILE {WORKER_PROFILE!r}; choose from {sorted(WORKER_PROFILES)}")
+    # set before the worker command line is parsed, so its defaults pick these up
+    _profile = WORKER_PROFILES[WORKER_PROFILE]
+    app.conf.worker_prefetch_multiplier = _profile['prefetch_multiplier']
+    if _profile['concurrency']:
+        app.conf.worker_concurrency = _profile['concurrency']
+
+
+@signals.celeryd_init.connect
+def apply_worker_profile_queues(sender=None, instance=None, options=None, **kwargs):
+    if WORKER_PROFILE and not (options or {}).get('queues'):
+        instance.app.amqp.queues.select(WORKER_PROFILES[WORKER_PROFILE]['queues'])
+
+
 # 🔁 Schedule periodic tasks
 app.conf.beat_schedule = {
     'check-due-mailplans-every-minute': {
         'task': 'mailplans.tasks.schedule_due_mailplans',
         'schedule': crontab(minute='*/1'),  # every 1 minute
     },
-}
\ No newline at end of file
+    'dispatch-scheduled-sends': {
+        'task': 'mailplans.tasks.dispatch_scheduled_sends',
+        'schedule': float(os.getenv('MAILPLAN_DISPATCH_INTERVAL', 30)),  # seconds
+    },
+    'archive-email-logs-daily': {
+        'task': 'mailplans.tasks.archive_email_logs_task',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
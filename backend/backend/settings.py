@@ -194,6 +194,7 @@ from pathlib import Path
 import os
 from datetime import timedelta
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers as cors_default_headers
 
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -275,6 +276,15 @@ DATABASES = {
 if os.getenv("PGSSLMODE", "").lower() in ("require", "true", "1"):
     DATABASES["default"].setdefault("OPTIONS", {})["sslmode"] = "require"
 
+# DB_ENGINE=sqlite: local SQLite file instead of Postgres (offline benchmarks / development)
+if os.getenv("DB_ENGINE", "").lower() == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", str(BASE_DIR / "db.sqlite3")),
+        }
+    }
+
 # Alternative: If you supply a DATABASE_URL, you could parse it with dj-database-url (optional)
 
 # -----------------------
@@ -338,6 +348,9 @@ else:
         for u in os.getenv("CORS_ALLOWED_ORIGINS", "").split(",")
         if u.strip()
     ]
+# conditional requests on the MailPlan API (ETag / If-None-Match / If-Match)
+CORS_ALLOW_HEADERS = (*cors_default_headers, "if-match", "if-none-match")
+CORS_EXPOSE_HEADERS = ["ETag"]
 
 # -----------------------
 # Celery
@@ -351,13 +364,121 @@ CELERY_TIMEZONE = os.getenv("CELERY_TIMEZONE", "Asia/Kolkata")
 CELERY_ENABLE_UTC = True
 CELERY_RESULT_EXPIRES = int(os.getenv("CELERY_RESULT_EXPIRES", 3600))
 
+# Threads used to deliver per-recipient messages in parallel (each uses its own pooled connection)
+MAILPLAN_SEND_CONCURRENCY = int(os.getenv("MAILPLAN_SEND_CONCURRENCY", 4))
+
+# Caches. The idempotency store (mailplans/idempotency.py) uses the "default" cache; point
+# REDIS_CACHE_URL at Redis so in-flight send keys are shared by all workers (local memory
+# only deduplicates within one process; the EmailLog unique key still guards the DB).
+REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL", "")
+if REDIS_CACHE_URL:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_CACHE_URL}}
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# Idempotency keys: how long completed / in-flight send keys are remembered in the cache (seconds)
+MAILPLAN_IDEMPOTENCY_CACHE = os.getenv("MAILPLAN_IDEMPOTENCY_CACHE", "default")
+MAILPLAN_IDEMPOTENCY_TTL = int(os.getenv("MAILPLAN_IDEMPOTENCY_TTL", 172800))
+MAILPLAN_IDEMPOTENCY_INFLIGHT_TTL = int(os.getenv("MAILPLAN_IDEMPOTENCY_INFLIGHT_TTL", 900))
+# send_mail_task delivers and logs this many addresses at a time; the in-flight TTL above must be
+# longer than one chunk takes to deliver (delivered chunks are in EmailLog and guarded there)
+MAILPLAN_SEND_LOG_CHUNK = int(os.getenv("MAILPLAN_SEND_LOG_CHUNK", 200))
+
+# Delivery engine: "threads" (pooled blocking SMTP connections, one per thread) or
+# "asyncio" (many aiosmtplib sessions multiplexed on one event loop per worker process)
+MAILPLAN_DELIVERY_ENGINE = os.getenv("MAILPLAN_DELIVERY_ENGINE", "threads")
+MAILPLAN_ASYNC_SMTP_SESSIONS = int(os.getenv("MAILPLAN_ASYNC_SMTP_SESSIONS", 50))
+
+# Buffered EmailLog writer: flush after this many rows / seconds (always flushed at task end)
+MAILPLAN_LOG_FLUSH_SIZE = int(os.getenv("MAILPLAN_LOG_FLUSH_SIZE", 500))
+MAILPLAN_LOG_FLUSH_INTERVAL = float(os.getenv("MAILPLAN_LOG_FLUSH_INTERVAL", 2))
+# A failed flush keeps its writes for the next one; after this many failures in a row they are dropped
+MAILPLAN_LOG_FLUSH_RETRIES = int(os.getenv("MAILPLAN_LOG_FLUSH_RETRIES", 3))
+
+# Compiled template LRU cache used when rendering subjects/bodies
+MAILPLAN_TEMPLATE_CACHE_SIZE = int(os.getenv("MAILPLAN_TEMPLATE_CACHE_SIZE", 512))
+# compile the templates of active plans when a worker process starts
+MAILPLAN_TEMPLATE_CACHE_PREWARM = os.getenv("MAILPLAN_TEMPLATE_CACHE_PREWARM", "False").lower() in ("1", "true", "yes")
+
+# Plans with send_queue="auto" go to the transactional queue when triggered by
+# button_click/on_signup and addressed to at most this many recipients (else bulk)
+MAILPLAN_TRANSACTIONAL_MAX_RECIPIENTS = int(os.getenv("MAILPLAN_TRANSACTIONAL_MAX_RECIPIENTS", 10))
+
+# Group due sends into send_mail_batch_task messages of this size (1 = one send_mail_task per email)
+MAILPLAN_SEND_BATCH_SIZE = int(os.getenv("MAILPLAN_SEND_BATCH_SIZE", 50))
+
+# Outbound send-rate limiting (token buckets in Redis shared by all workers, see mailplans/rate_limit.py).
+# Limits are "<emails per second>/<burst>"; empty = unlimited. Over-rate sends are re-queued with a countdown.
+MAILPLAN_RATE_LIMIT_ENABLED = os.getenv("MAILPLAN_RATE_LIMIT_ENABLED", "False").lower() in ("1", "true", "yes")
+MAILPLAN_RATE_LIMIT_REDIS_URL = os.getenv("MAILPLAN_RATE_LIMIT_REDIS_URL", "")  # defaults to CELERY_BROKER_URL
+MAILPLAN_RATE_LIMIT_GLOBAL = os.getenv("MAILPLAN_RATE_LIMIT_GLOBAL", "")
+MAILPLAN_RATE_LIMIT_DOMAIN = os.getenv("MAILPLAN_RATE_LIMIT_DOMAIN", "")
+MAILPLAN_RATE_LIMIT_DOMAINS = os.getenv("MAILPLAN_RATE_LIMIT_DOMAINS", "")  # e.g. "gmail.com=20/40,yahoo.com=5/10"
+# Longest countdown (seconds) of a re-queued send: countdowns are ETA messages held in worker memory,
+# so longer waits are split into several hops
+MAILPLAN_RATE_LIMIT_MAX_DEFER = float(os.getenv("MAILPLAN_RATE_LIMIT_MAX_DEFER", 60))
+
+# GET /api/mailplans/ page size (cursor pagination, ?page_size= up to the maximum)
+MAILPLAN_LIST_PAGE_SIZE = int(os.getenv("MAILPLAN_LIST_PAGE_SIZE", 50))
+MAILPLAN_LIST_MAX_PAGE_SIZE = int(os.getenv("MAILPLAN_LIST_MAX_PAGE_SIZE", 500))
+
+# POST /api/mailplans/bulk_trigger/: most plans one request may trigger
+MAILPLAN_BULK_TRIGGER_MAX = int(os.getenv("MAILPLAN_BULK_TRIGGER_MAX", 1000))
+
+# Cache alias for serialized MailPlan detail responses (empty = off), invalidated on every write
+MAILPLAN_RESPONSE_CACHE = os.getenv("MAILPLAN_RESPONSE_CACHE", "")
+MAILPLAN_RESPONSE_CACHE_TTL = int(os.getenv("MAILPLAN_RESPONSE_CACHE_TTL", 300))
+
+# Flow validation in MailPlanSerializer (0 = no limit); see mailplans/flow.py validate_flow
+MAILPLAN_FLOW_MAX_NODES = int(os.getenv("MAILPLAN_FLOW_MAX_NODES", 2000))
+MAILPLAN_FLOW_MAX_EDGES = int(os.getenv("MAILPLAN_FLOW_MAX_EDGES", 10000))
+MAILPLAN_FLOW_MAX_DELAY_DAYS = int(os.getenv("MAILPLAN_FLOW_MAX_DELAY_DAYS", 365))  # per delay node
+
+# Prometheus metrics of the mail tasks, served at /metrics (needs prometheus_client, see mailplans/metrics.py).
+# Set PROMETHEUS_MULTIPROC_DIR in the environment to aggregate all web/worker processes of a host.
+MAILPLAN_METRICS_ENABLED = os.getenv("MAILPLAN_METRICS_ENABLED", "True").lower() in ("1", "true", "yes")
+# scrapes need "Authorization: Bearer <token>"; without a token /metrics is 404 (open only with DEBUG)
+MAILPLAN_METRICS_TOKEN = os.getenv("MAILPLAN_METRICS_TOKEN", "")
+
 from celery.schedules import crontab  # noqa: E402 (import here to keep file order)
 
+# schedule_due_mailplans: plans claimed per transaction / per beat tick, flows per published message
+MAILPLAN_SCHEDULER_CHUNK_SIZE = int(os.getenv("MAILPLAN_SCHEDULER_CHUNK_SIZE", 500))
+MAILPLAN_SCHEDULER_MAX_PER_TICK = int(os.getenv("MAILPLAN_SCHEDULER_MAX_PER_TICK", 5000))
+MAILPLAN_SCHEDULER_PUBLISH_CHUNK = int(os.getenv("MAILPLAN_SCHEDULER_PUBLISH_CHUNK", 50))
+
+# Delayed flow sends (ScheduledSend rows) are published by dispatch_scheduled_sends
+MAILPLAN_DISPATCH_INTERVAL = float(os.getenv("MAILPLAN_DISPATCH_INTERVAL", 30))  # seconds
+MAILPLAN_DISPATCH_CHUNK_SIZE = int(os.getenv("MAILPLAN_DISPATCH_CHUNK_SIZE", 500))
+MAILPLAN_DISPATCH_MAX_CHUNKS = int(os.getenv("MAILPLAN_DISPATCH_MAX_CHUNKS", 20))  # per run
+
+# EmailLog retention: rows older than this many days are archived to gzip NDJSON and deleted (0 = keep forever)
+MAILPLAN_LOG_RETENTION_DAYS = int(os.getenv("MAILPLAN_LOG_RETENTION_DAYS", 90))
+MAILPLAN_LOG_ARCHIVE_DIR = os.getenv("MAILPLAN_LOG_ARCHIVE_DIR", str(BASE_DIR / "email_log_archive"))
+MAILPLAN_LOG_ARCHIVE_BATCH_SIZE = int(os.getenv("MAILPLAN_LOG_ARCHIVE_BATCH_SIZE", 1000))
+# rendered bodies without logs are only purged once no send used them for this long (seconds)
+MAILPLAN_RENDERED_BODY_GRACE_SECONDS = int(os.getenv("MAILPLAN_RENDERED_BODY_GRACE_SECONDS", 86400))
+
+# Bulk imports (POST /api/imports/, manage.py import_mailplans): uploads are kept here until imported
+MAILPLAN_IMPORT_DIR = os.getenv("MAILPLAN_IMPORT_DIR", str(BASE_DIR / "imports"))
+MAILPLAN_IMPORT_CHUNK_SIZE = int(os.getenv("MAILPLAN_IMPORT_CHUNK_SIZE", 1000))  # rows per bulk_create transaction
+MAILPLAN_IMPORT_MAX_CHUNK_SIZE = int(os.getenv("MAILPLAN_IMPORT_MAX_CHUNK_SIZE", 10000))
+MAILPLAN_IMPORT_MAX_ERRORS = int(os.getenv("MAILPLAN_IMPORT_MAX_ERRORS", 1000))  # row errors kept per job
+MAILPLAN_IMPORT_STALE_SECONDS = int(os.getenv("MAILPLAN_IMPORT_STALE_SECONDS", 300))  # running job without progress = dead
+
 CELERY_BEAT_SCHEDULE = {
     "check-due-mailplans-every-minute": {
         "task": "mailplans.tasks.schedule_due_mailplans",
         "schedule": crontab(minute="*/1"),  # every 1 minute
     },
+    "dispatch-scheduled-sends": {
+        "task": "mailplans.tasks.dispatch_scheduled_sends",
+        "schedule": MAILPLAN_DISPATCH_INTERVAL,
+    },
+    "archive-email-logs-daily": {
+        "task": "mailplans.tasks.archive_email_logs_task",
+        "schedule": crontab(hour=3, minute=30),
+    },
 }
 
 # -----------------------
@@ -377,6 +498,14 @@ EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "False").lower() in ("true", "1", "ye
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "no-reply@example.com")
 EMAIL_TIMEOUT = int(os.getenv("EMAIL_TIMEOUT", 10))
 
+# Per-worker SMTP connection pool (see mailplans/smtp_pool.py)
+EMAIL_POOL_ENABLED = os.getenv("EMAIL_POOL_ENABLED", "True").lower() in ("1", "true", "yes")
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", 4))
+# close connections that have been idle longer than this (seconds)
+EMAIL_POOL_IDLE_TIMEOUT = int(os.getenv("EMAIL_POOL_IDLE_TIMEOUT", 60))
+# NOOP-check connections idle longer than this before reusing them (seconds)
+EMAIL_POOL_HEALTHCHECK_AFTER = int(os.getenv("EMAIL_POOL_HEALTHCHECK_AFTER", 5))
+
 # -----------------------
 # Other common settings
 # -----------------------
@@ -5,7 +5,10 @@ from rest_framework.routers import DefaultRouter
 
 # Router & API views
 from mailplans.views import MailPlanViewSet
+from mailplans.import_views import ImportJobViewSet
 from mailplans.recipient_views import RecipientListView
+from mailplans.rate_limit_views import SendRateLimitView
+from mailplans.metrics_views import metrics_view
 
 # Use your custom serializer (already present at backend/mailplans/auth_serializers.py)
 from mailplans.auth_serializers import FlexibleTokenObtainPairSerializer
@@ -24,6 +27,7 @@ from django.db import connections, OperationalError
 # Router for main MailPlan endpoints
 router = DefaultRouter()
 router.register(r'mailplans', MailPlanViewSet, basename='mailplan')
+router.register(r'imports', ImportJobViewSet, basename='importjob')
 
 
 def health(request):
@@ -73,10 +77,16 @@ urlpatterns = [
     # Recipient list endpoint (with optional filters)
     path('api/recipients/', RecipientListView.as_view(), name='recipients-list'),
 
+    # Outbound send-rate limiter bucket levels (staff only)
+    path('api/rate-limits/', SendRateLimitView.as_view(), name='send-rate-limits'),
+
     # JWT authentication endpoints (using inline view above)
     path('api/token/', FlexibleTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     # Health check (DB)
     path('healthz/', health),
+
+    # Prometheus metrics of the mail tasks (see mailplans/metrics.py)
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,6 +1,6 @@
 # mailplans/admin.py
 from django.contrib import admin
-from .models import MailPlan, EmailLog
+from .models import MailPlan, EmailLog, ImportJob, Recipient, ScheduledSend
 
 @admin.register(MailPlan)
 class MailPlanAdmin(admin.ModelAdmin):
@@ -9,6 +9,33 @@ class MailPlanAdmin(admin.ModelAdmin):
 
 @admin.register(EmailLog)
 class EmailLogAdmin(admin.ModelAdmin):
-    list_display = ('id', 'mailplan', 'to_email', 'status', 'created_at', 'sent_at')
+    list_display = ('id', 'mailplan', 'to_email', 'status', 'attempts', 'created_at', 'sent_at')
     search_fields = ('to_email', 'subject', 'response_message')
     list_filter = ('status',)
+    list_select_related = ('mailplan',)
+    ordering = ('-created_at',)
+    # skip the unfiltered COUNT(*) over the whole log table on every page
+    show_full_result_count = False
+    # the shared compressed body is shown decompressed instead of as a FK selector
+    exclude = ('rendered', 'rendered_body')
+    readonly_fields = ('rendered_html',)
+
+@admin.register(ScheduledSend)
+class ScheduledSendAdmin(admin.ModelAdmin):
+    list_display = ('id', 'mailplan', 'node_id', 'due_at', 'created_at')
+    list_select_related = ('mailplan',)
+    ordering = ('due_at',)
+
+@admin.register(Recipient)
+class RecipientAdmin(admin.ModelAdmin):
+    list_display = ('id', 'email', 'name', 'created_at')
+    search_fields = ('email', 'name')
+    ordering = ('email',)
+    show_full_result_count = False
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'filename', 'format', 'status', 'committed_rows', 'imported_rows', 'failed_rows', 'created_at')
+    list_filter = ('status', 'format')
+    readonly_fields = ('runner', 'started_at', 'finished_at')
+    ordering = ('-created_at',)
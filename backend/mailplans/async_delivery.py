@@ -0,0 +1,218 @@
+# backend/mailplans/async_delivery.py
+"""
+asyncio delivery engine (MAILPLAN_DELIVERY_ENGINE = "asyncio").
+
+The default engine sends over a few pooled, blocking SMTP connections, one
+thread per connection (see tasks._deliver_messages). This engine instead runs
+one asyncio event loop per worker process, in a daemon thread, and keeps up
+to MAILPLAN_ASYNC_SMTP_SESSIONS SMTP sessions open on it with aiosmtplib.
+Messages of a task are sent concurrently over those sessions, so one process
+can keep many SMTP transactions in flight while it waits on the network.
+
+ - Sessions stay open between tasks. A session is dropped after a transient
+   error, and a new one is opened on demand.
+ - Concurrency is bounded by the number of sessions. Messages wait for a
+   free session.
+ - Outcomes have the same shape as the threaded engine, a list of
+   (sent_count, exception_or_None). Recipient rejections are raised as
+   smtplib.SMTPRecipientsRefused, so retry classification does not change.
+
+aiosmtplib is an optional dependency, and the engine only drives real SMTP.
+When aiosmtplib is not installed, or EMAIL_BACKEND is not the SMTP backend
+(locmem, console, dummy), available() is False and the send tasks use the
+threaded engine.
+"""
+
+import asyncio
+import logging
+import os
+import smtplib
+import threading
+import time
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+from . import metrics
+
+try:
+    import aiosmtplib
+except ImportError:  # optional dependency
+    aiosmtplib = None
+
+logger = logging.getLogger(__name__)
+
+SMTP_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+
+
+def available():
+    return aiosmtplib is not None and settings.EMAIL_BACKEND == SMTP_BACKEND
+
+
+def _build_message(subject, html_body, recipients):
+    email = EmailMessage(
+        subject=subject,
+        body=html_body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=recipients,
+    )
+    email.content_subtype = "html"
+    return email.from_email, email.recipients(), email.message()
+
+
+class AsyncSMTPEngine:
+    """Event loop thread + bounded set of reusable aiosmtplib sessions."""
+
+    def __init__(self, max_sessions=50, host=None, port=None):
+        self.max_sessions = max(1, int(max_sessions))
+        self.host = host
+        self.port = port
+        self.stats = {"created": 0, "reused": 0, "discarded": 0, "sent": 0, "failed": 0}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="mailplan-async-smtp", daemon=True)
+        self._thread.start()
+        # created on the loop (asyncio primitives bind to their loop)
+        self._idle = None
+        self._slots = None
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _setup(self):
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.max_sessions)
+
+    # ---------- sessions ----------
+
+    def _new_client(self):
+        use_ssl = getattr(settings, "EMAIL_USE_SSL", False)
+        return aiosmtplib.SMTP(
+            hostname=self.host or settings.EMAIL_HOST,
+            port=self.port or settings.EMAIL_PORT,
+            username=settings.EMAIL_HOST_USER or None,
+            password=settings.EMAIL_HOST_PASSWORD or None,
+            use_tls=use_ssl,
+            start_tls=True if settings.EMAIL_USE_TLS else False,
+            timeout=getattr(settings, "EMAIL_TIMEOUT", None) or 60,
+        )
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                client = self._idle.pop()
+                if client.is_connected:
+                    self.stats["reused"] += 1
+                    return client
+            client = self._new_client()
+            await client.connect()
+            self.stats["created"] += 1
+            return client
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, client):
+        self._idle.append(client)
+        self._slots.release()
+
+    async def _discard(self, client):
+        self.stats["discarded"] += 1
+        self._slots.release()
+        try:
+            client.close()
+        except Exception:
+            logger.debug("Ignoring error while closing async SMTP session.", exc_info=True)
+
+    # ---------- sending ----------
+
+    async def _send_one(self, subject, html_body, recipients):
+        sender, to, message = _build_message(subject, html_body, recipients)
+        try:
+            client = await self._acquire()
+        except Exception as exc:
+            self.stats["failed"] += 1
+            return 0, exc
+        started = time.perf_counter()
+        try:
+            errors, _ = await client.send_message(message, sender=sender, recipients=to)
+        except aiosmtplib.SMTPRecipientsRefused as exc:
+            metrics.observe_smtp("asyncio", time.perf_counter() - started)
+            # permanent for these addresses; the session itself is still fine
+            self._release(client)
+            self.stats["failed"] += 1
+            refused = {err.recipient: (err.code, err.message) for err in exc.recipients}
+            return 0, smtplib.SMTPRecipientsRefused(refused)
+        except Exception as exc:
+            metrics.observe_smtp("asyncio", time.perf_counter() - started)
+            await self._discard(client)
+            self.stats["failed"] += 1
+            return 0, exc
+        metrics.observe_smtp("asyncio", time.perf_counter() - started)
+        self._release(client)
+        self.stats["sent"] += 1
+        return (0 if len(errors) >= len(to) else 1), None
+
+    async def _send_all(self, messages):
+        return await asyncio.gather(*(self._send_one(*m) for m in messages))
+
+    def deliver(self, messages, timeout=None):
+        """Blocking entry point for worker threads; returns [(sent_count, exc)] in input order."""
+        if not messages:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self._send_all(messages), self._loop)
+        return future.result(timeout)
+
+    async def _close_all(self):
+        idle, self._idle = self._idle, []
+        for client in idle:
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+    def close(self):
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_all(), self._loop).result(10)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Engine of the current process (re-created after a fork, like the SMTP pool)."""
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        with _engine_lock:
+            if _engine is None or _engine_pid != pid:
+                _engine = AsyncSMTPEngine(max_sessions=getattr(settings, "MAILPLAN_ASYNC_SMTP_SESSIONS", 50))
+                _engine_pid = pid
+    return _engine
+
+
+def deliver_messages(messages):
+    return get_engine().deliver(messages)
+
+
+def reset_engine():
+    """Close and forget this process' engine (it is re-created from the current settings on next use)."""
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None and _engine_pid == os.getpid():
+        engine.close()
+
+
+@worker_process_shutdown.connect
+def _close_engine_on_shutdown(**kwargs):
+    if _engine is not None and _engine_pid == os.getpid():
+        logger.info("Closing async SMTP sessions: %s", _engine.stats)
+        _engine.close()
@@ -0,0 +1,309 @@
+# backend/mailplans/benchmarks.py
+"""
+Micro-benchmarks of the send and flow-planning hot paths.
+
+Run them with `python manage.py benchmark` (see that command for the
+options). Every case times a callable `repeat` times, after one untimed
+warm-up call, and reports the per-call time in milliseconds (min / median /
+max). Cases:
+
+    render.small / render.large     _render_with_template (compiled-template cache warm)
+    render.large.cold               the same with the template cache cleared first
+    flow.compile[nodes=N]           compile_flow on a generated flow (flowgen), schedule included
+    flow.schedule[nodes=N]          compute_schedule on its IR
+    flow.execute[nodes=N]           execute_flow_task (plan load, stored schedule, ScheduledSend rows)
+    send.single / send.list[...]    send_mail_task end to end with the locmem email backend
+    scheduler.due[plans=N]          schedule_due_mailplans claiming N due plans
+    serializer.list[plans=N]        MailPlanSerializer(many=True) over N plans
+
+The cases run on whatever database is configured (SQLite with DB_ENGINE=sqlite,
+or a local Postgres), inside one transaction that is rolled back at the end, so
+the fixture rows never persist. Nothing is published to the broker:
+enqueue_sends and the after_1_day flow publisher are replaced by counters, and
+the send rate limiter is bypassed, so runs are offline and repeatable.
+
+Results are a JSON-serializable dict; compare() checks them against a stored
+baseline (a previous result file, by default the committed
+mailplans/benchmark_baseline.json of a full SQLite run) and reports every case
+slower than the baseline median by more than the tolerance as a regression.
+"""
+
+import platform
+import statistics
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from unittest import mock
+
+import django
+from django.core import mail
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from . import async_delivery, smtp_pool, tasks
+from .flow import compile_flow, compute_schedule
+from .flowgen import generate_flow
+from .models import EmailLog, MailPlan, ScheduledSend
+from .rate_limit import _NoLimit
+from .serializers import MailPlanSerializer
+from .template_cache import template_cache
+
+RESULT_FORMAT = 1
+FIXTURE_PREFIX = "bench-"
+
+DEFAULT_FLOW_SIZES = (10, 100, 1000, 10000)
+DEFAULT_SCHEDULER_PLANS = 100000
+DEFAULT_SERIALIZER_PLANS = 500
+DEFAULT_LIST_RECIPIENTS = 25
+
+BENCHMARKS = {}  # name -> function(runner) -> None
+
+
+def benchmark(name):
+    """Register a benchmark group under `name` (used by --only)."""
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+class BenchmarkRunner:
+    def __init__(self, repeat=5, flow_sizes=DEFAULT_FLOW_SIZES, scheduler_plans=DEFAULT_SCHEDULER_PLANS,
+                 serializer_plans=DEFAULT_SERIALIZER_PLANS, list_recipients=DEFAULT_LIST_RECIPIENTS, log=None):
+        self.repeat = max(1, int(repeat))
+        self.flow_sizes = tuple(flow_sizes)
+        self.scheduler_plans = int(scheduler_plans)
+        self.serializer_plans = int(serializer_plans)
+        self.list_recipients = int(list_recipients)
+        self.log = log or (lambda message: None)
+        self.results = {}
+        self.published = 0
+
+    def measure(self, name, fn, setup=None, number=1, **params):
+        """
+        Time fn() `number` times per repeat; setup() runs untimed before each
+        repeat. Stores and returns the result entry for `name`.
+        """
+        if setup:
+            setup()
+        fn()  # warm-up
+        timings = []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            for _ in range(number):
+                fn()
+            timings.append((time.perf_counter() - started) * 1000 / number)
+        median = statistics.median(timings)
+        entry = {
+            "median_ms": round(median, 4),
+            "min_ms": round(min(timings), 4),
+            "max_ms": round(max(timings), 4),
+            "repeat": self.repeat,
+            "number": number,
+            "per_second": round(1000 / median, 1) if median else None,
+            **params,
+        }
+        self.results[name] = entry
+        self.log(f"{name:<36} {entry['median_ms']:>12.3f} ms  (min {entry['min_ms']:.3f}, max {entry['max_ms']:.3f})")
+        return entry
+
+    def _count_published(self, pairs, *args, **kwargs):
+        self.published += len(pairs)
+        return len(pairs)
+
+    def run(self, only=None):
+        """Run the selected benchmark groups (all by default) and return the result document."""
+        selected = [name for name in BENCHMARKS if not only or any(name.startswith(o) for o in only)]
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(tasks, "enqueue_sends", side_effect=self._count_published))
+            stack.enter_context(mock.patch.object(
+                tasks, "_publish_flow_executions", side_effect=lambda ids: self._count_published(ids)
+            ))
+            stack.enter_context(mock.patch.object(tasks, "get_limiter", return_value=_NoLimit()))
+            with transaction.atomic():
+                try:
+                    for name in selected:
+                        BENCHMARKS[name](self)
+                finally:
+                    # fixtures never outlive the run
+                    transaction.set_rollback(True)
+        return {
+            "format": RESULT_FORMAT,
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "machine": platform.machine(),
+                "repeat": self.repeat,
+                "groups": selected,
+                "seconds": round(time.perf_counter() - started, 2),
+            },
+            "results": self.results,
+        }
+
+
+def _create_plans(count, **fields):
+    """bulk_create `count` fixture plans (flow_ir is compiled here because bulk_create skips save())."""
+    flow = fields.pop("flow", {})
+    ir = compile_flow(flow)
+    plans = [
+        MailPlan(name=f"{FIXTURE_PREFIX}{i}", flow=flow, flow_ir=ir, **fields)
+        for i in range(count)
+    ]
+    MailPlan.objects.bulk_create(plans, batch_size=2000)
+    return MailPlan.objects.filter(name__startswith=FIXTURE_PREFIX)
+
+
+def _delete_fixtures():
+    ScheduledSend.objects.filter(mailplan__name__startswith=FIXTURE_PREFIX).delete()
+    EmailLog.objects.filter(mailplan__name__startswith=FIXTURE_PREFIX).delete()
+    MailPlan.objects.filter(name__startswith=FIXTURE_PREFIX).delete()
+
+
+SMALL_TEMPLATE = "Hi {{ name }}, your {{ plan }} trial ends on {{ date }}."
+LARGE_TEMPLATE = (
+    "<h1>{{ title }}</h1>"
+    + "".join(
+        f"<section><h2>Section {i} for {{{{ name }}}}</h2>"
+        "<p>{% if plan %}Plan: {{ plan|upper }}{% else %}No plan{% endif %} - {{ date }}</p>"
+        "<ul>{% for item in items %}<li>{{ forloop.counter }}. {{ item }}</li>{% endfor %}</ul></section>"
+        for i in range(200)
+    )
+)
+TEMPLATE_VARS = {
+    "name": "Ada", "plan": "pro", "date": "2026-01-31", "title": "Your weekly digest",
+    "items": [f"item {i}" for i in range(10)],
+}
+
+
+@benchmark("render")
+def bench_render(runner):
+    render = tasks._render_with_template
+    runner.measure("render.small", lambda: render(SMALL_TEMPLATE, TEMPLATE_VARS), number=200,
+                   template_bytes=len(SMALL_TEMPLATE))
+    runner.measure("render.large", lambda: render(LARGE_TEMPLATE, TEMPLATE_VARS), number=5,
+                   template_bytes=len(LARGE_TEMPLATE))
+
+    def cold():
+        template_cache.clear()
+        render(LARGE_TEMPLATE, TEMPLATE_VARS)
+
+    runner.measure("render.large.cold", cold, number=2, template_bytes=len(LARGE_TEMPLATE))
+
+
+@benchmark("flow")
+def bench_flow(runner):
+    for size in runner.flow_sizes:
+        flow = generate_flow(size, seed=size)
+        ir = compile_flow(flow)
+        edges = len(flow["edges"])
+        runner.measure(f"flow.compile[nodes={size}]", lambda: compile_flow(flow), nodes=size, edges=edges)
+        runner.measure(f"flow.schedule[nodes={size}]", lambda: compute_schedule(ir), nodes=size, edges=edges)
+
+        mp = MailPlan.objects.create(
+            name=f"{FIXTURE_PREFIX}flow-{size}", subject="s", content="c", flow=flow, trigger_type="button_click",
+        )
+        runner.measure(
+            f"flow.execute[nodes={size}]",
+            lambda: tasks.execute_flow_task(mp.id, run_id="bench"),
+            setup=lambda: ScheduledSend.objects.filter(mailplan=mp).delete(),
+            nodes=size, edges=edges,
+        )
+    _delete_fixtures()
+
+
+@benchmark("send")
+def bench_send(runner):
+    overrides = {
+        "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+        "MAILPLAN_DELIVERY_ENGINE": "threads",
+    }
+    recipients = ", ".join(f"user{i}@bench.example" for i in range(runner.list_recipients))
+    with override_settings(**overrides):
+        smtp_pool.reset_pool()
+        async_delivery.reset_engine()
+        try:
+            single = MailPlan.objects.create(
+                name=f"{FIXTURE_PREFIX}send-single", subject="Hi {{ name }}", content="<p>Hello {{ name }}</p>",
+                recipient_email="one@bench.example", template_vars={"name": "Ada"}, trigger_type="button_click",
+            )
+            many = MailPlan.objects.create(
+                name=f"{FIXTURE_PREFIX}send-list", subject="Hi {{ name }}", content="<p>Hello {{ name }}</p>",
+                recipient_email=recipients, template_vars={"name": "Ada"}, trigger_type="button_click",
+            )
+
+            def clear_outbox():
+                mail.outbox = []
+
+            # a fresh run id per call: every send is new work, not an idempotent duplicate
+            runner.measure("send.single", lambda: tasks.send_mail_task(single.id),
+                           setup=clear_outbox, number=20)
+            runner.measure(f"send.list[recipients={runner.list_recipients}]",
+                           lambda: tasks.send_mail_task(many.id),
+                           setup=clear_outbox, number=2, recipients=runner.list_recipients)
+        finally:
+            mail.outbox = []
+            smtp_pool.reset_pool()
+            async_delivery.reset_engine()
+    _delete_fixtures()
+
+
+@benchmark("scheduler")
+def bench_scheduler(runner):
+    count = runner.scheduler_plans
+    due_at = timezone.now() - timedelta(minutes=5)
+    plans = _create_plans(count, status="scheduled", scheduled_time=due_at, trigger_type="button_click",
+                          subject="s", content="c", recipient_email="due@bench.example")
+
+    def reset():
+        plans.update(last_triggered_at=None)
+
+    with override_settings(MAILPLAN_SCHEDULER_MAX_PER_TICK=count):
+        entry = runner.measure(f"scheduler.due[plans={count}]", tasks.schedule_due_mailplans, setup=reset, plans=count)
+    entry["plans_per_second"] = round(count * 1000 / entry["median_ms"], 1) if entry["median_ms"] else None
+    _delete_fixtures()
+
+
+@benchmark("serializer")
+def bench_serializer(runner):
+    count = runner.serializer_plans
+    _create_plans(count, subject="Hi {{ name }}", content="<p>Hello</p>", trigger_type="button_click",
+                  flow=generate_flow(10, seed=1))
+    queryset = MailPlan.objects.filter(name__startswith=FIXTURE_PREFIX).order_by("id")
+    runner.measure(
+        f"serializer.list[plans={count}]",
+        lambda: MailPlanSerializer(queryset.all(), many=True).data,
+        plans=count,
+    )
+    _delete_fixtures()
+
+
+def compare(current, baseline, tolerance=0.25):
+    """
+    Compare two result documents case by case (median per call).
+    Returns a list of dicts {name, baseline_ms, current_ms, ratio, status} with
+    status "regression", "faster", "ok" or "new" (not in the baseline).
+    """
+    base_results = (baseline or {}).get("results", {})
+    rows = []
+    for name, entry in current.get("results", {}).items():
+        base = base_results.get(name)
+        if not base or not base.get("median_ms"):
+            rows.append({"name": name, "baseline_ms": None, "current_ms": entry["median_ms"],
+                         "ratio": None, "status": "new"})
+            continue
+        ratio = entry["median_ms"] / base["median_ms"]
+        if ratio > 1 + tolerance:
+            status = "regression"
+        elif ratio < 1 - tolerance:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append({"name": name, "baseline_ms": base["median_ms"], "current_ms": entry["median_ms"],
+                     "ratio": round(ratio, 3), "status": status})
+    return rows
@@ -0,0 +1,502 @@
+# backend/mailplans/flow.py
+"""
+Flow compilation: turn the visual-builder flow JSON ({nodes: [], edges: []})
+into a compact intermediate representation (IR) once, when a MailPlan is saved.
+
+The IR is stored in MailPlan.flow_ir and contains everything the send path,
+the flow executor, the trigger view and the serializer used to recompute by
+walking the raw JSON on every call:
+
+    {
+        "format": 3,                       # IR format version
+        "hash": "<sha1 of the canonical flow JSON>",
+        "node_count": 12,
+        "index": {"<node id>": <position in flow["nodes"]>},
+        "adjacency": {"<source id>": ["<target id>", ...]},
+        "start": "<start node id>" | None,
+        "email_nodes": ["<node id>", ...],  # in flow order
+        "first_email_pos": <position in flow["nodes"]> | None,  # the node may have no id
+        "delays": {"<node id>": <seconds>}, # delay offset added by each delay node
+        "has_delay": bool,
+        "recipient": "<first recipient found in an email node>" | None,
+        "schedule": {                      # compute_schedule(), done once at compile time
+            "offsets": {"<email node id>": [<seconds after the trigger>, ...]},
+            "cycle_nodes": [...], "nodes": <reachable>, "edges": <relaxed>,
+        },
+    }
+
+Use FlowIR.for_plan(mp) to get O(1) node lookups backed by the stored IR (it
+recompiles transparently when the stored IR is missing or out of date).
+
+compile_flow() is lenient (bad nodes are skipped, bad durations count as 0)
+so that any stored flow can still be executed. validate_flow() is the strict
+variant used by MailPlanSerializer: it rejects cycles, dangling edges,
+unreachable email nodes, invalid delays and flows over the size limits,
+listing every problem in a FlowValidationError.
+"""
+
+import hashlib
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+FLOW_IR_FORMAT = 3
+
+DELAY_NODE_TYPES = ("delay", "wait", "delay_node")
+DELAY_DATA_KEYS = ("duration", "delay_minutes", "delay_seconds", "delay_hours", "unit")
+
+# delay units (and accepted spellings) normalized to seconds
+UNIT_SECONDS = {"seconds": 1, "minutes": 60, "hours": 3600, "days": 86400, "weeks": 604800}
+UNIT_ALIASES = {
+    "s": "seconds", "sec": "seconds", "secs": "seconds", "second": "seconds",
+    "min": "minutes", "mins": "minutes", "minute": "minutes",
+    "h": "hours", "hr": "hours", "hrs": "hours", "hour": "hours",
+    "d": "days", "day": "days",
+    "w": "weeks", "week": "weeks",
+}
+
+
+class FlowValidationError(ValueError):
+    """A flow failed validate_flow(); `errors` lists every problem found."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("; ".join(self.errors))
+
+
+def parse_flow(flow_value):
+    """Return the flow as a dict (accepts dict, JSON string or empty values)."""
+    if not flow_value:
+        return {}
+    flow = flow_value
+    if isinstance(flow_value, str):
+        try:
+            flow = json.loads(flow_value or "{}")
+        except Exception:
+            flow = {}
+    return flow if isinstance(flow, dict) else {}
+
+
+def flow_hash(flow):
+    """Stable content hash of a flow dict."""
+    canonical = json.dumps(flow or {}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def _node_data(node):
+    data = node.get("data") or {}
+    return data if isinstance(data, dict) else {}
+
+
+def is_email_node(node):
+    data = _node_data(node)
+    return node.get("type") == "email" or bool(data.get("recipient_email") or data.get("recipient"))
+
+
+def is_delay_node(node):
+    """Nodes that add a delay during flow execution."""
+    data = _node_data(node)
+    return node.get("type") == "delay" or "duration" in data or "unit" in data
+
+
+def looks_like_delay(node):
+    """Broader check used to decide whether a manual trigger should run the flow executor."""
+    ntype = (node.get("type") or "").lower()
+    if ntype in DELAY_NODE_TYPES:
+        return True
+    data = _node_data(node)
+    return any(k in data for k in DELAY_DATA_KEYS)
+
+
+def unit_seconds(unit):
+    """Seconds per `unit` (name or alias, case-insensitive), or None for unknown units."""
+    unit = str(unit or "").strip().lower()
+    return UNIT_SECONDS.get(UNIT_ALIASES.get(unit, unit))
+
+
+def parse_delay(duration, unit):
+    """
+    Strict conversion of a delay to whole seconds. Raises ValueError for
+    unknown units and for durations that are not finite, non-negative numbers
+    (numeric strings such as "2" or "1.5" are accepted).
+    """
+    factor = unit_seconds(unit)
+    if factor is None:
+        raise ValueError(f"unknown delay unit {unit!r} (expected one of {', '.join(UNIT_SECONDS)})")
+    if isinstance(duration, bool) or duration is None or duration == "":
+        raise ValueError(f"delay duration {duration!r} is not a number")
+    try:
+        value = float(duration)
+    except (TypeError, ValueError):
+        raise ValueError(f"delay duration {duration!r} is not a number")
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"delay duration {duration!r} must be a non-negative number")
+    return int(round(value * factor))
+
+
+def duration_seconds(duration, unit):
+    """Lenient parse_delay(): unknown units count as seconds, invalid durations as 0."""
+    if not duration:
+        return 0
+    if unit_seconds(unit) is None:
+        unit = "seconds"
+    try:
+        return parse_delay(duration, unit)
+    except ValueError:
+        return 0
+
+
+def delay_seconds(node):
+    data = _node_data(node)
+    return duration_seconds(data.get("duration") or 0, data.get("unit") or "hours")
+
+
+def compile_flow(flow_value):
+    """
+    Compile a flow (dict or JSON string) into the IR described in the module
+    docstring. Never raises for malformed input; invalid nodes/edges are skipped.
+    """
+    flow = parse_flow(flow_value)
+    nodes = flow.get("nodes", []) or []
+    edges = flow.get("edges", []) or []
+    if not isinstance(nodes, list):
+        nodes = []
+    if not isinstance(edges, list):
+        edges = []
+
+    index = {}
+    adjacency = {}
+    email_nodes = []
+    delays = {}
+    start = None
+    trigger = None
+    first_email_pos = None
+    recipient = None
+    has_delay = False
+
+    for pos, node in enumerate(nodes):
+        if not isinstance(node, dict):
+            continue
+        node_id = node.get("id")
+        key = str(node_id) if node_id is not None else None
+        if key is not None and key not in index:
+            index[key] = pos
+
+        if start is None and (node.get("type") == "start" or node_id == "start"):
+            start = key
+        if trigger is None and node.get("type") == "trigger":
+            trigger = key
+
+        if not has_delay and looks_like_delay(node):
+            has_delay = True
+        if key is not None and is_delay_node(node):
+            delays[key] = delay_seconds(node)
+
+        if is_email_node(node):
+            if first_email_pos is None:
+                first_email_pos = pos
+            if key is not None:
+                email_nodes.append(key)
+            if recipient is None:
+                data = _node_data(node)
+                recipient = data.get("recipient_email") or data.get("recipient") or None
+
+    for edge in edges:
+        if not isinstance(edge, dict):
+            continue
+        src = edge.get("source")
+        tgt = edge.get("target")
+        if not src or not tgt:
+            continue
+        adjacency.setdefault(str(src), []).append(str(tgt))
+
+    ir = {
+        "format": FLOW_IR_FORMAT,
+        "hash": flow_hash(flow),
+        "node_count": len(nodes),
+        "index": index,
+        "adjacency": adjacency,
+        "start": start or trigger,
+        "email_nodes": email_nodes,
+        "first_email_pos": first_email_pos,
+        "delays": delays,
+        "has_delay": has_delay,
+        "recipient": recipient,
+    }
+    # stored with the IR so execute_flow_task does not traverse the graph on every trigger
+    ir["schedule"] = compute_schedule(ir)
+    return ir
+
+
+def validate_flow(flow_value, max_nodes=None, max_edges=None, max_delay=None):
+    """
+    Strictly check a flow and compile it. Returns the IR (see compile_flow);
+    raises FlowValidationError listing every problem:
+
+      - malformed JSON, nodes/edges that are not lists of objects
+      - more than `max_nodes` nodes / `max_edges` edges
+      - missing or duplicate node ids, more than one start node
+      - edges without source/target or pointing at unknown nodes
+      - delay nodes with a non-numeric or negative duration, an unknown unit,
+        or a delay longer than `max_delay` seconds
+      - edges without a start (or trigger) node to run them from
+      - cycles, and email nodes that cannot be reached from the start node
+    """
+    if isinstance(flow_value, str) and flow_value.strip():
+        try:
+            json.loads(flow_value)
+        except ValueError:
+            raise FlowValidationError(["Flow is not valid JSON."])
+    if flow_value and not isinstance(flow_value, (dict, str)):
+        raise FlowValidationError(["Flow must be an object with 'nodes' and 'edges' lists."])
+    flow = parse_flow(flow_value)
+    nodes = flow.get("nodes")
+    edges = flow.get("edges")
+    nodes = [] if nodes is None else nodes
+    edges = [] if edges is None else edges
+    if not isinstance(nodes, list) or not isinstance(edges, list):
+        raise FlowValidationError(["Flow 'nodes' and 'edges' must be lists."])
+    if max_nodes and len(nodes) > max_nodes:
+        raise FlowValidationError([f"Flow has {len(nodes)} nodes; at most {max_nodes} are allowed."])
+    if max_edges and len(edges) > max_edges:
+        raise FlowValidationError([f"Flow has {len(edges)} edges; at most {max_edges} are allowed."])
+
+    errors = []
+    node_ids = set()
+    starts = []
+    for pos, node in enumerate(nodes):
+        if not isinstance(node, dict):
+            errors.append(f"Node #{pos} is not an object.")
+            continue
+        node_id = node.get("id")
+        if node_id is None or str(node_id) == "":
+            errors.append(f"Node #{pos} has no id.")
+            continue
+        key = str(node_id)
+        if key in node_ids:
+            errors.append(f"Duplicate node id {key!r}.")
+        node_ids.add(key)
+        if node.get("type") == "start" or node_id == "start":
+            starts.append(key)
+        if is_delay_node(node):
+            data = _node_data(node)
+            try:
+                seconds = parse_delay(data.get("duration"), data.get("unit") or "hours")
+            except ValueError as exc:
+                errors.append(f"Delay node {key!r}: {exc}.")
+            else:
+                if max_delay and seconds > max_delay:
+                    errors.append(f"Delay node {key!r}: delay of {seconds}s exceeds the maximum of {max_delay}s.")
+    if len(starts) > 1:
+        errors.append(f"Flow has more than one start node: {', '.join(starts)}.")
+
+    for pos, edge in enumerate(edges):
+        if not isinstance(edge, dict):
+            errors.append(f"Edge #{pos} is not an object.")
+            continue
+        src, tgt = edge.get("source"), edge.get("target")
+        label = edge.get("id") or f"#{pos}"
+        if not src or not tgt:
+            errors.append(f"Edge {label} needs both a source and a target.")
+            continue
+        dangling = [str(end) for end in (src, tgt) if str(end) not in node_ids]
+        if dangling:
+            errors.append(f"Edge {label} references unknown node(s): {', '.join(dangling)}.")
+    if errors:
+        raise FlowValidationError(errors)
+
+    ir = compile_flow(flow)
+    schedule = ir["schedule"]
+    if ir["start"] is None:
+        if edges:
+            errors.append("Flow has edges but no start or trigger node.")
+    else:
+        if schedule["cycle_nodes"]:
+            errors.append(f"Flow contains a cycle through node(s): {', '.join(schedule['cycle_nodes'])}.")
+        cyclic = set(schedule["cycle_nodes"])
+        unreachable = [n for n in ir["email_nodes"] if n not in schedule["offsets"] and n not in cyclic]
+        if unreachable:
+            errors.append(f"Email node(s) not reachable from the start node: {', '.join(unreachable)}.")
+    if errors:
+        raise FlowValidationError(errors)
+    return ir
+
+
+def compute_schedule(ir):
+    """
+    Compute, for every email node reachable from the start node, the set of
+    distinct arrival offsets (seconds after the trigger) along all paths.
+
+    This is a topological (Kahn) pass over the reachable subgraph: each edge
+    is relaxed once and carries the set of distinct offsets of its source, so
+    converging delay branches (diamonds) cost O(edges x distinct offsets)
+    instead of one visit per path. A delay node adds its delay to everything
+    leaving it (and to its own send when it is also an email node).
+
+    Nodes on a cycle - or only reachable through one - cannot be ordered and
+    are reported in "cycle_nodes" instead of being scheduled.
+
+    Returns {"offsets": {node_id: [seconds, ...]}, "cycle_nodes": [...],
+             "nodes": <reachable nodes>, "edges": <edges relaxed>}.
+    """
+    index = ir.get("index") or {}
+    adjacency = ir.get("adjacency") or {}
+    delays = ir.get("delays") or {}
+    email_nodes = set(ir.get("email_nodes") or [])
+    start = ir.get("start")
+
+    result = {"offsets": {}, "cycle_nodes": [], "nodes": 0, "edges": 0}
+    if start is None or start not in index:
+        return result
+
+    # 1. reachable subgraph + in-degrees restricted to it
+    indegree = {start: 0}
+    order = [start]
+    back_to_start = False
+    for node_id in order:  # `order` grows while iterating (BFS)
+        for tgt in adjacency.get(node_id, ()):
+            if tgt not in index:
+                continue
+            if tgt == start:
+                # an edge back into the start node always closes a cycle
+                back_to_start = True
+                continue
+            if tgt not in indegree:
+                indegree[tgt] = 0
+                order.append(tgt)
+            indegree[tgt] += 1
+    result["nodes"] = len(order)
+
+    # 2. Kahn's algorithm propagating distinct arrival offsets
+    arrivals = {start: {0}}
+    queue = [start]
+    processed = 0
+    edges = 0
+    for node_id in queue:  # `queue` grows while iterating
+        processed += 1
+        delay = delays.get(node_id, 0)
+        departures = {offset + delay for offset in arrivals.get(node_id, ())}
+        if node_id in email_nodes and departures:
+            result["offsets"][node_id] = sorted(departures)
+        for tgt in adjacency.get(node_id, ()):
+            if tgt not in indegree or tgt == start:
+                continue
+            edges += 1
+            arrivals.setdefault(tgt, set()).update(departures)
+            indegree[tgt] -= 1
+            if indegree[tgt] == 0:
+                queue.append(tgt)
+        arrivals.pop(node_id, None)
+    result["edges"] = edges
+
+    cycle_nodes = [start] if back_to_start else []
+    if processed < len(order):
+        cycle_nodes += [n for n in order if indegree.get(n, 0) > 0]
+    result["cycle_nodes"] = cycle_nodes
+    return result
+
+
+class FlowIR:
+    """
+    Read-only accessor over a flow and its compiled IR.
+
+    Node lookups go through the IR index (O(1)). A stored IR is only used
+    when its hash matches the flow, so a stale IR (e.g. a flow changed with
+    QuerySet.update() or a bulk import) is recompiled instead of serving old
+    edges, delays or schedule; each lookup also double-checks the id at the
+    indexed position.
+    """
+
+    def __init__(self, flow, ir=None):
+        self.flow = parse_flow(flow)
+        self._nodes = self.flow.get("nodes", []) or []
+        if not isinstance(self._nodes, list):
+            self._nodes = []
+        if not self._ir_usable(ir):
+            ir = compile_flow(self.flow)
+        self.ir = ir
+
+    @classmethod
+    def for_plan(cls, mp):
+        return cls(getattr(mp, "flow", None), getattr(mp, "flow_ir", None))
+
+    def _ir_usable(self, ir):
+        return (
+            isinstance(ir, dict)
+            and ir.get("format") == FLOW_IR_FORMAT
+            and ir.get("node_count") == len(self._nodes)
+            and ir.get("hash") == flow_hash(self.flow)
+        )
+
+    def _recompile(self):
+        logger.info("Stored flow IR is stale; recompiling.")
+        self.ir = compile_flow(self.flow)
+
+    def node(self, node_id):
+        """Return the node dict with the given id, or None."""
+        if node_id is None:
+            return None
+        key = str(node_id)
+        for attempt in range(2):
+            pos = self.ir["index"].get(key)
+            if pos is None:
+                return None
+            try:
+                node = self._nodes[pos]
+            except IndexError:
+                node = None
+            if isinstance(node, dict) and str(node.get("id")) == key:
+                return node
+            if attempt == 0:
+                self._recompile()
+        return None
+
+    def node_data(self, node_id):
+        node = self.node(node_id)
+        return _node_data(node) if node else {}
+
+    def first_email_node(self):
+        """The first email node in flow order, with or without an id."""
+        pos = self.ir.get("first_email_pos")
+        if pos is None or not 0 <= pos < len(self._nodes):
+            return None
+        node = self._nodes[pos]
+        return node if isinstance(node, dict) and is_email_node(node) else None
+
+    @property
+    def start(self):
+        return self.ir.get("start")
+
+    @property
+    def adjacency(self):
+        return self.ir.get("adjacency") or {}
+
+    @property
+    def email_nodes(self):
+        return self.ir.get("email_nodes") or []
+
+    @property
+    def delays(self):
+        return self.ir.get("delays") or {}
+
+    @property
+    def has_delay(self):
+        return bool(self.ir.get("has_delay"))
+
+    @property
+    def recipient(self):
+        return self.ir.get("recipient")
+
+    @property
+    def schedule(self):
+        """Send offsets per email node (see compute_schedule), precomputed at compile time."""
+        schedule = self.ir.get("schedule")
+        if not isinstance(schedule, dict):
+            schedule = compute_schedule(self.ir)
+        return schedule
+
+    @property
+    def version(self):
+        return self.ir.get("hash")
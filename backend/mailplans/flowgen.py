@@ -0,0 +1,133 @@
+# backend/mailplans/flowgen.py
+"""
+Deterministic generator of synthetic visual-builder flows, for benchmarks
+and load generation.
+
+generate_flow(n) (benchmarks) returns a {nodes, edges} flow of exactly n
+nodes shaped like what the builder produces, laid out in layers:
+
+    start -> layer 1 -> layer 2 -> ... (every `delay_every`-th layer is delays)
+
+Each node gets an edge from one random node of the previous layer, and about
+half of them from a second one, so branches converge (diamonds) the way real
+flows do. Every path to a node crosses the same delay layers (all delays of a
+layer have the same duration), so each email node has one send offset and the number of scheduled sends stays
+proportional to n even for 10k-node flows. The same seed always gives the
+same flow.
+
+generate_tree_flow(depth, fanout, delay_ratio) (generate_load) builds a tree
+of a given depth and fan-out with a random mix of delay and email nodes.
+"""
+
+import random
+
+DEFAULT_SUBJECT = "Step {step} for {{{{ name }}}}"
+DEFAULT_BODY = (
+    "<p>Hello {{{{ name }}}},</p>"
+    "<p>This is step {step} of your onboarding. {{% if plan %}}You are on the {{{{ plan }}}} plan.{{% endif %}}</p>"
+    "<p>See you soon!</p>"
+)
+
+
+def generate_flow(node_count, width=4, delay_every=3, seed=0, recipient="bench@example.com",
+                  delay_unit="hours", second_parent=0.5):
+    """
+    Build a flow of `node_count` nodes (including the start node).
+
+    width          nodes per layer
+    delay_every    every n-th layer consists of delay nodes (0 = no delays)
+    recipient      recipient_email of the email nodes
+    second_parent  probability that a node also gets an edge from a second
+                   node of the previous layer
+    """
+    rng = random.Random(seed)
+    node_count = max(1, int(node_count))
+    width = max(1, int(width))
+
+    nodes = [{"id": "start", "type": "start", "position": {"x": 0, "y": 0}, "data": {"label": "Start"}}]
+    edges = []
+    previous = ["start"]
+    layer = 0
+    while len(nodes) < node_count:
+        layer += 1
+        is_delay = bool(delay_every) and layer % delay_every == 0
+        # one duration per delay layer keeps a single arrival offset per node
+        duration = 1 + rng.randrange(3)
+        current = []
+        for column in range(min(width, node_count - len(nodes))):
+            node_id = f"n{len(nodes)}"
+            step = f"{layer}.{column}"
+            if is_delay:
+                node = {"id": node_id, "type": "delay", "data": {"duration": duration, "unit": delay_unit}}
+            else:
+                node = {
+                    "id": node_id,
+                    "type": "email",
+                    "data": {
+                        "recipient_email": recipient,
+                        "subject": DEFAULT_SUBJECT.format(step=step),
+                        "body": DEFAULT_BODY.format(step=step),
+                    },
+                }
+            node["position"] = {"x": column * 220, "y": layer * 140}
+            nodes.append(node)
+            current.append(node_id)
+
+        for node_id in current:
+            parents = 2 if len(previous) > 1 and rng.random() < second_parent else 1
+            for source in rng.sample(previous, parents):
+                edges.append({"id": f"e{len(edges)}", "source": source, "target": node_id})
+        previous = current
+
+    return {"nodes": nodes, "edges": edges}
+
+
+def generate_tree_flow(depth, fanout, delay_ratio=0.3, max_nodes=None, rng=None, recipient="load@example.com",
+                       subject=DEFAULT_SUBJECT.format(step="{step}"), body=None):
+    """
+    Build a tree-shaped flow: the start node, then `depth` levels below it
+    where every node has `fanout` children (capped at `max_nodes` nodes in
+    total, breadth first). Each non-start node is a delay node with
+    probability `delay_ratio`, else an email node. Every node has a single
+    path from start, so each email node has one send offset.
+
+    `subject` / `body` may contain "{step}", replaced by the node's position.
+    Pass a random.Random as `rng` to draw from a shared seeded sequence.
+    """
+    rng = rng or random.Random(0)
+    body = body if body is not None else DEFAULT_BODY.format(step="{step}")
+    fanout = max(1, int(fanout))
+
+    nodes = [{"id": "start", "type": "start", "position": {"x": 0, "y": 0}, "data": {"label": "Start"}}]
+    edges = []
+    level = ["start"]
+    for depth_index in range(1, max(0, int(depth)) + 1):
+        children = []
+        for parent in level:
+            for _ in range(fanout):
+                if max_nodes and len(nodes) >= max_nodes:
+                    break
+                node_id = f"n{len(nodes)}"
+                step = f"{depth_index}.{len(children)}"
+                if rng.random() < delay_ratio:
+                    data = {"duration": 1 + rng.randrange(48), "unit": rng.choice(("minutes", "hours", "days"))}
+                    node = {"id": node_id, "type": "delay", "data": data}
+                else:
+                    node = {
+                        "id": node_id,
+                        "type": "email",
+                        "data": {
+                            "recipient_email": recipient,
+                            "subject": subject.replace("{step}", step),
+                            "body": body.replace("{step}", step),
+                        },
+                    }
+                node["position"] = {"x": len(children) * 220, "y": depth_index * 140}
+                nodes.append(node)
+                edges.append({"id": f"e{len(edges)}", "source": parent, "target": node_id})
+                children.append(node_id)
+        if not children:
+            break
+        level = children
+
+    return {"nodes": nodes, "edges": edges}
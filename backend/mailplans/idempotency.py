@@ -0,0 +1,189 @@
+# backend/mailplans/idempotency.py
+"""
+Idempotency keys for email sends.
+
+Every send of one recipient address for one (plan, node, run) gets the key
+
+    sha1("<mailplan_id>:<node_id>:<run_id>:<recipient>")
+
+A run is one firing of a plan: a manual trigger (derived from the
+Idempotency-Key request header when one is sent), a scheduler tick, the
+after_1_day fire, or one execution of a flow. The run_id is passed along
+with the send tasks, their retries, rate-limit deferrals and delayed
+ScheduledSend rows. A redelivered or duplicated message therefore produces
+the same keys again.
+
+The send tasks check keys before they render or send anything:
+
+ 1. cache.get_many(keys). A hit means the key is in flight or already done.
+ 2. cache.add(key, "inflight", short TTL) claims each remaining key. The add
+    is atomic when the cache is Redis, so two workers cannot claim the same
+    key. With the default local-memory cache this only holds within one
+    process.
+ 3. EmailLog.idempotency_key (a unique column) is checked for the claimed
+    keys. This catches sends older than the cache TTL.
+
+After delivery, sent and permanently rejected keys are marked "done" for
+MAILPLAN_IDEMPOTENCY_TTL. send_mail_task does this, and writes the EmailLog
+rows, every MAILPLAN_SEND_LOG_CHUNK addresses, so an in-flight claim only
+has to outlive the delivery of one chunk, not of the whole task. Keys that failed transiently stay claimed: their
+EmailLog row is kept "pending" and the retry re-delivers that row, claiming
+one attempt of it with claim_attempts() so a duplicated retry message does
+not send it twice. Duplicates are counted per process (stats) and in the
+shared cache (duplicate_count()).
+"""
+
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "mailplan:idem:"
+COUNTER_KEY = "mailplan:idem:duplicates"
+INFLIGHT = "inflight"
+DONE = "done"
+
+
+def make_key(mailplan_id, node_id, run_id, recipient):
+    raw = f"{mailplan_id}:{node_id or ''}:{run_id or ''}:{(recipient or '').strip().lower()}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def new_run_id(kind="run"):
+    """A fresh run id (each call is a new, intended send)."""
+    return f"{kind}-{uuid.uuid4().hex}"
+
+
+def run_id_for(kind, *parts):
+    """A deterministic run id: the same inputs always name the same run."""
+    raw = ":".join(str(p) for p in parts)
+    return f"{kind}-{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:32]}"
+
+
+class IdempotencyStore:
+    def __init__(self, cache_alias="default", ttl=172800, inflight_ttl=900):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self.stats = {"claimed": 0, "duplicates_cache": 0, "duplicates_db": 0}
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _count_duplicates(self, count):
+        try:
+            self.cache.add(COUNTER_KEY, 0, None)
+            self.cache.incr(COUNTER_KEY, count)
+        except Exception:
+            logger.debug("Could not update the shared duplicate counter.", exc_info=True)
+
+    def claim(self, keys):
+        """
+        Claim send keys before rendering/sending.
+        Returns (claimed_keys, duplicate_keys); only claimed keys may be sent.
+        """
+        from .models import EmailLog
+
+        keys = [k for k in dict.fromkeys(keys) if k]
+        if not keys:
+            return [], set()
+        cache_keys = {KEY_PREFIX + k: k for k in keys}
+        duplicates = set()
+        claimed = []
+        try:
+            seen = self.cache.get_many(list(cache_keys))
+            duplicates.update(cache_keys[ck] for ck in seen)
+            for ck, k in cache_keys.items():
+                if k in duplicates:
+                    continue
+                if self.cache.add(ck, INFLIGHT, self.inflight_ttl):
+                    claimed.append(k)
+                else:
+                    duplicates.add(k)
+        except Exception:
+            # cache unavailable: fall back to the database check below
+            logger.warning("Idempotency cache unavailable; checking keys against the database only.", exc_info=True)
+            claimed = [k for k in keys if k not in duplicates]
+        cache_dups = len(duplicates)
+
+        if claimed:
+            done = set(
+                EmailLog.objects.filter(idempotency_key__in=claimed).values_list("idempotency_key", flat=True)
+            )
+            if done:
+                self.complete(done)
+                duplicates.update(done)
+                claimed = [k for k in claimed if k not in done]
+
+        self.stats["claimed"] += len(claimed)
+        self.stats["duplicates_cache"] += cache_dups
+        self.stats["duplicates_db"] += len(duplicates) - cache_dups
+        if duplicates:
+            self._count_duplicates(len(duplicates))
+        return claimed, duplicates
+
+    def claim_attempts(self, attempts):
+        """
+        Claim the next delivery attempt of logged sends awaiting a retry.
+        `attempts` maps key -> attempt number (EmailLog.attempts); two messages
+        retrying the same row see the same number and only one gets the key.
+        Returns the claimed keys (all of them if the cache is unavailable).
+        """
+        claimed = []
+        try:
+            for key, attempt in attempts.items():
+                if self.cache.add(f"{KEY_PREFIX}{key}:attempt:{attempt}", INFLIGHT, self.inflight_ttl):
+                    claimed.append(key)
+        except Exception:
+            logger.warning("Idempotency cache unavailable; resuming retries without an attempt claim.", exc_info=True)
+            return list(attempts)
+        duplicates = len(attempts) - len(claimed)
+        if duplicates:
+            self.stats["duplicates_cache"] += duplicates
+            self._count_duplicates(duplicates)
+        return claimed
+
+    def release_attempts(self, attempts):
+        """Give up attempt claims (e.g. a rate-limit deferral) so the re-published retry can take them."""
+        if not attempts:
+            return
+        try:
+            self.cache.delete_many([f"{KEY_PREFIX}{key}:attempt:{attempt}" for key, attempt in attempts.items()])
+        except Exception:
+            logger.debug("Could not release idempotency attempt claims.", exc_info=True)
+
+    def complete(self, keys):
+        """Mark keys as sent (or permanently failed): later sends with them are duplicates."""
+        if not keys:
+            return
+        try:
+            self.cache.set_many({KEY_PREFIX + k: DONE for k in keys}, self.ttl)
+        except Exception:
+            logger.debug("Could not mark idempotency keys as done.", exc_info=True)
+
+    def release(self, keys):
+        """Give up claims (transient failure or deferral) so a later attempt can claim them again."""
+        if not keys:
+            return
+        try:
+            self.cache.delete_many([KEY_PREFIX + k for k in keys])
+        except Exception:
+            logger.debug("Could not release idempotency keys.", exc_info=True)
+
+    def duplicate_count(self):
+        try:
+            return self.cache.get(COUNTER_KEY, 0)
+        except Exception:
+            return None
+
+
+idempotency = IdempotencyStore(
+    cache_alias=getattr(settings, "MAILPLAN_IDEMPOTENCY_CACHE", "default"),
+    ttl=getattr(settings, "MAILPLAN_IDEMPOTENCY_TTL", 172800),
+    inflight_ttl=getattr(settings, "MAILPLAN_IDEMPOTENCY_INFLIGHT_TTL", 900),
+)
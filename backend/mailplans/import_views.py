@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db import transaction
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .importer import can_resume, detect_format, store_upload
+from .models import ImportJob
+from .pagination import MailPlanCursorPagination
+from .serializers import ImportJobSerializer, ImportUploadSerializer
+from .tasks import import_mailplans_task
+
+
+class ImportJobViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Bulk MailPlan imports from CSV / NDJSON files (see mailplans/importer.py).
+
+    POST /api/imports/               multipart: file, format=csv|ndjson, chunk_size -> 202 + job
+    GET  /api/imports/{id}/          progress: committed/imported/failed rows, row errors
+    POST /api/imports/{id}/resume/   continue a failed (or stalled) job from its last committed chunk
+
+    The upload is streamed to MAILPLAN_IMPORT_DIR and imported by
+    import_mailplans_task on the planning queue.
+    """
+    queryset = ImportJob.objects.order_by('-created_at', '-id')
+    serializer_class = ImportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MailPlanCursorPagination
+
+    def create(self, request):
+        upload = ImportUploadSerializer(data=request.data)
+        upload.is_valid(raise_exception=True)
+        data = upload.validated_data
+        try:
+            fmt = detect_format(data['file'].name, data.get('format'))
+        except ValueError as exc:
+            raise ValidationError({'format': str(exc)})
+
+        path = store_upload(data['file'], fmt)
+        job = ImportJob.objects.create(
+            format=fmt,
+            filename=data['file'].name[:255],
+            source_path=path,
+            delete_source=True,
+            chunk_size=data.get('chunk_size') or getattr(settings, 'MAILPLAN_IMPORT_CHUNK_SIZE', 1000),
+            created_by=request.user if request.user.is_authenticated else None,
+        )
+        transaction.on_commit(lambda: import_mailplans_task.delay(job.id))
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        job = self.get_object()
+        if not can_resume(job):
+            detail = 'Import already finished.' if job.status == 'done' else 'Import is still running.'
+            return Response({'detail': detail}, status=status.HTTP_409_CONFLICT)
+        transaction.on_commit(lambda: import_mailplans_task.delay(job.id))
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
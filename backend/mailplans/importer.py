@@ -0,0 +1,302 @@
+# backend/mailplans/importer.py
+"""
+Streaming bulk import of MailPlans (with their recipient lists) from CSV or
+NDJSON files, for migrations from other tools.
+
+Input: one plan per CSV row / NDJSON line. Keys are MailPlanSerializer
+fields (name, subject, content, trigger_type, status, scheduled_time,
+recipient_email, recipient_name, send_queue, priority, template_vars, flow)
+plus `recipients`: a recipient list (NDJSON array, or a string separated by
+commas, semicolons or newlines) that becomes a start -> email flow sending
+to all of them. In CSV files, flow / template_vars are JSON strings and
+empty cells mean "not given". Unknown keys are ignored.
+
+run_import() reads the file as a stream (memory stays flat for any file
+size) and validates each row with MailPlanSerializer, so imported plans
+pass the same checks as POST /api/mailplans/, flow validation included.
+Invalid rows are collected in ImportJob.errors (with their row number) and
+skipped. Valid rows are inserted with bulk_create, ImportJob.chunk_size rows
+per transaction; the same transaction advances ImportJob.committed_rows and
+the counters, so:
+
+  - progress is visible on the job while it runs (GET /api/imports/<id>/)
+  - a run that dies (worker crash, deploy, DB error) is resumed from the
+    last committed chunk, without duplicating plans, by running the job
+    again (POST /api/imports/<id>/resume/ or `import_mailplans --resume`)
+
+Only one runner works on a job at a time: a run claims the job, and every
+chunk commit re-checks the claim and the restart point under a row lock.
+"""
+
+import csv
+import json
+import logging
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import ImportJob, MailPlan
+from .recipients import recipient_index
+from .serializers import MailPlanSerializer
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "ndjson")
+FORMAT_EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+JSON_FIELDS = ("flow", "template_vars")
+RECIPIENT_SEPARATORS = re.compile(r"[,;\n]")
+
+
+class RowError(ValueError):
+    """A row that cannot be imported; `errors` maps field names to messages."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(json.dumps(errors, default=str))
+
+
+class ImportConflict(RuntimeError):
+    """Another runner claimed the job (or moved its restart point) while this one ran."""
+
+
+def detect_format(filename, declared=None):
+    """'csv' or 'ndjson' from an explicit format or the file extension; raises ValueError."""
+    if declared:
+        declared = str(declared).lower()
+        if declared == "jsonl":
+            declared = "ndjson"
+        if declared not in FORMATS:
+            raise ValueError(f"Unknown import format {declared!r} (expected csv or ndjson).")
+        return declared
+    fmt = FORMAT_EXTENSIONS.get(os.path.splitext(filename or "")[1].lower())
+    if fmt is None:
+        raise ValueError("Cannot tell the import format from the file name; pass format=csv or format=ndjson.")
+    return fmt
+
+
+def import_dir():
+    return getattr(settings, "MAILPLAN_IMPORT_DIR", os.path.join(settings.BASE_DIR, "imports"))
+
+
+def store_upload(upload, fmt):
+    """Copy an uploaded file chunk by chunk into MAILPLAN_IMPORT_DIR; returns its path."""
+    directory = import_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4().hex}.{fmt}")
+    with open(path, "wb") as out:
+        for chunk in upload.chunks():
+            out.write(chunk)
+    return path
+
+
+def iter_rows(path, fmt):
+    """
+    Yield (row number, row) from the file, streaming. Row numbers are 1-based
+    data rows (CSV header and blank NDJSON lines are not counted), so they
+    are stable across runs. Unparseable NDJSON lines are yielded as RowError.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        if fmt == "csv":
+            for number, row in enumerate(csv.DictReader(fh), 1):
+                yield number, row
+            return
+        number = 0
+        for line in fh:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield number, RowError({"non_field_errors": [f"Invalid JSON: {exc}"]})
+                continue
+            if not isinstance(row, dict):
+                yield number, RowError({"non_field_errors": ["Each line must be a JSON object."]})
+                continue
+            yield number, row
+
+
+def _split_recipients(value):
+    if isinstance(value, (list, tuple)):
+        parts = value
+    else:
+        parts = RECIPIENT_SEPARATORS.split(str(value))
+    return [str(p).strip() for p in parts if str(p).strip()]
+
+
+def prepare_row(row, fmt):
+    """Turn a raw row into MailPlanSerializer input; raises RowError."""
+    data = {}
+    for key, value in row.items():
+        if key is None:
+            raise RowError({"non_field_errors": ["Row has more cells than the header."]})
+        key = key.strip()
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            continue
+        if fmt == "csv" and key in JSON_FIELDS:
+            try:
+                value = json.loads(value)
+            except ValueError as exc:
+                raise RowError({key: [f"Invalid JSON: {exc}"]})
+        data[key] = value
+
+    recipients = data.pop("recipients", None)
+    if recipients is not None:
+        addresses = _split_recipients(recipients)
+        if not addresses:
+            raise RowError({"recipients": ["Recipient list is empty."]})
+        if "flow" in data:
+            raise RowError({"recipients": ["Give either a flow or a recipient list, not both."]})
+        data["flow"] = {
+            "nodes": [
+                {"id": "start", "type": "start", "position": {"x": 0, "y": 0}, "data": {"label": "Start"}},
+                {"id": "email", "type": "email", "position": {"x": 0, "y": 140},
+                 "data": {"recipient_email": ", ".join(addresses)}},
+            ],
+            "edges": [{"id": "e-start-email", "source": "start", "target": "email"}],
+        }
+        data.setdefault("recipient_email", addresses[0])
+    return data
+
+
+def row_validator():
+    """
+    One MailPlanSerializer for a whole run: its fields are built once and
+    reused by run_validation() (building them is most of the per-row cost).
+    """
+    return MailPlanSerializer()
+
+
+def build_plan(row, fmt, validator=None):
+    """Validate a raw row like POST /api/mailplans/ does; returns an unsaved MailPlan or raises RowError."""
+    if isinstance(row, RowError):
+        raise row
+    validator = validator or row_validator()
+    try:
+        attrs = validator.run_validation(prepare_row(row, fmt))
+    except serializers.ValidationError as exc:
+        raise RowError(exc.detail)
+    # attrs carry the compiled flow_ir (bulk_create skips save())
+    return MailPlan(**attrs)
+
+
+def _is_stale(job):
+    stale_after = getattr(settings, "MAILPLAN_IMPORT_STALE_SECONDS", 300)
+    return job.updated_at is None or job.updated_at < timezone.now() - timedelta(seconds=stale_after)
+
+
+def can_resume(job):
+    """False for finished jobs and for jobs a live runner is still working on."""
+    if job.status == "done":
+        return False
+    return job.status != "running" or _is_stale(job)
+
+
+def claim(job_id, runner, force=False):
+    """
+    Mark the job as running for `runner`. Returns the job, or None when it is
+    finished or another runner is still active (unless `force`). A runner
+    may re-claim its own job: a redelivered task message has the same id.
+    """
+    with transaction.atomic():
+        job = ImportJob.objects.select_for_update().get(pk=job_id)
+        if job.status == "done":
+            return None
+        if job.status == "running" and job.runner != runner and not force and not _is_stale(job):
+            return None
+        job.status = "running"
+        job.runner = runner
+        job.started_at = job.started_at or timezone.now()
+        job.message = ""
+        job.save(update_fields=["status", "runner", "started_at", "message", "updated_at"])
+    return job
+
+
+def _commit_chunk(job, runner, first_row, last_row, plans, errors):
+    max_errors = getattr(settings, "MAILPLAN_IMPORT_MAX_ERRORS", 1000)
+    with transaction.atomic():
+        locked = ImportJob.objects.select_for_update().get(pk=job.pk)
+        if locked.runner != runner or locked.committed_rows != first_row:
+            raise ImportConflict(f"Import job {job.pk} was taken over by another run.")
+        created = MailPlan.objects.bulk_create(plans) if plans else []
+        # bulk_create skips the post_save recipient sync
+        recipient_index.sync([mp for mp in created if mp.pk is not None])
+        room = max(0, max_errors - len(locked.errors))
+        locked.errors = locked.errors + errors[:room]
+        locked.committed_rows = last_row
+        locked.imported_rows += len(plans)
+        locked.failed_rows += len(errors)
+        locked.save(update_fields=[
+            "errors", "committed_rows", "imported_rows", "failed_rows", "updated_at",
+        ])
+    return locked
+
+
+def _finish(job, runner, status, message):
+    ImportJob.objects.filter(pk=job.pk, runner=runner).update(
+        status=status, message=message, finished_at=timezone.now(), updated_at=timezone.now(),
+    )
+    job.refresh_from_db()
+    return job
+
+
+def run_import(job_id, runner=None, force=False, progress=None):
+    """
+    Import (or resume) the job's file. `progress(job)` is called after every
+    committed chunk. Returns the job, or None when it could not be claimed.
+    Failures mark the job 'failed' (resumable) and are re-raised.
+    """
+    runner = runner or uuid.uuid4().hex
+    job = claim(job_id, runner, force=force)
+    if job is None:
+        return None
+
+    chunk_size = max(1, job.chunk_size)
+    first_row = last_row = job.committed_rows
+    plans, errors = [], []
+    validator = row_validator()
+    try:
+        for number, row in iter_rows(job.source_path, job.format):
+            if number <= first_row:
+                continue  # committed by an earlier run
+            try:
+                plans.append(build_plan(row, job.format, validator))
+            except RowError as exc:
+                errors.append({"row": number, "errors": exc.errors})
+            last_row = number
+            if last_row - first_row >= chunk_size:
+                job = _commit_chunk(job, runner, first_row, last_row, plans, errors)
+                first_row, plans, errors = last_row, [], []
+                if progress:
+                    progress(job)
+        if last_row > first_row:
+            job = _commit_chunk(job, runner, first_row, last_row, plans, errors)
+            if progress:
+                progress(job)
+    except ImportConflict:
+        logger.warning("Import job %s: stopped, another run owns the job now.", job.pk)
+        raise
+    except Exception as exc:
+        logger.exception("Import job %s failed after row %s.", job.pk, job.committed_rows)
+        _finish(job, runner, "failed", f"Failed after row {job.committed_rows}: {exc}")
+        raise
+
+    job = _finish(
+        job, runner, "done",
+        f"Imported {job.imported_rows} plan(s); {job.failed_rows} row(s) rejected.",
+    )
+    if job.delete_source:
+        try:
+            os.remove(job.source_path)
+        except OSError:
+            logger.warning("Could not remove imported file %s.", job.source_path)
+    logger.info("Import job %s done: %s", job.pk, job.message)
+    return job
@@ -0,0 +1,217 @@
+# backend/mailplans/log_writer.py
+"""
+Write-behind buffer for EmailLog rows and MailPlan status changes.
+
+A single send used to cost an INSERT for the EmailLog row, an UPDATE for the
+rendered fields, another UPDATE for the outcome and an UPDATE of the plan
+status. The send tasks now build each EmailLog instance with its final state
+and hand it to the writer, which turns everything buffered into:
+
+ - one INSERT ... ON CONFLICT DO NOTHING for new content-addressed bodies,
+   preceded by one UPDATE of last_used_at on the referenced bodies that have
+   not been used for a while (see retention.purge_orphan_bodies),
+ - one bulk_create for new EmailLog rows,
+ - one bulk_update per distinct set of changed fields on existing rows,
+ - one UPDATE per distinct MailPlan status.
+
+Flushes happen when MAILPLAN_LOG_FLUSH_SIZE items are buffered or the oldest
+item is older than MAILPLAN_LOG_FLUSH_INTERVAL seconds, explicitly at the end
+of each send task, after every task (task_postrun, which runs before the late
+ack of send tasks) and on worker shutdown. Each flush is one transaction.
+
+A flush that fails (database blip, deadlock) puts everything back into the
+buffer, so the next flush writes it again: the rows describe mails that were
+already delivered, and their idempotency keys must reach the database. After
+MAILPLAN_LOG_FLUSH_RETRIES failed flushes in a row the buffered writes are
+dropped (and logged), so a write that can never succeed does not block the
+ones behind it for good.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from celery.signals import task_postrun, worker_process_shutdown
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import response_cache
+
+logger = logging.getLogger(__name__)
+
+
+class EmailLogWriter:
+    def __init__(self, max_pending=None, max_age=None, max_retries=None):
+        self.max_pending = max_pending or getattr(settings, "MAILPLAN_LOG_FLUSH_SIZE", 500)
+        self.max_age = max_age if max_age is not None else getattr(settings, "MAILPLAN_LOG_FLUSH_INTERVAL", 2.0)
+        self.max_retries = (max_retries if max_retries is not None
+                            else getattr(settings, "MAILPLAN_LOG_FLUSH_RETRIES", 3))
+        self._lock = threading.RLock()
+        self._bodies = {}  # hash -> RenderedBody
+        self._inserts = []
+        self._updates = {}  # tuple(fields) -> {pk: log}
+        self._plan_status = {}  # mailplan_id -> status
+        self._oldest = None
+        self._failures = 0  # failed flushes in a row
+        self.stats = {
+            "flushes": 0, "inserted": 0, "updated": 0, "plan_updates": 0, "statements": 0,
+            "failed_flushes": 0, "dropped": 0,
+        }
+
+    def _touch(self):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def pending(self):
+        with self._lock:
+            return len(self._inserts) + sum(len(v) for v in self._updates.values()) + len(self._plan_status)
+
+    def store_body(self, text):
+        """
+        Buffer the compressed, content-addressed RenderedBody for `text` and
+        return its hash (use it as EmailLog.rendered_id). The blob is inserted
+        with ON CONFLICT DO NOTHING ahead of the EmailLog rows of the same flush.
+        """
+        from .models import RenderedBody
+
+        blob = RenderedBody.from_text(text or "")
+        with self._lock:
+            self._bodies.setdefault(blob.hash, blob)
+            self._touch()
+        return blob.hash
+
+    def add(self, *logs):
+        """Buffer new (unsaved) EmailLog instances for a bulk INSERT."""
+        with self._lock:
+            self._inserts.extend(logs)
+            self._touch()
+        self.maybe_flush()
+
+    def update(self, log, fields):
+        """Buffer an UPDATE of `fields` on an already saved EmailLog."""
+        if log.pk is None:
+            # not inserted yet: the pending INSERT will carry the new values
+            return
+        with self._lock:
+            self._updates.setdefault(tuple(sorted(fields)), {})[log.pk] = log
+            self._touch()
+        self.maybe_flush()
+
+    def set_plan_status(self, mailplan_id, status):
+        with self._lock:
+            self._plan_status[mailplan_id] = status
+            self._touch()
+
+    def maybe_flush(self):
+        with self._lock:
+            too_many = self.pending() >= self.max_pending
+            too_old = self._oldest is not None and time.monotonic() - self._oldest >= self.max_age
+        if too_many or too_old:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything buffered in one transaction. On error the writes are
+        put back into the buffer (see the module docstring) and the error is
+        raised.
+        """
+        with self._lock:
+            bodies, self._bodies = self._bodies, {}
+            inserts, self._inserts = self._inserts, []
+            updates, self._updates = self._updates, {}
+            plan_status, self._plan_status = self._plan_status, {}
+            self._oldest = None
+
+            if not (bodies or inserts or updates or plan_status):
+                return 0
+
+            try:
+                with transaction.atomic():
+                    statements = self._write(bodies, inserts, updates, plan_status)
+            except Exception:
+                self._failures += 1
+                self.stats["failed_flushes"] += 1
+                if self._failures <= self.max_retries:
+                    self._requeue(bodies, inserts, updates, plan_status)
+                else:
+                    dropped = len(inserts) + sum(len(v) for v in updates.values()) + len(plan_status)
+                    self.stats["dropped"] += dropped
+                    self._failures = 0
+                    logger.error("Dropping %s buffered EmailLog/MailPlan write(s) after %s failed flushes.",
+                                 dropped, self.max_retries + 1)
+                raise
+            self._failures = 0
+            self.stats["flushes"] += 1
+            self.stats["inserted"] += len(inserts)
+            self.stats["updated"] += sum(len(v) for v in updates.values())
+            self.stats["plan_updates"] += len(plan_status)
+            self.stats["statements"] += statements
+            return statements
+
+    def _requeue(self, bodies, inserts, updates, plan_status):
+        """Put the writes of a failed flush back; anything buffered since is newer and wins."""
+        for blob_hash, blob in bodies.items():
+            self._bodies.setdefault(blob_hash, blob)
+        self._inserts[:0] = inserts
+        for fields, by_pk in updates.items():
+            self._updates[fields] = {**by_pk, **self._updates.get(fields, {})}
+        for mp_id, st in plan_status.items():
+            self._plan_status.setdefault(mp_id, st)
+        # retried by the next explicit flush, or once max_age has passed again
+        self._touch()
+
+    def _write(self, bodies, inserts, updates, plan_status):
+        from .models import EmailLog, MailPlan, RenderedBody
+
+        statements = 0
+        if bodies:
+            # Mark reused bodies first: the row lock keeps purge_orphan_bodies off
+            # them until this transaction commits, and a body it deleted just
+            # before is re-inserted by the bulk_create below. Bodies used within
+            # half the grace period are never purge candidates and are skipped.
+            now = timezone.now()
+            grace = getattr(settings, "MAILPLAN_RENDERED_BODY_GRACE_SECONDS", 86400)
+            RenderedBody.objects.filter(
+                pk__in=list(bodies), last_used_at__lt=now - timedelta(seconds=grace / 2),
+            ).update(last_used_at=now)
+            RenderedBody.objects.bulk_create(list(bodies.values()), ignore_conflicts=True)
+            statements += 2
+        if inserts:
+            # the unique idempotency_key is the last line of defence against a
+            # duplicate send being logged twice; a conflicting row is dropped
+            EmailLog.objects.bulk_create(inserts, batch_size=1000, ignore_conflicts=True)
+            statements += 1
+        for fields, by_pk in updates.items():
+            EmailLog.objects.bulk_update(list(by_pk.values()), list(fields), batch_size=1000)
+            statements += 1
+        by_status = {}
+        for mp_id, st in plan_status.items():
+            by_status.setdefault(st, []).append(mp_id)
+        for st, ids in by_status.items():
+            MailPlan.objects.filter(id__in=ids).update(status=st, **MailPlan.touched())
+            # after commit: a GET in between would cache the old status again
+            transaction.on_commit(lambda ids=ids: response_cache.invalidate(*ids))
+            statements += 1
+        return statements
+
+
+log_writer = EmailLogWriter()
+
+
+@task_postrun.connect
+def _flush_after_task(**kwargs):
+    # runs before the (late) ack of the task message
+    try:
+        log_writer.flush()
+    except Exception:
+        logger.exception("Failed to flush buffered EmailLog writes after task.")
+
+
+@worker_process_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    try:
+        log_writer.flush()
+    except Exception:
+        logger.exception("Failed to flush buffered EmailLog writes on shutdown.")
@@ -0,0 +1,48 @@
+# backend/mailplans/management/commands/archive_email_logs.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mailplans.retention import archive_email_logs, manage_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive EmailLog rows older than N days to a gzip-compressed NDJSON file "
+        "and delete them in bounded batches. With --partitions-only, just create "
+        "upcoming monthly partitions (PostgreSQL, partitioned table only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="retention in days (default MAILPLAN_LOG_RETENTION_DAYS)")
+        parser.add_argument("--archive-dir", default=None, help="directory for archive files (default MAILPLAN_LOG_ARCHIVE_DIR)")
+        parser.add_argument("--batch-size", type=int, default=None, help="rows per fetch / delete batch")
+        parser.add_argument("--dry-run", action="store_true", help="only count the rows that would be archived")
+        parser.add_argument("--partitions-only", action="store_true", help="only create upcoming monthly partitions")
+
+    def handle(self, *args, **options):
+        if options["partitions_only"]:
+            result = manage_partitions(drop=False)
+            if not result["partitioned"]:
+                self.stdout.write("EmailLog table is not partitioned; nothing to do.")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Partitions ensured: {', '.join(result['created'])}"))
+            return
+
+        days = options["days"] if options["days"] is not None else getattr(settings, "MAILPLAN_LOG_RETENTION_DAYS", 90)
+        if days <= 0:
+            raise CommandError("Retention must be at least 1 day.")
+
+        summary = archive_email_logs(
+            days=days,
+            archive_dir=options["archive_dir"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+        if options["dry_run"]:
+            self.stdout.write(f"{summary['archived']} EmailLog row(s) older than {summary['cutoff']} would be archived.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {summary['archived']} row(s) to {summary['file'] or '-'}; "
+            f"deleted {summary['deleted']} row(s), {len(summary['partitions_dropped'])} partition(s) "
+            f"and {summary['bodies_deleted']} unused body blob(s)."
+        ))
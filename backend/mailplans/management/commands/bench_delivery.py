@@ -0,0 +1,118 @@
+# backend/mailplans/management/commands/bench_delivery.py
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from mailplans import async_delivery, smtp_pool
+from mailplans.tasks import _deliver_messages
+
+SMTP_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure delivery throughput (messages/second in this process) of the "
+        "threaded and asyncio delivery engines against an SMTP sink. "
+        "Use --start-sink to run the bundled smtp_sink command for the duration."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engine", choices=("threads", "asyncio", "both"), default="both")
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--batch", type=int, default=200, help="messages handed to the engine per call (like one task)")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=2525)
+        parser.add_argument("--start-sink", action="store_true", help="start smtp_sink in a subprocess")
+        parser.add_argument("--sink-latency-ms", type=float, default=0.0, help="reply latency of the started sink")
+        parser.add_argument("--concurrency", type=int, default=None, help="MAILPLAN_SEND_CONCURRENCY for the threaded engine")
+        parser.add_argument("--sessions", type=int, default=None, help="MAILPLAN_ASYNC_SMTP_SESSIONS for the asyncio engine")
+        parser.add_argument("--json", action="store_true", help="print the results as JSON")
+
+    def handle(self, *args, **options):
+        engines = ("threads", "asyncio") if options["engine"] == "both" else (options["engine"],)
+        if "asyncio" in engines and async_delivery.aiosmtplib is None:
+            raise CommandError("The asyncio engine needs aiosmtplib (pip install aiosmtplib).")
+
+        sink = self._start_sink(options) if options["start_sink"] else None
+        try:
+            results = [self._run(engine, options) for engine in engines]
+        finally:
+            if sink is not None:
+                sink.terminate()
+                sink.wait(10)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for r in results:
+            self.stdout.write(
+                f"{r['engine']:>8}: {r['sent']}/{r['messages']} sent in {r['seconds']:.2f}s "
+                f"-> {r['per_second']:.1f} msg/s (failed {r['failed']}, concurrency {r['concurrency']})"
+            )
+
+    def _start_sink(self, options):
+        manage_py = Path(settings.BASE_DIR) / "manage.py"
+        cmd = [sys.executable, str(manage_py), "smtp_sink", "--host", options["host"], "--port", str(options["port"]),
+               "--latency-ms", str(options["sink_latency_ms"]), "--report-every", "3600"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+        time.sleep(1.5)  # let it bind
+        if proc.poll() is not None:
+            raise CommandError("smtp_sink failed to start.")
+        return proc
+
+    def _run(self, engine, options):
+        overrides = {
+            "EMAIL_BACKEND": SMTP_BACKEND,
+            "EMAIL_HOST": options["host"],
+            "EMAIL_PORT": options["port"],
+            "EMAIL_USE_TLS": False,
+            "EMAIL_USE_SSL": False,
+            "EMAIL_HOST_USER": "",
+            "EMAIL_HOST_PASSWORD": "",
+            "EMAIL_POOL_ENABLED": True,
+            "MAILPLAN_DELIVERY_ENGINE": engine,
+        }
+        if options["concurrency"]:
+            overrides["MAILPLAN_SEND_CONCURRENCY"] = options["concurrency"]
+            overrides["EMAIL_POOL_SIZE"] = options["concurrency"]
+        if options["sessions"]:
+            overrides["MAILPLAN_ASYNC_SMTP_SESSIONS"] = options["sessions"]
+
+        total = options["messages"]
+        batch = max(1, options["batch"])
+        body = "<p>" + "benchmark body " * 40 + "</p>"
+        messages = [(f"bench {i}", body, [f"user{i}@bench.example"]) for i in range(total)]
+
+        with override_settings(**overrides):
+            # pools/engines are built from settings on first use
+            smtp_pool.reset_pool()
+            async_delivery.reset_engine()
+            try:
+                _deliver_messages(messages[:1])  # warm up: open the first session
+                started = time.perf_counter()
+                outcomes = []
+                for i in range(0, total, batch):
+                    outcomes.extend(_deliver_messages(messages[i:i + batch]))
+                elapsed = time.perf_counter() - started
+                concurrency = (settings.MAILPLAN_ASYNC_SMTP_SESSIONS if engine == "asyncio"
+                               else settings.MAILPLAN_SEND_CONCURRENCY)
+            finally:
+                smtp_pool.reset_pool()
+                async_delivery.reset_engine()
+
+        sent = sum(1 for count, _ in outcomes if count)
+        return {
+            "engine": engine,
+            "messages": total,
+            "sent": sent,
+            "failed": total - sent,
+            "seconds": round(elapsed, 4),
+            "per_second": round(sent / elapsed, 1) if elapsed else 0.0,
+            "concurrency": concurrency,
+        }
@@ -0,0 +1,112 @@
+# backend/mailplans/management/commands/benchmark.py
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from mailplans import benchmarks
+
+# committed results of a full default run (SQLite); refresh with --save-baseline after intended changes
+DEFAULT_BASELINE = Path(benchmarks.__file__).with_name("benchmark_baseline.json")
+
+
+def _sizes(value):
+    try:
+        return tuple(int(v) for v in value.split(",") if v.strip())
+    except ValueError:
+        raise CommandError(f"Invalid size list {value!r} (expected e.g. 10,100,1000).")
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the micro-benchmarks of the send and flow-planning hot paths "
+        "(see mailplans/benchmarks.py) against the configured database, inside a "
+        "transaction that is rolled back. Use DB_ENGINE=sqlite to run offline on "
+        "SQLite (migrate first). Writes JSON results with --output and fails with "
+        "a non-zero exit status when a case is slower than the baseline (by "
+        "default the committed mailplans/benchmark_baseline.json) by more than "
+        "--tolerance."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--only", action="append", default=[],
+                            help=f"benchmark group prefix to run (repeatable): {', '.join(benchmarks.BENCHMARKS)}")
+        parser.add_argument("--repeat", type=int, default=5, help="timed repetitions per case (median is reported)")
+        parser.add_argument("--flow-sizes", type=_sizes, default=benchmarks.DEFAULT_FLOW_SIZES,
+                            help="comma-separated node counts of the generated flows")
+        parser.add_argument("--scheduler-plans", type=int, default=benchmarks.DEFAULT_SCHEDULER_PLANS)
+        parser.add_argument("--serializer-plans", type=int, default=benchmarks.DEFAULT_SERIALIZER_PLANS)
+        parser.add_argument("--list-recipients", type=int, default=benchmarks.DEFAULT_LIST_RECIPIENTS)
+        parser.add_argument("--quick", action="store_true",
+                            help="smaller sizes (flows up to 1000 nodes, 10000 plans, 3 repeats) for a fast check")
+        parser.add_argument("--output", help="write the JSON results to this file")
+        parser.add_argument("--json", action="store_true", help="print the JSON results instead of the table")
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE),
+                            help="JSON results of an earlier run to compare against "
+                                 "(default: the committed mailplans/benchmark_baseline.json)")
+        parser.add_argument("--no-baseline", action="store_true", help="do not compare against a baseline")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="allowed slowdown against the baseline median (0.25 = 25%%)")
+        parser.add_argument("--save-baseline", help="also write the results to this file as the new baseline")
+
+    def handle(self, *args, **options):
+        if options["quick"]:
+            options["repeat"] = min(options["repeat"], 3)
+            options["flow_sizes"] = tuple(s for s in options["flow_sizes"] if s <= 1000)
+            options["scheduler_plans"] = min(options["scheduler_plans"], 10000)
+
+        unknown = [o for o in options["only"] if not any(name.startswith(o) for name in benchmarks.BENCHMARKS)]
+        if unknown:
+            raise CommandError(f"Unknown benchmark group(s): {', '.join(unknown)}")
+
+        baseline = None
+        if options["baseline"] and not options["no_baseline"]:
+            try:
+                baseline = json.loads(Path(options["baseline"]).read_text())
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {exc}")
+            base_db = baseline.get("meta", {}).get("database")
+            if base_db and base_db != connection.vendor:
+                # timings of another database engine say nothing about this one
+                self.stderr.write(f"Baseline {options['baseline']} was recorded on {base_db}, not "
+                                  f"{connection.vendor}; not comparing (pass --baseline to use another file).")
+                baseline = None
+
+        runner = benchmarks.BenchmarkRunner(
+            repeat=options["repeat"],
+            flow_sizes=options["flow_sizes"],
+            scheduler_plans=options["scheduler_plans"],
+            serializer_plans=options["serializer_plans"],
+            list_recipients=options["list_recipients"],
+            log=None if options["json"] else self.stdout.write,
+        )
+        results = runner.run(only=options["only"])
+
+        comparison = benchmarks.compare(results, baseline, options["tolerance"]) if baseline else []
+        if comparison:
+            results["comparison"] = {"baseline": options["baseline"], "tolerance": options["tolerance"],
+                                     "cases": comparison}
+
+        document = json.dumps(results, indent=2)
+        for path in (options["output"], options["save_baseline"]):
+            if path:
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                Path(path).write_text(document + "\n")
+
+        if options["json"]:
+            self.stdout.write(document)
+        elif comparison:
+            self.stdout.write("")
+            self.stdout.write(f"{'case':<36} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}  status")
+            for row in comparison:
+                base = f"{row['baseline_ms']:.3f}" if row["baseline_ms"] is not None else "-"
+                ratio = f"{row['ratio']:.2f}" if row["ratio"] is not None else "-"
+                self.stdout.write(f"{row['name']:<36} {base:>12} {row['current_ms']:>12.3f} {ratio:>7}  {row['status']}")
+
+        regressions = [row for row in comparison if row["status"] == "regression"]
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} benchmark regression(s) over {options['tolerance']:.0%}: "
+                + ", ".join(f"{row['name']} x{row['ratio']:.2f}" for row in regressions)
+            )
@@ -0,0 +1,57 @@
+# backend/mailplans/management/commands/compact_rendered_bodies.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mailplans.models import EmailLog, RenderedBody
+
+
+class Command(BaseCommand):
+    help = (
+        "Move inline EmailLog.rendered_body values into shared, zlib-compressed "
+        "RenderedBody rows (one per content hash). Works in primary-key ordered "
+        "chunks so it can run on large tables and be interrupted/restarted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="rows converted per transaction")
+        parser.add_argument("--start-id", type=int, default=0, help="resume after this EmailLog id")
+        parser.add_argument("--limit", type=int, default=0, help="stop after this many rows (0 = all)")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options["chunk_size"])
+        last_id = options["start_id"]
+        limit = options["limit"]
+        converted = 0
+        saved_bytes = 0
+
+        while True:
+            rows = list(
+                EmailLog.objects.filter(pk__gt=last_id, rendered__isnull=True, rendered_body__isnull=False)
+                .order_by("pk")
+                .only("pk", "rendered_body")[:chunk_size]
+            )
+            if not rows:
+                break
+
+            blobs = {}
+            for log in rows:
+                blob = RenderedBody.from_text(log.rendered_body)
+                blobs.setdefault(blob.hash, blob)
+                saved_bytes += blob.size
+                log.rendered_id = blob.hash
+                log.rendered_body = None
+
+            with transaction.atomic():
+                RenderedBody.objects.bulk_create(list(blobs.values()), ignore_conflicts=True)
+                EmailLog.objects.bulk_update(rows, ["rendered", "rendered_body"])
+
+            converted += len(rows)
+            last_id = rows[-1].pk
+            self.stdout.write(f"converted {converted} rows (last id {last_id}, {len(blobs)} distinct bodies in chunk)")
+            if limit and converted >= limit:
+                break
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {converted} EmailLog rows now reference shared bodies "
+            f"({saved_bytes} bytes of inline HTML moved). Resume with --start-id {last_id}."
+        ))
@@ -0,0 +1,240 @@
+# backend/mailplans/management/commands/generate_load.py
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from mailplans.flow import compile_flow
+from mailplans.flowgen import generate_tree_flow
+from mailplans.models import EmailLog, MailPlan, RenderedBody, ScheduledSend
+from mailplans.recipients import recipient_index
+from mailplans.retention import delete_in_batches, purge_orphan_bodies
+
+WORDS = (
+    "account update welcome trial offer invoice reminder weekly digest product launch feature team "
+    "schedule meeting report summary order shipping delivery discount member event webinar guide "
+    "tips security password profile settings billing renewal upgrade feedback survey thanks"
+).split()
+DOMAINS = ("example.com", "example.org", "example.net", "mail.test", "inbox.test")
+FAILURE_MESSAGES = (
+    "(421, b'4.7.0 Try again later')",
+    "Connection unexpectedly closed",
+    "{'%s': (550, b'5.1.1 User unknown')}",
+)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def _explicit_created_at(*models):
+    """Let bulk_create keep the generated created_at values instead of auto_now_add's now()."""
+    fields = [model._meta.get_field("created_at") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-create synthetic MailPlans with random flows, and historical EmailLog rows, "
+        "for capacity planning. Rows are inserted with bulk_create in chunks (memory stays "
+        "flat for millions of logs) and the run is reproducible for a given --seed. "
+        "Generated plans are named with --prefix; --delete removes them (and their logs) again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plans", type=int, default=1000)
+        parser.add_argument("--depth", type=int, default=4, help="levels of nodes below the start node")
+        parser.add_argument("--fanout", type=int, default=2, help="children per flow node")
+        parser.add_argument("--max-nodes", type=int, default=100, help="cap on nodes per flow")
+        parser.add_argument("--delay-ratio", type=float, default=0.3, help="share of delay nodes (0-1)")
+        parser.add_argument("--recipients", type=int, default=1, help="recipient addresses per plan")
+        parser.add_argument("--template-vars", type=int, default=5, help="template variables per plan")
+        parser.add_argument("--content-size", type=int, default=1000, help="approximate body size in bytes")
+        parser.add_argument("--logs", type=int, default=0, help="historical EmailLog rows to create in total")
+        parser.add_argument("--history-days", type=int, default=90, help="spread plans and logs over this many days")
+        parser.add_argument("--failure-rate", type=float, default=0.05, help="share of failed EmailLog rows")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="rows per bulk_create / transaction")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--prefix", default="load-", help="name prefix of the generated plans")
+        parser.add_argument("--delete", action="store_true", help="delete plans named with --prefix and exit")
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        if not prefix:
+            raise CommandError("--prefix must not be empty.")
+        self.chunk_size = max(1, options["chunk_size"])
+        if options["delete"]:
+            self._delete(prefix)
+            return
+        if MailPlan.objects.filter(name__startswith=prefix).exists():
+            raise CommandError(f"Plans named {prefix}* already exist; use --delete or another --prefix.")
+        if not 0 <= options["delay_ratio"] <= 1 or not 0 <= options["failure_rate"] <= 1:
+            raise CommandError("--delay-ratio and --failure-rate must be between 0 and 1.")
+
+        rng = random.Random(options["seed"])
+        self.now = timezone.now()
+
+        started = time.perf_counter()
+        with _explicit_created_at(MailPlan, EmailLog):
+            plans = self._create_plans(rng, options)
+            # bulk_create skips the post_save recipient sync
+            recipient_index.rebuild(MailPlan.objects.filter(name__startswith=prefix), self.chunk_size)
+            logs = self._create_logs(rng, options, plans) if options["logs"] else 0
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(plans)} plans and {logs} email logs in {elapsed:.1f}s (seed {options['seed']})."
+        ))
+
+    # ---------- plans ----------
+
+    def _text(self, rng, size, variables):
+        """Random words (with {{ var }} references) of about `size` bytes."""
+        parts, length = [], 0
+        while length < size:
+            if variables and rng.random() < 0.1:
+                word = "{{ %s }}" % rng.choice(variables)
+            else:
+                word = rng.choice(WORDS)
+            parts.append(word)
+            length += len(word) + 1
+        return " ".join(parts)
+
+    def _plan(self, rng, index, options):
+        prefix = options["prefix"]
+        variables = [f"var{i}" for i in range(options["template_vars"])]
+        template_vars = {name: rng.choice(WORDS) for name in variables}
+        recipients = [f"user{index}-{r}@{rng.choice(DOMAINS)}" for r in range(max(1, options["recipients"]))]
+        # the seeded email logs are addressed to these (see _create_logs)
+        self.recipients[f"{prefix}{index}"] = recipients
+        body = "<p>Step {step}</p><p>" + self._text(rng, options["content_size"], variables) + "</p>"
+        subject = "{step}: " + self._text(rng, 40, variables)
+        flow = generate_tree_flow(
+            options["depth"], options["fanout"], options["delay_ratio"], max_nodes=options["max_nodes"], rng=rng,
+            recipient=", ".join(recipients), subject=subject, body=body,
+        )
+        created_at = self.now - timedelta(seconds=rng.randrange(max(1, options["history_days"]) * 86400))
+        trigger_type = rng.choice(("on_signup", "after_1_day", "button_click"))
+        status = rng.choices(("active", "scheduled", "sent", "failed", "paused"), weights=(50, 10, 30, 5, 5))[0]
+        return MailPlan(
+            name=f"{prefix}{index}",
+            subject=subject.replace("{step}", "Hello"),
+            content=body.replace("{step}", "1"),
+            trigger_type=trigger_type,
+            # future due times only: generated plans must not fire on the scheduler's next tick
+            scheduled_time=self.now + timedelta(minutes=rng.randrange(60, 43200)) if status == "scheduled" else None,
+            recipient_email=recipients[0],
+            status=status,
+            # bulk_create skips save(), so the flow IR is compiled here
+            flow=flow,
+            flow_ir=compile_flow(flow),
+            template_vars=template_vars,
+            created_at=created_at,
+            last_triggered_at=self._last_triggered(trigger_type, status, created_at),
+        )
+
+    def _last_triggered(self, trigger_type, status, created_at):
+        """Plans that would already have fired are marked as such (so the scheduler leaves them alone)."""
+        if status == "sent":
+            return created_at
+        fired_at = created_at + timedelta(days=1)
+        if trigger_type == "after_1_day" and fired_at <= self.now:
+            return fired_at
+        return None
+
+    def _create_plans(self, rng, options):
+        total = max(0, options["plans"])
+        created = 0
+        self.recipients = {}
+        for chunk in _chunks((self._plan(rng, i, options) for i in range(total)), self.chunk_size):
+            with transaction.atomic():
+                MailPlan.objects.bulk_create(chunk)
+            created += len(chunk)
+            self.stdout.write(f"  plans: {created}/{total}")
+        # ids are read back in creation order (bulk_create does not return them on every backend)
+        return [
+            (plan_id, content, self.recipients[name])
+            for plan_id, content, name in MailPlan.objects.filter(name__startswith=options["prefix"])
+            .order_by("id").values_list("id", "content", "name")
+        ]
+
+    # ---------- email logs ----------
+
+    def _create_logs(self, rng, options, plans):
+        if not plans:
+            return 0
+        # one shared compressed body per plan, as the send tasks store it
+        bodies = {}
+        for chunk in _chunks(plans, self.chunk_size):
+            blobs = []
+            for plan_id, content, _ in chunk:
+                blob = RenderedBody.from_text(content or "")
+                bodies[plan_id] = blob.hash
+                blobs.append(blob)
+            with transaction.atomic():
+                RenderedBody.objects.bulk_create(blobs, ignore_conflicts=True)
+
+        total = options["logs"]
+        history = max(1, options["history_days"]) * 86400
+        plan_ids = [plan_id for plan_id, _, _ in plans]
+        recipients = {plan_id: addresses for plan_id, _, addresses in plans}
+
+        def rows():
+            for i in range(total):
+                plan_id = rng.choice(plan_ids)
+                created_at = self.now - timedelta(seconds=rng.randrange(history))
+                to_email = rng.choice(recipients[plan_id])
+                failed = rng.random() < options["failure_rate"]
+                yield EmailLog(
+                    mailplan_id=plan_id,
+                    to_email=to_email,
+                    subject=f"Load test email {i}",
+                    body="",
+                    rendered_id=bodies[plan_id],
+                    status="failed" if failed else "sent",
+                    response_message=(rng.choice(FAILURE_MESSAGES).replace("%s", to_email) if failed
+                                      else "sent_count=1"),
+                    created_at=created_at,
+                    sent_at=None if failed else created_at + timedelta(seconds=rng.randrange(1, 30)),
+                    attempts=rng.randint(1, 5) if failed else 1,
+                )
+
+        created = 0
+        report_every = max(self.chunk_size, total // 20)
+        for chunk in _chunks(rows(), self.chunk_size):
+            with transaction.atomic():
+                EmailLog.objects.bulk_create(chunk)
+            created += len(chunk)
+            if created % report_every < self.chunk_size or created == total:
+                self.stdout.write(f"  email logs: {created}/{total}")
+        return created
+
+    # ---------- cleanup ----------
+
+    def _delete(self, prefix):
+        # logs first, in batches, so the plan delete does not cascade over millions of rows at once
+        logs = delete_in_batches(EmailLog.objects.filter(mailplan__name__startswith=prefix), self.chunk_size)
+        delete_in_batches(ScheduledSend.objects.filter(mailplan__name__startswith=prefix), self.chunk_size)
+        plans = delete_in_batches(MailPlan.objects.filter(name__startswith=prefix), self.chunk_size)
+        # seeded data only: no grace period for bodies the deleted logs used
+        bodies = purge_orphan_bodies(self.chunk_size, grace=0)
+        recipient_index.prune()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {plans} plans, {logs} email logs and {bodies} unused bodies named {prefix}*."
+        ))
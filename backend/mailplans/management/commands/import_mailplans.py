@@ -0,0 +1,77 @@
+# backend/mailplans/management/commands/import_mailplans.py
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mailplans.importer import detect_format, run_import
+from mailplans.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Import MailPlans from a CSV or NDJSON file in this process (see "
+        "mailplans/importer.py for the columns). Rows are validated like "
+        "POST /api/mailplans/ and inserted with bulk_create, one transaction per "
+        "chunk; rejected rows are listed at the end. An interrupted import is "
+        "continued from its last committed chunk with --resume JOB_ID."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="CSV / NDJSON file (not needed with --resume)")
+        parser.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file extension")
+        parser.add_argument("--chunk-size", type=int, default=None,
+                            help="rows per transaction (default MAILPLAN_IMPORT_CHUNK_SIZE)")
+        parser.add_argument("--resume", type=int, metavar="JOB_ID", help="continue an earlier import job")
+        parser.add_argument("--force", action="store_true",
+                            help="with --resume: take over a job another run still holds")
+        parser.add_argument("--show-errors", type=int, default=20, help="rejected rows to print (default 20)")
+
+    def handle(self, *args, **options):
+        if options["resume"]:
+            try:
+                job = ImportJob.objects.get(pk=options["resume"])
+            except ImportJob.DoesNotExist:
+                raise CommandError(f"No import job {options['resume']}.")
+        else:
+            path = options["path"]
+            if not path or not os.path.isfile(path):
+                raise CommandError("Give the file to import (or --resume JOB_ID).")
+            try:
+                fmt = detect_format(path, options["format"])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            chunk_size = options["chunk_size"] or getattr(settings, "MAILPLAN_IMPORT_CHUNK_SIZE", 1000)
+            job = ImportJob.objects.create(
+                format=fmt,
+                filename=os.path.basename(path)[:255],
+                source_path=os.path.abspath(path),
+                chunk_size=max(1, chunk_size),
+            )
+            self.stdout.write(f"Import job {job.id}: {path} ({fmt}, {job.chunk_size} rows per chunk)")
+
+        started = time.perf_counter()
+
+        def progress(j):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"  rows {j.committed_rows}: {j.imported_rows} imported, {j.failed_rows} rejected "
+                f"({elapsed:.1f}s)"
+            )
+
+        try:
+            result = run_import(job.id, force=options["force"], progress=progress)
+        except Exception as exc:
+            raise CommandError(f"Import job {job.id} stopped: {exc}. Continue with --resume {job.id}.")
+        if result is None:
+            job.refresh_from_db()
+            raise CommandError(
+                f"Import job {job.id} is {job.status}" + (" (use --force to take it over)." if job.status == "running" else ".")
+            )
+
+        for entry in result.errors[:options["show_errors"]]:
+            self.stdout.write(self.style.WARNING(f"  row {entry['row']}: {entry['errors']}"))
+        if result.failed_rows > options["show_errors"]:
+            self.stdout.write(f"  ... see ImportJob {result.id} for more rejected rows")
+        self.stdout.write(self.style.SUCCESS(f"Import job {result.id}: {result.message}"))
@@ -0,0 +1,29 @@
+# backend/mailplans/management/commands/rebuild_recipients.py
+from django.core.management.base import BaseCommand
+
+from mailplans.models import MailPlan
+from mailplans.recipients import recipient_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-sync the Recipient index (GET /api/recipients/) from every MailPlan's "
+        "recipient_email field and flow email nodes, in id-ordered chunks, and drop "
+        "recipients no plan sends to. Saved plans are synced automatically; run this "
+        "after bulk_create / QuerySet.update() writes (e.g. generate_load)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="plans per sync batch")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options["chunk_size"])
+        total = MailPlan.objects.count()
+        report_every = max(chunk_size, total // 20)
+
+        def progress(done):
+            if done % report_every < chunk_size or done == total:
+                self.stdout.write(f"  plans: {done}/{total}")
+
+        done = recipient_index.rebuild(MailPlan.objects.all(), chunk_size, progress)
+        self.stdout.write(self.style.SUCCESS(f"Synced the recipients of {done} plans."))
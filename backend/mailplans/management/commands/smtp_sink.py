@@ -0,0 +1,122 @@
+# backend/mailplans/management/commands/smtp_sink.py
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class SinkStats:
+    def __init__(self):
+        self.sessions = 0
+        self.messages = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+
+
+class SMTPSinkProtocol:
+    """
+    Minimal SMTP server that accepts and discards everything (no TLS/AUTH).
+    Enough for EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP and QUIT from
+    smtplib / aiosmtplib clients.
+    """
+
+    def __init__(self, stats, latency=0.0, reject_domains=()):
+        self.stats = stats
+        self.latency = latency
+        self.reject_domains = {d.lower() for d in reject_domains}
+
+    async def _reply(self, writer, line):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(line.encode("ascii") + b"\r\n")
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        self.stats.sessions += 1
+        recipients = 0
+        try:
+            await self._reply(writer, "220 mailplan-sink ESMTP ready")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", "replace").strip()
+                verb = command[:4].upper()
+                if verb == "EHLO":
+                    writer.write(b"250-mailplan-sink\r\n250-8BITMIME\r\n")
+                    await self._reply(writer, "250 SMTPUTF8")
+                elif verb == "HELO":
+                    await self._reply(writer, "250 mailplan-sink")
+                elif verb == "MAIL":
+                    recipients = 0
+                    await self._reply(writer, "250 OK")
+                elif verb == "RCPT":
+                    domain = command.rpartition("@")[2].strip("<> \t").lower()
+                    if domain in self.reject_domains:
+                        self.stats.rejected += 1
+                        await self._reply(writer, "550 5.1.1 Recipient rejected by sink")
+                    else:
+                        recipients += 1
+                        await self._reply(writer, "250 OK")
+                elif verb == "DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    while True:
+                        data = await reader.readline()
+                        if not data or data in (b".\r\n", b".\n"):
+                            break
+                    if recipients:
+                        self.stats.messages += 1
+                    await self._reply(writer, "250 OK queued")
+                elif verb in ("RSET", "NOOP"):
+                    recipients = 0 if verb == "RSET" else recipients
+                    await self._reply(writer, "250 OK")
+                elif verb == "QUIT":
+                    await self._reply(writer, "221 Bye")
+                    break
+                else:
+                    await self._reply(writer, "502 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local SMTP sink that accepts and discards all mail, for benchmarking "
+        "the delivery engines (point EMAIL_HOST/EMAIL_PORT at it). Prints the "
+        "received message rate every few seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=2525)
+        parser.add_argument("--latency-ms", type=float, default=0.0,
+                            help="delay added before every reply, to simulate a remote server")
+        parser.add_argument("--reject-domain", action="append", default=[],
+                            help="answer RCPT for this domain with 550 (repeatable)")
+        parser.add_argument("--report-every", type=float, default=5.0, help="seconds between rate reports")
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self._serve(options))
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve(self, options):
+        stats = SinkStats()
+        protocol = SMTPSinkProtocol(stats, options["latency_ms"] / 1000.0, options["reject_domain"])
+        server = await asyncio.start_server(protocol.handle, options["host"], options["port"])
+        self.stdout.write(f"SMTP sink listening on {options['host']}:{options['port']}")
+        async with server:
+            last_count, last_time = 0, time.monotonic()
+            while True:
+                await asyncio.sleep(options["report_every"])
+                now = time.monotonic()
+                rate = (stats.messages - last_count) / (now - last_time)
+                self.stdout.write(
+                    f"messages={stats.messages} sessions={stats.sessions} "
+                    f"rejected={stats.rejected} rate={rate:.1f}/s"
+                )
+                last_count, last_time = stats.messages, now
@@ -0,0 +1,179 @@
+# backend/mailplans/metrics.py
+"""
+Prometheus metrics of the mail tasks.
+
+The send and planning tasks time each of their stages and count outcomes:
+
+    mailplan_stage_seconds{task, stage}         histogram, e.g. stage="load" (DB reads),
+                                                "flow", "claim", "rate_limit", "render",
+                                                "smtp", "log_write", "traversal", ...
+    mailplan_task_seconds{task}                 histogram, whole task run
+    mailplan_smtp_seconds{engine}               histogram, SMTP latency per message
+    mailplan_emails_total{task, status}         counter: sent, failed (retried), rejected,
+                                                deferred, duplicate, gave_up
+    mailplan_task_retries_total{task}           counter
+    mailplan_flow_traversal_nodes / _edges      histograms of execute_flow_task traversals
+    mailplan_flow_scheduled_sends               histogram, sends planned per traversal
+    mailplan_scheduler_plans_total{kind}        counter: plans fired by schedule_due_mailplans
+
+GET /metrics serves them in the Prometheus text format to scrapers that send
+"Authorization: Bearer <MAILPLAN_METRICS_TOKEN>" (404 when no token is set,
+unless DEBUG is on).
+
+Celery prefork children and gunicorn workers are separate processes. Set
+PROMETHEUS_MULTIPROC_DIR (an empty, writable directory, shared by the web and
+worker processes on a host and wiped on deploy) in the environment before they
+start: prometheus_client then keeps every process' samples in files there and
+/metrics aggregates all of them. Without it, /metrics only shows the
+process that serves the request.
+
+prometheus_client is an optional dependency. Without it (or with
+MAILPLAN_METRICS_ENABLED off) every hook below is a no-op and /metrics
+answers 503.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+from django.conf import settings
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # optional dependency
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+
+class _Metrics:
+    def __init__(self):
+        Counter, Histogram = prometheus_client.Counter, prometheus_client.Histogram
+        self.stage_seconds = Histogram(
+            "mailplan_stage_seconds", "Time spent in each stage of the mail tasks.",
+            ["task", "stage"], buckets=STAGE_BUCKETS,
+        )
+        self.task_seconds = Histogram(
+            "mailplan_task_seconds", "Duration of mail task runs.", ["task"], buckets=STAGE_BUCKETS,
+        )
+        self.smtp_seconds = Histogram(
+            "mailplan_smtp_seconds", "SMTP latency per message.", ["engine"], buckets=STAGE_BUCKETS,
+        )
+        self.emails = Counter("mailplan_emails", "Email send outcomes.", ["task", "status"])
+        self.retries = Counter("mailplan_task_retries", "Mail task retries scheduled.", ["task"])
+        self.traversal_nodes = Histogram(
+            "mailplan_flow_traversal_nodes", "Flow nodes visited per execute_flow_task traversal.",
+            buckets=SIZE_BUCKETS,
+        )
+        self.traversal_edges = Histogram(
+            "mailplan_flow_traversal_edges", "Flow edges relaxed per execute_flow_task traversal.",
+            buckets=SIZE_BUCKETS,
+        )
+        self.scheduled_sends = Histogram(
+            "mailplan_flow_scheduled_sends", "Sends planned per execute_flow_task traversal.",
+            buckets=SIZE_BUCKETS,
+        )
+        self.scheduler_plans = Counter(
+            "mailplan_scheduler_plans", "Plans fired by schedule_due_mailplans.", ["kind"],
+        )
+
+
+_metrics = None
+if prometheus_client is not None and getattr(settings, "MAILPLAN_METRICS_ENABLED", True):
+    _metrics = _Metrics()
+
+
+def enabled():
+    return _metrics is not None
+
+
+def multiprocess_mode():
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def observe_stage(task, stage, seconds):
+    if _metrics is not None:
+        _metrics.stage_seconds.labels(task, stage).observe(seconds)
+
+
+@contextmanager
+def timed(task, stage):
+    """Time the enclosed block as `stage` of `task`."""
+    if _metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _metrics.stage_seconds.labels(task, stage).observe(time.perf_counter() - started)
+
+
+def count_emails(task, status, count=1):
+    if _metrics is not None and count:
+        _metrics.emails.labels(task, status).inc(count)
+
+
+def count_retry(task):
+    if _metrics is not None:
+        _metrics.retries.labels(task).inc()
+
+
+def observe_smtp(engine, seconds):
+    if _metrics is not None:
+        _metrics.smtp_seconds.labels(engine).observe(seconds)
+
+
+def observe_traversal(nodes, edges, sends):
+    if _metrics is not None:
+        _metrics.traversal_nodes.observe(nodes)
+        _metrics.traversal_edges.observe(edges)
+        _metrics.scheduled_sends.observe(sends)
+
+
+def count_scheduled(kind, count):
+    if _metrics is not None and count:
+        _metrics.scheduler_plans.labels(kind).inc(count)
+
+
+def exposition():
+    """(body, content_type) of the current metrics in the Prometheus text format."""
+    if multiprocess_mode():
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+# ---------- whole-task timing ----------
+
+_task_started = {}  # task_id -> perf_counter at prerun
+
+
+@task_prerun.connect
+def _task_prerun(task_id=None, task=None, **kwargs):
+    if _metrics is not None and task is not None and task.name.startswith("mailplans."):
+        _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _task_postrun(task_id=None, task=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        _metrics.task_seconds.labels(task.name.rpartition(".")[2]).observe(time.perf_counter() - started)
+
+
+@worker_process_shutdown.connect
+def _mark_process_dead(**kwargs):
+    if _metrics is not None and multiprocess_mode():
+        try:
+            multiprocess.mark_process_dead(os.getpid())
+        except Exception:
+            logger.debug("Could not mark metrics of process %s dead.", os.getpid(), exc_info=True)
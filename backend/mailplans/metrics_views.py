@@ -0,0 +1,32 @@
+# backend/mailplans/metrics_views.py
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
+
+from . import metrics
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint: GET /metrics (text exposition format).
+    Requests must send "Authorization: Bearer <MAILPLAN_METRICS_TOKEN>".
+    Without a configured token the endpoint does not exist (404), except
+    with DEBUG on, where it is open for local development.
+    """
+    token = getattr(settings, "MAILPLAN_METRICS_TOKEN", "")
+    if not token and not settings.DEBUG:
+        raise Http404()
+    if token:
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            return HttpResponse("unauthorized\n", status=401, content_type="text/plain")
+    if not metrics.enabled():
+        return HttpResponse(
+            "metrics disabled (install prometheus_client / set MAILPLAN_METRICS_ENABLED)\n",
+            status=503, content_type="text/plain",
+        )
+    body, content_type = metrics.exposition()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:23
+
+from django.db import migrations, models
+
+
+def compile_existing_flows(apps, schema_editor):
+    from mailplans.flow import compile_flow
+
+    MailPlan = apps.get_model('mailplans', 'MailPlan')
+    batch = []
+    for mp in MailPlan.objects.only('id', 'flow').iterator(chunk_size=500):
+        mp.flow_ir = compile_flow(mp.flow)
+        batch.append(mp)
+        if len(batch) >= 500:
+            MailPlan.objects.bulk_update(batch, ['flow_ir'])
+            batch = []
+    if batch:
+        MailPlan.objects.bulk_update(batch, ['flow_ir'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0008_mailplan_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailplan',
+            name='flow_ir',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(compile_existing_flows, migrations.RunPython.noop),
+    ]
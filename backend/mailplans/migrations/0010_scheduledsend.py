@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0009_mailplan_flow_ir'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledSend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('due_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('mailplan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_sends', to='mailplans.mailplan')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0010_scheduledsend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailplan',
+            name='last_triggered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mailplan',
+            index=models.Index(fields=['status', 'scheduled_time'], name='mailplan_status_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailplan',
+            index=models.Index(fields=['trigger_type', 'status', 'created_at'], name='mailplan_trigger_status_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0011_mailplan_last_triggered_at_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedBody',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='rendered',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='email_logs', to='mailplans.renderedbody'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0012_renderedbody'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['mailplan', '-created_at'], name='emaillog_plan_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['status', '-created_at'], name='emaillog_status_created_idx'),
+        ),
+    ]
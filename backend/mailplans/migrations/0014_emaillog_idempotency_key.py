@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0013_emaillog_time_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillog',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='emaillog',
+            name='run_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledsend',
+            name='run_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
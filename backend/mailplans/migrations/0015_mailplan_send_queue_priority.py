@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0014_emaillog_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailplan',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, '0'), (1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5'), (6, '6'), (7, '7'), (8, '8'), (9, '9')], default=5),
+        ),
+        migrations.AddField(
+            model_name='mailplan',
+            name='send_queue',
+            field=models.CharField(choices=[('auto', 'Auto (by trigger type and recipient count)'), ('transactional', 'Transactional'), ('bulk', 'Bulk / campaign')], default='auto', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0015_mailplan_send_queue_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaillog',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
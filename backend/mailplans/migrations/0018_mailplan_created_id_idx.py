@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0017_recompile_flow_ir'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mailplan',
+            index=models.Index(fields=['-created_at', '-id'], name='mailplan_created_id_idx'),
+        ),
+    ]
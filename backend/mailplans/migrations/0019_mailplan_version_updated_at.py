@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0018_mailplan_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailplan',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='mailplan',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
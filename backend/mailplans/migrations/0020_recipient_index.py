@@ -0,0 +1,86 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:01
+
+import logging
+
+import django.db.models.deletion
+from django.db import DatabaseError, migrations, models, transaction
+
+logger = logging.getLogger(__name__)
+
+# (index, model, indexed expression): Django compiles `field__icontains` on
+# Postgres to UPPER("field"::text) LIKE UPPER(...), which these indexes serve
+TRIGRAM_INDEXES = [
+    ('recipient_email_trgm', 'recipient', 'UPPER("email"::text)'),
+    ('recipient_name_trgm', 'recipient', 'UPPER("name"::text)'),
+    ('mailplan_template_vars_trgm', 'mailplan', 'UPPER("template_vars"::text)'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return  # substring filters scan the (small) Recipient table elsewhere
+    try:
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError:
+        logger.warning(
+            "pg_trgm is not available (CREATE EXTENSION needs a privileged role); "
+            "recipient substring filters will not be index-assisted."
+        )
+        return
+    for name, model, expression in TRIGRAM_INDEXES:
+        table = apps.get_model('mailplans', model)._meta.db_table
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" USING gin ({expression} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def backfill_recipients(apps, schema_editor):
+    from mailplans.recipients import RecipientIndex
+
+    index = RecipientIndex(
+        apps.get_model('mailplans', 'Recipient'), apps.get_model('mailplans', 'MailPlanRecipient')
+    )
+    index.rebuild(apps.get_model('mailplans', 'MailPlan').objects.all(), chunk_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0019_mailplan_version_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MailPlanRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('field', 'recipient_email field'), ('flow', 'Flow email node')], default='field', max_length=10)),
+                ('mailplan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipient_links', to='mailplans.mailplan')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plan_links', to='mailplans.recipient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipient', 'mailplan'], name='recipient_mailplan_idx')],
+                'constraints': [models.UniqueConstraint(fields=('mailplan', 'recipient'), name='mailplan_recipient_uniq')],
+            },
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+        migrations.RunPython(backfill_recipients, migrations.RunPython.noop),
+    ]
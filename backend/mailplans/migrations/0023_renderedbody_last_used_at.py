@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0022_trigger_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renderedbody',
+            name='last_used_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
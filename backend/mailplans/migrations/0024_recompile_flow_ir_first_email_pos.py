@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:05
+
+from django.db import migrations
+
+
+def recompile_flows(apps, schema_editor):
+    # flow IR format 3 records the first email node by position (it may have
+    # no id); recompile once here instead of on every send of every plan
+    from mailplans.flow import FLOW_IR_FORMAT, compile_flow
+
+    MailPlan = apps.get_model('mailplans', 'MailPlan')
+    batch = []
+    for mp in MailPlan.objects.only('id', 'flow', 'flow_ir').iterator(chunk_size=500):
+        if isinstance(mp.flow_ir, dict) and mp.flow_ir.get('format') == FLOW_IR_FORMAT:
+            continue
+        mp.flow_ir = compile_flow(mp.flow)
+        batch.append(mp)
+        if len(batch) >= 500:
+            MailPlan.objects.bulk_update(batch, ['flow_ir'])
+            batch = []
+    if batch:
+        MailPlan.objects.bulk_update(batch, ['flow_ir'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailplans', '0023_renderedbody_last_used_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(recompile_flows, migrations.RunPython.noop),
+    ]
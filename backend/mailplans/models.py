@@ -1,5 +1,13 @@
 # backend/mailplans/models.py
+import hashlib
+import zlib
+
+from django.conf import settings
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
+
+from .flow import FLOW_IR_FORMAT, compile_flow, flow_hash, parse_flow
 
 class MailPlan(models.Model):
     PLAN_TRIGGER_CHOICES = [
@@ -8,6 +16,14 @@ class MailPlan(models.Model):
         ('button_click', 'On Button Click'),
     ]
 
+    SEND_QUEUE_CHOICES = [
+        ('auto', 'Auto (by trigger type and recipient count)'),
+        ('transactional', 'Transactional'),
+        ('bulk', 'Bulk / campaign'),
+    ]
+
+    PRIORITY_CHOICES = [(i, str(i)) for i in range(10)]  # 9 = most urgent
+
     STATUS_CHOICES = [
         ('active', 'Active'),
         ('scheduled', 'Scheduled'),
@@ -25,11 +41,30 @@ class MailPlan(models.Model):
     recipient_email = models.EmailField(blank=True, null=True)
     recipient_name = models.CharField(max_length=255, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    # Celery queue / message priority of this plan's sends, see mailplans/routing.py
+    send_queue = models.CharField(max_length=20, choices=SEND_QUEUE_CHOICES, default='auto')
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=5)
     created_at = models.DateTimeField(auto_now_add=True)
+    # watermark set when the scheduler (or a manual trigger) fires the plan
+    last_triggered_at = models.DateTimeField(blank=True, null=True)
     # flow field added in migration 0005
     flow = models.JSONField(blank=True, default=dict, help_text='Visual flow JSON: {nodes: [], edges: []}')
     # template_vars / other JSON fields (kept nullable/defaults per migration)
     template_vars = models.JSONField(blank=True, default=dict, null=True)
+    # compiled flow (node index, adjacency, start node, email nodes, delays); see mailplans/flow.py
+    flow_ir = models.JSONField(blank=True, default=dict, editable=False)
+    # bumped by every write (save() and bulk status updates, see touched()); the API's ETags derive from it
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # schedule_due_mailplans claim queries
+            models.Index(fields=['status', 'scheduled_time'], name='mailplan_status_sched_idx'),
+            models.Index(fields=['trigger_type', 'status', 'created_at'], name='mailplan_trigger_status_idx'),
+            # cursor pagination of the plan list (newest first)
+            models.Index(fields=['-created_at', '-id'], name='mailplan_created_id_idx'),
+        ]
 
     def __str__(self):
         display = self.name
@@ -37,6 +72,75 @@ class MailPlan(models.Model):
             display += f" -> {self.recipient_email}"
         return display
 
+    def save(self, *args, **kwargs):
+        # compile the flow once here so readers never re-walk the raw JSON
+        # (MailPlanSerializer already hands over the IR it validated)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "flow" in update_fields:
+            if not self._flow_ir_current():
+                self.flow_ir = compile_flow(self.flow)
+            if update_fields is not None and "flow_ir" not in update_fields:
+                kwargs["update_fields"] = list(update_fields) + ["flow_ir"]
+        adding = self._state.adding
+        if not adding:
+            # incremented in SQL so concurrent saves never reuse a version
+            self.version = F("version") + 1
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = list(update_fields) + [
+                    f for f in ("version", "updated_at") if f not in update_fields
+                ]
+        super().save(*args, **kwargs)
+        if not adding:
+            # drop the F() expression: `version` becomes a deferred field that is
+            # only read back (refresh_from_db) if the caller accesses it
+            self.__dict__.pop("version", None)
+
+    @staticmethod
+    def touched():
+        """Extra QuerySet.update() values that record a write like save() does."""
+        return {"version": F("version") + 1, "updated_at": timezone.now()}
+
+    def _flow_ir_current(self):
+        ir = self.flow_ir
+        return (
+            isinstance(ir, dict)
+            and ir.get("format") == FLOW_IR_FORMAT
+            and ir.get("hash") == flow_hash(parse_flow(self.flow))
+        )
+
+
+class RenderedBody(models.Model):
+    """
+    A rendered email body stored once per content hash, zlib-compressed.
+
+    Sends of the same plan content to many recipients share a single row
+    instead of repeating the full HTML in every EmailLog.
+    """
+    hash = models.CharField(max_length=64, primary_key=True)  # sha256 hex of the text
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(default=0)  # uncompressed length in bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+    # refreshed by the log writer when it references the blob again; orphans are
+    # only purged once unused for MAILPLAN_RENDERED_BODY_GRACE_SECONDS
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_text(cls, text):
+        raw = text.encode('utf-8')
+        return cls(hash=hashlib.sha256(raw).hexdigest(), data=zlib.compress(raw, 6), size=len(raw))
+
+    @property
+    def text(self):
+        return zlib.decompress(bytes(self.data)).decode('utf-8')
+
+    def __str__(self):
+        return f"RenderedBody {self.hash[:12]} ({self.size} bytes)"
+
 
 class EmailLog(models.Model):
     STATUS_CHOICES = [
@@ -49,11 +153,169 @@ class EmailLog(models.Model):
     to_email = models.EmailField()
     subject = models.CharField(max_length=300)
     body = models.TextField()
+    # legacy inline copy; new rows reference a shared compressed RenderedBody instead
     rendered_body = models.TextField(blank=True, null=True)
+    rendered = models.ForeignKey(
+        RenderedBody, on_delete=models.PROTECT, null=True, blank=True, related_name='email_logs'
+    )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
     response_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     sent_at = models.DateTimeField(null=True, blank=True)
+    # one key per (plan, node, run, recipient) send, see mailplans/idempotency.py
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    run_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    # delivery attempts so far; a row stays 'pending' while a retry is due
+    attempts = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            # per-plan history and admin/reporting filters ordered by time
+            models.Index(fields=['mailplan', '-created_at'], name='emaillog_plan_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='emaillog_status_created_idx'),
+        ]
 
     def __str__(self):
         return f"EmailLog {self.id} -> {self.to_email} ({self.status})"
+
+    @property
+    def rendered_html(self):
+        """The rendered HTML body, whether stored inline (legacy) or as a shared blob."""
+        if self.rendered_id:
+            return self.rendered.text
+        return self.rendered_body
+
+
+class ScheduledSend(models.Model):
+    """
+    A delayed email send produced by execute_flow_task for a flow delay.
+
+    Delayed sends used to be Celery ETA messages held in worker memory until
+    due. They are now rows here; dispatch_scheduled_sends claims due rows in
+    chunks (SELECT ... FOR UPDATE SKIP LOCKED), hands them to the send tasks
+    and deletes them, so pending sends cost no worker RAM.
+    """
+    mailplan = models.ForeignKey(MailPlan, on_delete=models.CASCADE, related_name='scheduled_sends')
+    node_id = models.CharField(max_length=255, blank=True, null=True)
+    due_at = models.DateTimeField(db_index=True)
+    run_id = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"ScheduledSend {self.id} -> MailPlan {self.mailplan_id} node {self.node_id} at {self.due_at}"
+
+
+class Recipient(models.Model):
+    """
+    A distinct recipient address over all plans: their recipient_email field
+    and the email nodes of their flows. Maintained on MailPlan save (see
+    mailplans/recipients.py) so GET /api/recipients/ deduplicates, filters
+    and pages in SQL.
+    """
+    email = models.EmailField(unique=True)  # lower-cased
+    name = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.email
+
+
+class MailPlanRecipient(models.Model):
+    """Association of a plan with one of its recipients."""
+    SOURCE_CHOICES = [
+        ('field', 'recipient_email field'),
+        ('flow', 'Flow email node'),
+    ]
+
+    mailplan = models.ForeignKey(MailPlan, on_delete=models.CASCADE, related_name='recipient_links')
+    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE, related_name='plan_links')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='field')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mailplan', 'recipient'], name='mailplan_recipient_uniq'),
+        ]
+        indexes = [
+            # "recipient has a plan" / "first plan of a recipient" lookups of the recipient list
+            models.Index(fields=['recipient', 'mailplan'], name='recipient_mailplan_idx'),
+        ]
+
+    def __str__(self):
+        return f"MailPlan {self.mailplan_id} -> Recipient {self.recipient_id} ({self.source})"
+
+
+class ImportJob(models.Model):
+    """
+    A bulk import of MailPlans from a CSV or NDJSON file (see
+    mailplans/importer.py). Rows are committed in chunks together with the
+    counters below, so `committed_rows` is always a safe restart point and
+    the counters double as progress.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    filename = models.CharField(max_length=255, blank=True, default='')  # as uploaded / given
+    source_path = models.CharField(max_length=1024)  # file read by the importer
+    # uploads are copied to MAILPLAN_IMPORT_DIR and removed once imported
+    delete_source = models.BooleanField(default=False)
+    chunk_size = models.PositiveIntegerField(default=1000)
+    # data rows (1-based) processed and committed so far; a resumed run skips them
+    committed_rows = models.PositiveIntegerField(default=0)
+    imported_rows = models.PositiveIntegerField(default=0)
+    failed_rows = models.PositiveIntegerField(default=0)
+    # [{"row": n, "errors": {...}}, ...], capped at MAILPLAN_IMPORT_MAX_ERRORS entries
+    errors = models.JSONField(blank=True, default=list)
+    message = models.TextField(blank=True, default='')
+    runner = models.CharField(max_length=64, blank=True, default='')  # task id / token of the claiming run
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    # touched by every committed chunk: a 'running' job that stopped updating has died
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"ImportJob {self.id} {self.filename or self.source_path} ({self.status})"
+
+
+class TriggerBatch(models.Model):
+    """
+    One POST /api/mailplans/bulk_trigger/ call. Every send of the batch
+    carries `run_id`, so its progress is read from EmailLog.run_id and
+    ScheduledSend.run_id (both indexed) instead of per-plan bookkeeping.
+    """
+    run_id = models.CharField(max_length=64, unique=True)  # also the batch id of the API
+    plan_ids = models.JSONField(default=list)
+    flow_plans = models.PositiveIntegerField(default=0)  # plans handed to execute_flow_task (delay nodes)
+    messages = models.PositiveIntegerField(default=0)  # Celery messages published
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"TriggerBatch {self.run_id} ({len(self.plan_ids)} plans)"
+
+    def progress(self):
+        """Aggregate state of the batch: plan statuses, emails by log status, delayed sends still due."""
+        def counts(qs):
+            return dict(qs.order_by().values_list('status').annotate(n=models.Count('id')))
+
+        return {
+            "plans": len(self.plan_ids),
+            "plan_status": counts(MailPlan.objects.filter(id__in=self.plan_ids)),
+            "emails": counts(EmailLog.objects.filter(run_id=self.run_id)),
+            "delayed_pending": ScheduledSend.objects.filter(run_id=self.run_id).count(),
+        }
@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+# separates the ordering values inside a cursor position; the last value may contain it
+POSITION_SEPARATOR = '|'
+
+
+class MailPlanCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the MailPlan list, newest first.
+
+    Pages are selected with "(created_at, id) < <cursor position>" on the
+    (created_at, id) index instead of OFFSET, so every page costs the same
+    however many plans exist. DRF's CursorPagination only keys on the first
+    ordering field and steps through ties with an offset, which skips or
+    repeats rows when paging back; here the position holds every ordering
+    field, so it is unique and pages are stable in both directions.
+
+    GET /api/mailplans/?page_size=100  ->  {"next": <url>, "previous": <url>, "results": [...]}
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'MAILPLAN_LIST_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'MAILPLAN_LIST_MAX_PAGE_SIZE', 500)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip('-')
+            values.append(str(instance[name] if isinstance(instance, dict) else getattr(instance, name)))
+        return POSITION_SEPARATOR.join(values)
+
+    def _position_filter(self, position, reverse):
+        """Q for the rows after `position` in the (possibly reversed) ordering."""
+        values = position.split(POSITION_SEPARATOR, len(self.ordering) - 1)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') != reverse else '__gt'
+            condition |= Q(**equal, **{name + lookup: value})
+            equal[name] = value
+        if len(values) > 1:
+            # a plain range on the leading field, so the index bounds the scan
+            name = self.ordering[0].lstrip('-')
+            lookup = '__lte' if self.ordering[0].startswith('-') != reverse else '__gte'
+            condition &= Q(**{name + lookup: values[0]})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset with the position filter on every ordering field
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*[f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self._position_filter(current_position, reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            following_position = None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class RecipientCursorPagination(MailPlanCursorPagination):
+    """Recipients in address order; the unique email index is the cursor position."""
+    ordering = ('email',)
@@ -0,0 +1,320 @@
+# backend/mailplans/rate_limit.py
+"""
+Distributed token-bucket rate limiting of outbound email.
+
+Every Celery worker shares the same buckets in Redis: one global bucket and
+one bucket per recipient domain. A bucket holds at most `burst` tokens and
+refills at `rate` tokens per second; each email takes one token from the
+global bucket and one from its domain's bucket. Both are checked and taken
+in one Lua script (atomic across workers, timed with the Redis clock so
+worker clock skew does not matter).
+
+The send tasks call partition(addresses) before delivering: addresses that
+got a token are sent now, the others are re-published to the queue with a
+countdown (the time until the next token) instead of sleeping in the worker.
+A countdown is an ETA message that a worker reserves and holds in memory
+until due, so it is capped at MAILPLAN_RATE_LIMIT_MAX_DEFER seconds: longer
+waits (slow buckets, e.g. "0.01/1") take several hops, a send still over the
+limit when it comes back is simply deferred again.
+
+Configuration (settings / env):
+
+    MAILPLAN_RATE_LIMIT_ENABLED        master switch
+    MAILPLAN_RATE_LIMIT_REDIS_URL      defaults to the Celery broker URL
+    MAILPLAN_RATE_LIMIT_GLOBAL         "<rate>/<burst>" for all email, e.g. "50/100" (empty = unlimited)
+    MAILPLAN_RATE_LIMIT_DOMAIN         default "<rate>/<burst>" per recipient domain
+    MAILPLAN_RATE_LIMIT_DOMAINS        per-domain overrides, e.g. "gmail.com=20/40,yahoo.com=5/10"
+    MAILPLAN_RATE_LIMIT_MAX_DEFER      longest countdown of a deferred send, in seconds (default 60)
+
+If Redis is unreachable the limiter fails open (everything is allowed and a
+warning is logged at most once a minute), so an outage of the limiter never
+stops delivery. bucket_levels() reports the current fill of the buckets.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "mailplan:ratelimit:"
+GLOBAL_BUCKET = "__global__"
+
+# KEYS: bucket keys. ARGV[1]: tokens wanted, then rate, burst for each key.
+# Grants as many tokens as every bucket can give (possibly 0) and returns
+# {granted, seconds until the next token is available in all buckets}.
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wanted = tonumber(ARGV[1])
+local grant = wanted
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local burst = tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if tokens == nil or ts == nil then
+        tokens = burst
+        ts = now
+    end
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    grant = math.min(grant, math.floor(tokens))
+end
+if grant < 0 then grant = 0 end
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local burst = tonumber(ARGV[2 * i + 1])
+    local left = levels[i] - grant
+    redis.call('HSET', key, 'tokens', tostring(left), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 60)
+    if grant < wanted and left < 1 then
+        wait = math.max(wait, (1 - left) / rate)
+    end
+end
+return {grant, tostring(wait)}
+"""
+
+# KEYS: bucket keys. ARGV: rate, burst for each key. Returns the refilled levels (read-only).
+_LEVELS_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local out = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if tokens == nil or ts == nil then
+        out[i] = tostring(burst)
+    else
+        out[i] = tostring(math.min(burst, tokens + math.max(0, now - ts) * rate))
+    end
+end
+return out
+"""
+
+
+def parse_limit(value):
+    """Parse "<rate>/<burst>" (or just "<rate>", burst = rate) into (rate, burst); None when unlimited."""
+    if not value:
+        return None
+    value = str(value).strip()
+    rate, _, burst = value.partition("/")
+    try:
+        rate = float(rate)
+        burst = float(burst) if burst else max(rate, 1.0)
+    except ValueError:
+        logger.warning("Ignoring invalid rate limit %r (expected <rate>/<burst>).", value)
+        return None
+    if rate <= 0:
+        return None
+    return rate, max(burst, 1.0)
+
+
+def parse_domain_limits(value):
+    """Parse "gmail.com=20/40,yahoo.com=5/10" into {domain: (rate, burst) or None}."""
+    limits = {}
+    for item in (value or "").replace("\n", ",").split(","):
+        domain, sep, limit = item.partition("=")
+        if sep and domain.strip():
+            limits[domain.strip().lower()] = parse_limit(limit)
+    return limits
+
+
+def domain_of(address):
+    return (address or "").rpartition("@")[2].strip().lower()
+
+
+class SendRateLimiter:
+    def __init__(self, redis_url, global_limit=None, domain_limit=None, domain_limits=None, prefix=KEY_PREFIX):
+        self.redis_url = redis_url
+        self.global_limit = global_limit
+        self.domain_limit = domain_limit
+        self.domain_limits = domain_limits or {}
+        self.prefix = prefix
+        self._client = None
+        self._scripts = {}
+        self._lock = threading.Lock()
+        self._last_warning = 0.0
+        self.stats = {"granted": 0, "deferred": 0, "fail_open": 0}
+
+    def _redis(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import redis
+
+                    client = redis.Redis.from_url(self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+                    self._scripts = {
+                        "acquire": client.register_script(_ACQUIRE_SCRIPT),
+                        "levels": client.register_script(_LEVELS_SCRIPT),
+                    }
+                    self._client = client
+        return self._client
+
+    def _warn(self, exc):
+        now = time.monotonic()
+        if now - self._last_warning > 60:
+            self._last_warning = now
+            logger.warning("Send rate limiter unavailable, allowing sends (fail open): %s", exc)
+
+    def limit_for(self, domain):
+        if domain in self.domain_limits:
+            return self.domain_limits[domain]
+        return self.domain_limit
+
+    def _buckets(self, domain):
+        """[(key, rate, burst)] for the buckets an email to `domain` draws from."""
+        buckets = []
+        if self.global_limit:
+            buckets.append((self.prefix + GLOBAL_BUCKET, *self.global_limit))
+        limit = self.limit_for(domain)
+        if limit and domain:
+            buckets.append((self.prefix + domain, *limit))
+        return buckets
+
+    def acquire(self, domain, count=1):
+        """
+        Take up to `count` tokens for emails to `domain`.
+        Returns (granted, wait_seconds); wait is the time until the next token.
+        """
+        buckets = self._buckets(domain)
+        if not buckets or count <= 0:
+            return count, 0.0
+        args = [count]
+        for _, rate, burst in buckets:
+            args += [rate, burst]
+        try:
+            self._redis()
+            granted, wait = self._scripts["acquire"](keys=[key for key, _, _ in buckets], args=args)
+            return int(granted), float(wait)
+        except Exception as exc:
+            self.stats["fail_open"] += 1
+            self._warn(exc)
+            return count, 0.0
+
+    def grant(self, addresses):
+        """
+        Take one token per address. Returns (set of granted positions in
+        `addresses`, wait_seconds until more tokens are available).
+        One script call per distinct domain.
+        """
+        by_domain = {}
+        for pos, addr in enumerate(addresses):
+            by_domain.setdefault(domain_of(addr), []).append(pos)
+
+        granted_positions = set()
+        wait = 0.0
+        for domain, positions in by_domain.items():
+            granted, domain_wait = self.acquire(domain, len(positions))
+            granted_positions.update(positions[:granted])
+            if granted < len(positions):
+                wait = max(wait, domain_wait)
+
+        self.stats["granted"] += len(granted_positions)
+        self.stats["deferred"] += len(addresses) - len(granted_positions)
+        return granted_positions, wait
+
+    def partition(self, addresses):
+        """Split addresses into (allowed, deferred, wait_seconds), keeping their order."""
+        granted, wait = self.grant(addresses)
+        allowed = [a for pos, a in enumerate(addresses) if pos in granted]
+        deferred = [a for pos, a in enumerate(addresses) if pos not in granted]
+        return allowed, deferred, wait
+
+    def bucket_levels(self, domains=None):
+        """
+        Current token levels: {"global": {...}, "domains": {domain: {...}}},
+        each entry {"tokens", "rate", "burst"}. Domains default to the
+        configured overrides.
+        """
+        result = {"enabled": True, "global": None, "domains": {}, "stats": dict(self.stats)}
+        entries = []
+        if self.global_limit:
+            entries.append(("global", None, self.prefix + GLOBAL_BUCKET, self.global_limit))
+        for domain in domains if domains is not None else sorted(self.domain_limits):
+            limit = self.limit_for(domain)
+            if limit:
+                entries.append(("domain", domain, self.prefix + domain, limit))
+        if not entries:
+            return result
+
+        args = []
+        for _, _, _, (rate, burst) in entries:
+            args += [rate, burst]
+        try:
+            self._redis()
+            levels = self._scripts["levels"](keys=[key for _, _, key, _ in entries], args=args)
+        except Exception as exc:
+            self._warn(exc)
+            result["error"] = str(exc)
+            return result
+
+        for (kind, domain, _, (rate, burst)), tokens in zip(entries, levels):
+            entry = {"tokens": round(float(tokens), 3), "rate": rate, "burst": burst}
+            if kind == "global":
+                result["global"] = entry
+            else:
+                result["domains"][domain] = entry
+        return result
+
+
+class _NoLimit:
+    """Stand-in used when rate limiting is disabled."""
+
+    stats = {}
+
+    def grant(self, addresses):
+        return set(range(len(addresses))), 0.0
+
+    def partition(self, addresses):
+        return list(addresses), [], 0.0
+
+    def bucket_levels(self, domains=None):
+        return {"enabled": False}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if not getattr(settings, "MAILPLAN_RATE_LIMIT_ENABLED", False):
+                    _limiter = _NoLimit()
+                else:
+                    _limiter = SendRateLimiter(
+                        redis_url=getattr(settings, "MAILPLAN_RATE_LIMIT_REDIS_URL", None) or settings.CELERY_BROKER_URL,
+                        global_limit=parse_limit(getattr(settings, "MAILPLAN_RATE_LIMIT_GLOBAL", "")),
+                        domain_limit=parse_limit(getattr(settings, "MAILPLAN_RATE_LIMIT_DOMAIN", "")),
+                        domain_limits=parse_domain_limits(getattr(settings, "MAILPLAN_RATE_LIMIT_DOMAINS", "")),
+                    )
+    return _limiter
+
+
+def defer_countdown(wait):
+    """
+    Countdown for re-published sends: the bucket wait plus jitter, so deferred
+    tasks do not return in lockstep. Capped (with jitter below the cap) at
+    MAILPLAN_RATE_LIMIT_MAX_DEFER seconds, see the module docstring.
+    """
+    max_defer = max(1.0, float(getattr(settings, "MAILPLAN_RATE_LIMIT_MAX_DEFER", 60)))
+    countdown = max(wait, 1.0) * random.uniform(1.0, 1.5)
+    if countdown > max_defer:
+        countdown = max_defer * random.uniform(0.75, 1.0)
+    return round(countdown, 2)
+
+
+def bucket_levels(domains=None):
+    return get_limiter().bucket_levels(domains)
@@ -0,0 +1,18 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import permissions
+
+from .rate_limit import bucket_levels
+
+
+class SendRateLimitView(APIView):
+    """
+    Current fill of the outbound send-rate token buckets.
+    GET /api/rate-limits/?domain=gmail.com&domain=yahoo.com
+    Without ?domain= the configured per-domain overrides are reported.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        domains = [d.strip().lower() for d in request.query_params.getlist('domain') if d.strip()]
+        return Response(bucket_levels(domains or None))
@@ -1,13 +1,23 @@
+from django.db.models import Exists, OuterRef, Subquery
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import permissions
-from .models import MailPlan
+from .models import MailPlanRecipient, Recipient
+from .pagination import RecipientCursorPagination
 
 
 class RecipientListView(APIView):
     """
     API endpoint to list all unique recipients with optional filters.
-    GET /api/recipients/?email=&name=&tag=
+    GET /api/recipients/?email=&name=&tag=&page_size=&cursor=
+
+    Recipients come from the normalized Recipient index (plan recipient_email
+    fields and flow email nodes, see mailplans/recipients.py); deduplication,
+    filtering and cursor pagination (by email) all happen in SQL.
+
+    Response: {next, previous, page_count, recipients}. There is no total
+    count (it would need a full COUNT over the index on every page);
+    page_count is the number of recipients on this page.
     """
     permission_classes = [permissions.IsAuthenticated]
 
@@ -16,32 +26,29 @@ class RecipientListView(APIView):
         name_filter = request.query_params.get('name')
         tag_filter = request.query_params.get('tag')
 
-        # Base queryset
-        qs = MailPlan.objects.all()
+        links = MailPlanRecipient.objects.filter(recipient=OuterRef('pk'))
+        # only recipients some plan still sends to
+        qs = Recipient.objects.filter(Exists(links))
 
-        # Apply optional filters
+        # Apply optional filters (trigram-indexed on Postgres)
         if email_filter:
-            qs = qs.filter(recipient_email__icontains=email_filter)
+            qs = qs.filter(email__icontains=email_filter)
         if name_filter:
-            qs = qs.filter(recipient_name__icontains=name_filter)  # ✅ updated field
+            qs = qs.filter(name__icontains=name_filter)
         if tag_filter:
-            # Optional: filter by tags or template_vars content
-            qs = qs.filter(template_vars__icontains=tag_filter)
-
-        # Build unique recipient list with richer info
-        recipients = {}
-        for plan in qs:
-            email = plan.recipient_email
-            if email not in recipients:
-                recipients[email] = {
-                    "email": plan.recipient_email,
-                    "name": plan.recipient_name or "",
-                    "plan": plan.name,
-                }
-
-        recipient_list = list(recipients.values())
+            # recipients of plans whose template_vars mention the tag
+            qs = qs.filter(Exists(links.filter(mailplan__template_vars__icontains=tag_filter)))
+
+        # name of the recipient's first plan, only for the rows of this page
+        first_plan = links.order_by('mailplan_id').values('mailplan__name')[:1]
+        rows = qs.values('email', 'name').annotate(plan=Subquery(first_plan))
+
+        paginator = RecipientCursorPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
 
         return Response({
-            "count": len(recipient_list),
-            "recipients": recipient_list,
+            "next": paginator.get_next_link(),
+            "previous": paginator.get_previous_link(),
+            "page_count": len(page),
+            "recipients": page,
         })
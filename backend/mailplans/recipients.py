@@ -0,0 +1,201 @@
+# backend/mailplans/recipients.py
+"""
+Normalized recipient index behind GET /api/recipients/.
+
+Every address a plan sends to - its recipient_email field and the
+recipient(s) of each email node of its flow - is a Recipient row (one per
+lower-cased address) linked to the plan by a MailPlanRecipient row. The
+links of a plan are re-synced whenever it is saved (post_save, see
+signals.py); plans written with bulk_create / QuerySet.update() are synced
+with `manage.py rebuild_recipients`.
+
+The recipient list then deduplicates, filters and pages in SQL:
+
+  - ordering / cursor pagination on the unique email index
+  - email / name substring filters: trigram GIN indexes on Postgres
+    (pg_trgm, created by migration 0020), a scan of the much smaller
+    Recipient table elsewhere
+  - tag filter: plans whose template_vars contain the tag (trigram index on
+    Postgres), joined through the recipient_mailplan_idx index
+"""
+
+import logging
+
+from django.db import transaction
+
+from .flow import FlowIR
+
+logger = logging.getLogger(__name__)
+
+# plan fields the recipient links are derived from
+SOURCE_FIELDS = frozenset(("recipient_email", "recipient_name", "flow", "flow_ir"))
+
+
+def split_addresses(value):
+    """Lower-cased addresses of a recipient value (comma/newline separated string or list)."""
+    if isinstance(value, (list, tuple)):
+        parts = value
+    else:
+        parts = str(value or "").replace("\n", ",").split(",")
+    addresses = []
+    for part in parts:
+        address = str(part).strip().lower()
+        # template placeholders ({{ email }}) are not addresses
+        if "@" in address and "{" not in address and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+def plan_recipients(mp):
+    """{email: (name, source)} of a plan; the recipient_email field wins over flow nodes."""
+    found = {}
+    try:
+        flow_ir = FlowIR(mp.flow, mp.flow_ir)
+        for node_id in flow_ir.email_nodes:
+            data = flow_ir.node_data(node_id)
+            name = str(data.get("recipient_name") or "").strip()
+            for address in split_addresses(data.get("recipient_email") or data.get("recipient")):
+                found.setdefault(address, (name, "flow"))
+    except Exception:
+        logger.exception("Could not read the flow recipients of MailPlan %s.", mp.pk)
+    name = (mp.recipient_name or "").strip()
+    for address in split_addresses(mp.recipient_email):
+        found[address] = (name or found.get(address, ("", ""))[0], "field")
+    return found
+
+
+class RecipientIndex:
+    def __init__(self, recipient_model=None, link_model=None):
+        # historical models can be passed in (migrations); the app models otherwise
+        self._recipient_model = recipient_model
+        self._link_model = link_model
+
+    @property
+    def recipient_model(self):
+        if self._recipient_model is None:
+            from .models import Recipient
+            return Recipient
+        return self._recipient_model
+
+    @property
+    def link_model(self):
+        if self._link_model is None:
+            from .models import MailPlanRecipient
+            return MailPlanRecipient
+        return self._link_model
+
+    def sync(self, plans):
+        """
+        Make the recipient links of `plans` match their current fields and
+        flows: upsert the Recipient rows, add / update / remove links and drop
+        recipients no plan links to any more. A few bulk statements per call.
+        """
+        Recipient, Link = self.recipient_model, self.link_model
+        wanted = {mp.pk: plan_recipients(mp) for mp in plans}
+        if not wanted:
+            return
+
+        names = {}
+        for found in wanted.values():
+            for address, (name, _) in found.items():
+                if name or address not in names:
+                    names[address] = name
+
+        with transaction.atomic():
+            named = [Recipient(email=a, name=n) for a, n in names.items() if n]
+            unnamed = [Recipient(email=a) for a, n in names.items() if not n]
+            if named:
+                Recipient.objects.bulk_create(
+                    named, update_conflicts=True, unique_fields=["email"], update_fields=["name"]
+                )
+            if unnamed:
+                Recipient.objects.bulk_create(unnamed, ignore_conflicts=True)
+            # the row locks keep a concurrent prune() off these recipients until
+            # the links below are committed
+            ids = self._lock_ids(list(names))
+            missing = [a for a in names if a not in ids]
+            if missing:
+                # deleted by a prune() that committed between the upsert and the lock
+                Recipient.objects.bulk_create(
+                    [Recipient(email=a, name=names[a]) for a in missing], ignore_conflicts=True
+                )
+                ids.update(self._lock_ids(missing))
+
+            existing = {
+                (mp_id, rec_id): (link_id, source)
+                for link_id, mp_id, rec_id, source in Link.objects.filter(mailplan_id__in=list(wanted))
+                .values_list("id", "mailplan_id", "recipient_id", "source")
+            }
+            desired = {
+                (mp_id, ids[address]): source
+                for mp_id, found in wanted.items()
+                for address, (_, source) in found.items()
+                if address in ids
+            }
+            stale = [key for key in existing if key not in desired]
+            if stale:
+                Link.objects.filter(id__in=[existing[key][0] for key in stale]).delete()
+            changed = [
+                Link(id=existing[key][0], source=source)
+                for key, source in desired.items()
+                if key in existing and existing[key][1] != source
+            ]
+            if changed:
+                Link.objects.bulk_update(changed, ["source"])
+            new = [
+                Link(mailplan_id=mp_id, recipient_id=rec_id, source=source)
+                for (mp_id, rec_id), source in desired.items()
+                if (mp_id, rec_id) not in existing
+            ]
+            if new:
+                Link.objects.bulk_create(new, ignore_conflicts=True)
+            if stale:
+                self.prune(recipient_ids={rec_id for _, rec_id in stale})
+
+    def _lock_ids(self, addresses):
+        return dict(
+            self.recipient_model.objects.select_for_update()
+            .filter(email__in=addresses).values_list("email", "id")
+        )
+
+    def prune(self, recipient_ids=None):
+        """
+        Delete recipients (all, or among `recipient_ids`) that no plan links
+        to; returns the count. Candidates are locked first and re-checked: a
+        sync() that looked one up holds its lock until its new links are
+        committed, and the re-check (a fresh statement) then sees them.
+        """
+        Recipient, Link = self.recipient_model, self.link_model
+        orphans = Recipient.objects.exclude(id__in=Link.objects.values("recipient_id"))
+        if recipient_ids is not None:
+            orphans = orphans.filter(id__in=list(recipient_ids))
+        with transaction.atomic():
+            candidates = list(orphans.select_for_update().values_list("id", flat=True))
+            if not candidates:
+                return 0
+            _, per_model = (
+                Recipient.objects.filter(id__in=candidates)
+                .exclude(id__in=Link.objects.values("recipient_id"))
+                .delete()
+            )
+        return per_model.get(Recipient._meta.label, 0)
+
+    def rebuild(self, plans, chunk_size=1000, progress=None):
+        """Sync every plan of the `plans` queryset, in id order and chunks; returns the plan count."""
+        done = 0
+        last_id = 0
+        plans = plans.only("id", "recipient_email", "recipient_name", "flow", "flow_ir").order_by("id")
+        while True:
+            chunk = list(plans.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            self.sync(chunk)
+            last_id = chunk[-1].id
+            done += len(chunk)
+            if progress:
+                progress(done)
+        self.prune()
+        return done
+
+
+recipient_index = RecipientIndex()
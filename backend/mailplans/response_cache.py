@@ -0,0 +1,125 @@
+# backend/mailplans/response_cache.py
+"""
+ETags and a serialized-response cache for the MailPlan API.
+
+Every write to a MailPlan bumps MailPlan.version (save() and the bulk
+status updates of the log writer / scheduler), so "<pk>-v<version>" is a
+strong ETag of the detail representation:
+
+    GET   /api/mailplans/{id}/   If-None-Match: <etag>  ->  304 when unchanged
+    PATCH /api/mailplans/{id}/   If-Match: <etag>       ->  412 when changed since
+
+List pages get an ETag hashed from their body, which still saves the
+transfer of unchanged pages.
+
+With MAILPLAN_RESPONSE_CACHE set to a cache alias (see CACHES), the
+serialized detail response is kept in that cache together with its ETag,
+so repeated reads (and their 304s) cost neither a query nor serializer
+work. Entries are dropped whenever a plan is written, right away and again
+when the transaction commits (so a reader cannot re-cache the old row in
+between); MAILPLAN_RESPONSE_CACHE_TTL bounds their lifetime anyway.
+"""
+
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "mailplan:detail:"
+
+
+def etag_for(pk, version):
+    return f'"{pk}-v{version}"'
+
+
+def body_etag(data):
+    """Strong ETag of a serialized (JSON-compatible) response body."""
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return '"%s"' % hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def etag_matches(header, etag):
+    """
+    True when an If-None-Match / If-Match header value lists `etag` (or is
+    "*"). Weak validators (W/"...") are compared by their opaque tag.
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class DetailCache:
+    """Serialized detail responses per plan id, stored as (etag, data)."""
+
+    def __init__(self, alias="", ttl=300):
+        self.alias = alias
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.alias)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, pk):
+        if not self.enabled:
+            return None
+        try:
+            entry = self.cache.get(f"{KEY_PREFIX}{pk}")
+        except Exception:
+            logger.exception("MailPlan response cache read failed.")
+            return None
+        self.stats["hits" if entry is not None else "misses"] += 1
+        return entry
+
+    def set(self, pk, etag, data):
+        if not self.enabled:
+            return
+        try:
+            self.cache.set(f"{KEY_PREFIX}{pk}", (etag, data), self.ttl)
+        except Exception:
+            logger.exception("MailPlan response cache write failed.")
+
+    def invalidate(self, pks):
+        """Drop the cached responses of `pks` now and once the current transaction commits."""
+        if not self.enabled:
+            return
+        keys = [f"{KEY_PREFIX}{pk}" for pk in pks]
+        if not keys:
+            return
+
+        def delete():
+            try:
+                self.cache.delete_many(keys)
+                self.stats["invalidations"] += len(keys)
+            except Exception:
+                logger.exception("MailPlan response cache invalidation failed.")
+
+        delete()
+        transaction.on_commit(delete)
+
+
+detail_cache = DetailCache(
+    alias=getattr(settings, "MAILPLAN_RESPONSE_CACHE", ""),
+    ttl=getattr(settings, "MAILPLAN_RESPONSE_CACHE_TTL", 300),
+)
+
+
+def invalidate(*pks):
+    detail_cache.invalidate(pks)
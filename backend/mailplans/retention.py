@@ -0,0 +1,256 @@
+# backend/mailplans/retention.py
+"""
+Time-based retention for EmailLog.
+
+archive_email_logs() moves EmailLog rows older than N days out of the
+database in two phases:
+
+ 1. Export: every row with created_at < cutoff (and id <= the highest such id
+    seen when the run started) is streamed with QuerySet.iterator() - a
+    server-side cursor on PostgreSQL - into a gzip-compressed NDJSON file,
+    one JSON object per line. The file is written under a temporary name,
+    fsync'ed and renamed, so a crash never leaves a half archive behind.
+ 2. Delete: only after the archive is complete, the same rows are deleted in
+    bounded batches of primary keys (one short transaction each), so the
+    purge never holds long locks or builds one huge DELETE.
+
+RenderedBody blobs that are no longer referenced by any EmailLog, and that
+no send used within MAILPLAN_RENDERED_BODY_GRACE_SECONDS, are then removed
+in batches as well (their HTML is written into the archive).
+
+When the emaillog table is a PostgreSQL range-partitioned table (partitioned
+by created_at), manage_partitions() creates the upcoming monthly partitions
+and detaches/drops whole months older than the cutoff, which is instant
+compared to row deletes. On any other database, or an unpartitioned table,
+it does nothing.
+"""
+
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = (
+    "id", "mailplan_id", "to_email", "subject", "body", "status",
+    "response_message", "created_at", "sent_at", "rendered_id",
+)
+
+
+def _serialize(log):
+    row = {}
+    for field in ARCHIVE_FIELDS:
+        value = getattr(log, field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        row[field] = value
+    row["rendered_html"] = log.rendered_html
+    return row
+
+
+def _cutoff_for(days):
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_path(archive_dir, cutoff):
+    stamp = timezone.now().strftime("%Y%m%dT%H%M%S")
+    return os.path.join(archive_dir, f"emaillog-before-{cutoff:%Y%m%d}-{stamp}.ndjson.gz")
+
+
+def export_email_logs(queryset, path, chunk_size=2000):
+    """
+    Stream `queryset` into a gzip NDJSON file at `path`.
+    Returns the number of rows written.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".partial"
+    written = 0
+    try:
+        with open(tmp_path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for log in queryset.select_related("rendered").order_by("pk").iterator(chunk_size=chunk_size):
+                gz.write(json.dumps(_serialize(log), default=str).encode("utf-8"))
+                gz.write(b"\n")
+                written += 1
+            gz.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+
+def delete_in_batches(queryset, batch_size=1000):
+    """
+    Delete the rows of `queryset` in primary-key batches, one transaction per
+    batch. Returns the number of `queryset.model` rows deleted; rows removed
+    by cascade are not counted.
+    """
+    model = queryset.model
+    deleted = 0
+    last_pk = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            deleted += model.objects.filter(pk__in=ids).delete()[1].get(model._meta.label, 0)
+        last_pk = ids[-1]
+    return deleted
+
+
+def purge_orphan_bodies(batch_size=1000, grace=None):
+    """
+    Delete RenderedBody rows no EmailLog references anymore and no send used
+    within the last `grace` seconds (default MAILPLAN_RENDERED_BODY_GRACE_SECONDS).
+
+    The log writer reuses an existing body without inserting it, and its
+    EmailLog rows only reference it once the flush commits. It refreshes
+    last_used_at before that, so each batch here locks its candidates and
+    re-checks last_used_at under the lock: a body being reused is skipped.
+    A batch that still fails (ProtectedError / IntegrityError: a log was
+    committed meanwhile) is rolled back and left for the next run.
+    """
+    from .models import RenderedBody
+
+    if grace is None:
+        grace = getattr(settings, "MAILPLAN_RENDERED_BODY_GRACE_SECONDS", 86400)
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    orphans = RenderedBody.objects.filter(email_logs__isnull=True, last_used_at__lt=cutoff)
+    deleted = 0
+    last_pk = ""
+    while True:
+        ids = list(orphans.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        try:
+            with transaction.atomic():
+                locked = list(
+                    orphans.filter(pk__in=ids).select_for_update(of=("self",)).values_list("pk", flat=True)
+                )
+                deleted += RenderedBody.objects.filter(pk__in=locked).delete()[1].get(RenderedBody._meta.label, 0)
+        except (ProtectedError, IntegrityError):
+            logger.warning("Skipped a batch of %s RenderedBody row(s) that are in use again.", len(ids))
+    return deleted
+
+
+def archive_email_logs(days=None, archive_dir=None, batch_size=None, dry_run=False):
+    """
+    Archive and delete EmailLog rows older than `days` days.
+    Returns a summary dict; nothing is deleted when the export fails.
+    """
+    from .models import EmailLog
+
+    days = days if days is not None else getattr(settings, "MAILPLAN_LOG_RETENTION_DAYS", 90)
+    archive_dir = archive_dir or getattr(settings, "MAILPLAN_LOG_ARCHIVE_DIR", "email_log_archive")
+    batch_size = batch_size or getattr(settings, "MAILPLAN_LOG_ARCHIVE_BATCH_SIZE", 1000)
+
+    cutoff = _cutoff_for(days)
+    old = EmailLog.objects.filter(created_at__lt=cutoff)
+    # pin the set of rows so rows created while exporting are never deleted unarchived
+    max_id = old.order_by("-pk").values_list("pk", flat=True).first()
+    summary = {
+        "cutoff": cutoff.isoformat(), "archived": 0, "deleted": 0,
+        "partitions_dropped": [], "bodies_deleted": 0, "file": None,
+    }
+    if max_id is None:
+        return summary
+    old = old.filter(pk__lte=max_id)
+
+    if dry_run:
+        summary["archived"] = old.count()
+        return summary
+
+    path = archive_path(archive_dir, cutoff)
+    summary["archived"] = export_email_logs(old, path, chunk_size=batch_size)
+    summary["file"] = path
+    logger.info("Archived %s EmailLog row(s) older than %s to %s.", summary["archived"], cutoff, path)
+
+    # whole months can go at once when the table is partitioned; batches handle the rest
+    partitions = manage_partitions(cutoff=cutoff)
+    summary["partitions_dropped"] = partitions["dropped"]
+    summary["deleted"] = delete_in_batches(old, batch_size=batch_size)
+    summary["bodies_deleted"] = purge_orphan_bodies(batch_size=batch_size)
+    return summary
+
+
+# ---------- optional PostgreSQL monthly partitions ----------
+
+def _month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d, months):
+    month = d.month - 1 + months
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def is_partitioned(table):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [table],
+        )
+        return cursor.fetchone() is not None
+
+
+def manage_partitions(cutoff=None, months_ahead=2, drop=True):
+    """
+    Create monthly partitions for the next `months_ahead` months and drop the
+    ones that end before `cutoff`. Partition names are <table>_yYYYYmMM.
+    Does nothing unless the EmailLog table is already range partitioned;
+    converting an existing table is a one-off migration for the DBA.
+    """
+    from .models import EmailLog
+
+    table = EmailLog._meta.db_table
+    result = {"partitioned": False, "created": [], "dropped": []}
+    if not is_partitioned(table):
+        return result
+    result["partitioned"] = True
+    qn = connection.ops.quote_name
+
+    this_month = _month_start(timezone.now().date())
+    with connection.cursor() as cursor:
+        for i in range(months_ahead + 1):
+            start = _add_months(this_month, i)
+            end = _add_months(start, 1)
+            name = f"{table}_y{start:%Y}m{start:%m}"
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {qn(name)} PARTITION OF {qn(table)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [datetime.combine(start, dt_time.min, dt_timezone.utc), datetime.combine(end, dt_time.min, dt_timezone.utc)],
+            )
+            result["created"].append(name)
+
+        if drop and cutoff is not None:
+            cutoff_month = _month_start(cutoff.date())
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = %s",
+                [table],
+            )
+            for (name,) in cursor.fetchall():
+                try:
+                    year, month = int(name[-7:-3]), int(name[-2:])
+                except ValueError:
+                    continue
+                if not name.startswith(f"{table}_y") or _add_months(date(year, month, 1), 1) > cutoff_month:
+                    continue
+                cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+                cursor.execute(f"DROP TABLE {qn(name)}")
+                result["dropped"].append(name)
+    return result
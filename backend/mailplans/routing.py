@@ -0,0 +1,92 @@
+# backend/mailplans/routing.py
+"""
+Queue and priority selection for the mail tasks.
+
+backend/celery.py declares four queues and routes every task to one of them
+by default:
+
+    transactional   send_mail_task          single triggered sends (button_click, on_signup)
+    bulk            send_mail_batch_task    campaigns, scheduled and after_1_day sends
+    planning        execute_flow_task       flow traversal / scheduling
+                    import_mailplans_task   bulk CSV / NDJSON imports
+    scheduler       periodic tasks          schedule_due_mailplans, dispatch_scheduled_sends, ...
+
+The default routes only know the task name. Callers that know the plan pass
+options from the helpers below, so a 100k-recipient campaign never shares a
+queue with a button_click send:
+
+ - MailPlan.send_queue = "auto" picks the transactional queue for
+   button_click/on_signup plans with at most
+   MAILPLAN_TRANSACTIONAL_MAX_RECIPIENTS addresses, and the bulk queue for
+   everything else. "transactional" or "bulk" forces a queue.
+ - MailPlan.priority (0 = lowest ... 9 = highest) becomes the broker message
+   priority within the queue. Redis orders priorities the other way round
+   (0 is served first), and broker_priority() handles the conversion.
+"""
+
+from django.conf import settings
+
+TRANSACTIONAL_QUEUE = "transactional"
+BULK_QUEUE = "bulk"
+PLANNING_QUEUE = "planning"
+SCHEDULER_QUEUE = "scheduler"
+
+TRANSACTIONAL_TRIGGERS = ("button_click", "on_signup")
+DEFAULT_PRIORITY = 5
+
+
+def recipient_count(recipient_email):
+    return len([r for r in (recipient_email or "").replace("\n", ",").split(",") if r.strip()])
+
+
+def queue_for(trigger_type, send_queue="auto", recipients=1):
+    if send_queue in (TRANSACTIONAL_QUEUE, BULK_QUEUE):
+        return send_queue
+    max_recipients = getattr(settings, "MAILPLAN_TRANSACTIONAL_MAX_RECIPIENTS", 10)
+    if trigger_type in TRANSACTIONAL_TRIGGERS and recipients <= max_recipients:
+        return TRANSACTIONAL_QUEUE
+    return BULK_QUEUE
+
+
+def broker_priority(priority):
+    """Plan priority (9 = most urgent) -> message priority for the configured broker."""
+    try:
+        priority = min(9, max(0, int(priority)))
+    except (TypeError, ValueError):
+        priority = DEFAULT_PRIORITY
+    broker = getattr(settings, "CELERY_BROKER_URL", "") or ""
+    if broker.startswith(("redis://", "rediss://", "redis+socket://")):
+        return 9 - priority
+    return priority
+
+
+def send_options(trigger_type, send_queue, priority, recipient_email):
+    """apply_async options for a send of a plan described by these field values."""
+    return {
+        "queue": queue_for(trigger_type, send_queue, recipient_count(recipient_email)),
+        "priority": broker_priority(priority),
+    }
+
+
+def plan_send_options(mp):
+    return send_options(
+        getattr(mp, "trigger_type", None),
+        getattr(mp, "send_queue", "auto"),
+        getattr(mp, "priority", DEFAULT_PRIORITY),
+        getattr(mp, "recipient_email", None),
+    )
+
+
+def plan_planning_options(mp):
+    return {"queue": PLANNING_QUEUE, "priority": broker_priority(getattr(mp, "priority", DEFAULT_PRIORITY))}
+
+
+def request_options(request):
+    """Queue/priority a task message was delivered with, to re-publish it on the same queue."""
+    info = getattr(request, "delivery_info", None) or {}
+    options = {}
+    if info.get("routing_key"):
+        options["queue"] = info["routing_key"]
+    if info.get("priority") is not None:
+        options["priority"] = info["priority"]
+    return options
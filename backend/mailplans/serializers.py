@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from .models import MailPlan
-import json
+from .models import ImportJob, MailPlan
+from .flow import FlowIR, FlowValidationError, parse_flow, validate_flow
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
@@ -12,36 +13,29 @@ class MailPlanSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = MailPlan
-        fields = '__all__'
+        # flow_ir is an internal compiled form of `flow`, not part of the API
+        exclude = ('flow_ir',)
 
-    def _compute_recipient_from_flow(self, flow_obj):
+    def validate(self, attrs):
         """
-        Given a flow (dict or JSON string), return the first email node's recipient
-        if present. Returns None when nothing found.
+        Compile the flow strictly (cycles, dangling edges, unreachable email
+        nodes, bad delays and size limits are rejected) and hand the compiled
+        IR, including the send schedule, to the model so it is stored as is.
         """
-        try:
-            if not flow_obj:
-                return None
-            # if stored as string, parse it
-            if isinstance(flow_obj, str):
-                flow = json.loads(flow_obj or "{}")
-            else:
-                flow = flow_obj
-            nodes = flow.get('nodes', []) if isinstance(flow, dict) else []
-            for node in nodes:
-                if not isinstance(node, dict):
-                    continue
-                node_type = node.get('type')
-                data = node.get('data') or {}
-                # prefer explicit email node or presence of recipient_email/recipient
-                if node_type == 'email' or data.get('recipient_email') or data.get('recipient'):
-                    email = data.get('recipient_email') or data.get('recipient')
-                    if email:
-                        return email
-        except Exception:
-            # fail silently and return None so fallback works
-            return None
-        return None
+        attrs = super().validate(attrs)
+        if 'flow' in attrs:
+            try:
+                ir = validate_flow(
+                    attrs['flow'],
+                    max_nodes=getattr(settings, 'MAILPLAN_FLOW_MAX_NODES', 0),
+                    max_edges=getattr(settings, 'MAILPLAN_FLOW_MAX_EDGES', 0),
+                    max_delay=getattr(settings, 'MAILPLAN_FLOW_MAX_DELAY_DAYS', 0) * 86400,
+                )
+            except FlowValidationError as exc:
+                raise serializers.ValidationError({'flow': exc.errors})
+            attrs['flow'] = parse_flow(attrs['flow'])
+            attrs['flow_ir'] = ir
+        return attrs
 
     def to_representation(self, instance):
         """
@@ -51,9 +45,12 @@ class MailPlanSerializer(serializers.ModelSerializer):
         """
         rep = super().to_representation(instance)
 
-        # Compute recipient from the instance.flow (preferred) or from rep['flow']
-        flow_val = getattr(instance, 'flow', None)
-        recipient_from_flow = self._compute_recipient_from_flow(flow_val)
+        # Recipient of the first email node, precomputed in the compiled flow
+        try:
+            recipient_from_flow = FlowIR.for_plan(instance).recipient
+        except Exception:
+            # fail silently so the fallback below works
+            recipient_from_flow = None
 
         if recipient_from_flow:
             rep['recipient_email'] = recipient_from_flow
@@ -64,6 +61,118 @@ class MailPlanSerializer(serializers.ModelSerializer):
         return rep
 
 
+def select_fields(query_params, available):
+    """
+    Field names requested with ?fields=a,b (only these) and/or ?exclude=c,d,
+    in the order of `available`. Raises ValidationError for unknown names.
+    """
+    def parse(name):
+        names = [n.strip() for n in (query_params.get(name) or '').split(',') if n.strip()]
+        unknown = [n for n in names if n not in available]
+        if unknown:
+            raise serializers.ValidationError({name: f"Unknown field(s): {', '.join(unknown)}"})
+        return set(names)
+
+    fields, exclude = parse('fields'), parse('exclude')
+    return [name for name in available if (not fields or name in fields) and name not in exclude]
+
+
+class MailPlanListSerializer(serializers.BaseSerializer):
+    """
+    Read-only representation of MailPlan rows fetched with .values() (see
+    MailPlanViewSet.list): no model instances are built and only the
+    selected columns are loaded. Each value is formatted by the matching
+    MailPlanSerializer field, so the output is the same as the detail view.
+    recipient_email comes from the `ir_recipient` annotation (the recipient
+    precomputed in flow_ir) instead of re-reading the flow.
+    """
+
+    def __init__(self, *args, fields=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        model_fields = MailPlanSerializer().fields
+        self.output_fields = [(name, model_fields[name]) for name in fields]
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        fields = kwargs.pop('fields', ())
+        kwargs['child'] = cls(fields=fields)
+        return serializers.ListSerializer(*args, **kwargs)
+
+    def to_representation(self, row):
+        rep = {}
+        for name, field in self.output_fields:
+            value = row.get(name)
+            if name == 'recipient_email':
+                value = row.get('ir_recipient') or value
+            rep[name] = None if value is None else field.to_representation(value)
+        return rep
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """Progress and outcome of a bulk import (read-only)."""
+
+    class Meta:
+        model = ImportJob
+        fields = (
+            'id', 'status', 'format', 'filename', 'chunk_size',
+            'committed_rows', 'imported_rows', 'failed_rows', 'errors', 'message',
+            'created_at', 'updated_at', 'started_at', 'finished_at',
+        )
+        read_only_fields = fields
+
+
+class ImportUploadSerializer(serializers.Serializer):
+    """POST /api/imports/ input: the file, its format (default: from the extension) and the chunk size."""
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=('csv', 'ndjson', 'jsonl'), required=False)
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_chunk_size(self, value):
+        limit = getattr(settings, 'MAILPLAN_IMPORT_MAX_CHUNK_SIZE', 10000)
+        if value > limit:
+            raise serializers.ValidationError(f"At most {limit} rows per chunk.")
+        return value
+
+
+class BulkTriggerSerializer(serializers.Serializer):
+    """
+    POST /api/mailplans/bulk_trigger/ input: plan `ids`, or a `filter`
+    (status, send_queue, priority: exact, one of the field's choices;
+    name: contains) selecting button_click plans. `confirm` must be true, as for a single trigger.
+    """
+    FILTERS = {'status': 'status', 'send_queue': 'send_queue', 'priority': 'priority', 'name': 'name__icontains'}
+    # exact filters that must be one of the model field's choices
+    CHOICE_FILTERS = ('status', 'send_queue', 'priority')
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    filter = serializers.DictField(required=False)
+    confirm = serializers.BooleanField(default=False)
+
+    def validate_filter(self, value):
+        unknown = sorted(set(value) - set(self.FILTERS))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown filter(s): {', '.join(unknown)}")
+        value = dict(value)
+        for key in self.CHOICE_FILTERS:
+            if key not in value:
+                continue
+            choices = [choice for choice, _ in MailPlan._meta.get_field(key).choices]
+            match = [choice for choice in choices if str(choice) == str(value[key])]
+            if not match:
+                raise serializers.ValidationError(
+                    {key: f"Unknown {key} {value[key]!r}; choose from {', '.join(map(str, choices))}."}
+                )
+            value[key] = match[0]
+        return {self.FILTERS[key]: val for key, val in value.items()}
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Give either ids or a filter.")
+        limit = getattr(settings, 'MAILPLAN_BULK_TRIGGER_MAX', 1000)
+        if len(attrs.get('ids', ())) > limit:
+            raise serializers.ValidationError({'ids': f"At most {limit} plans per request."})
+        return attrs
+
 
 class SafeTokenObtainPairSerializer(TokenObtainPairSerializer):
     """
@@ -19,11 +19,15 @@ those events explicitly to a handler instead of using a generic model post_save.
 import os
 import logging
 from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from .models import MailPlan
 from .tasks import send_mail_task
+from .idempotency import run_id_for
+from .routing import plan_send_options
+from . import response_cache
+from .recipients import SOURCE_FIELDS, recipient_index
 
 logger = logging.getLogger(__name__)
 
@@ -31,18 +35,40 @@ logger = logging.getLogger(__name__)
 ALLOW_AUTO_ENQUEUE = os.environ.get("ALLOW_AUTO_ENQUEUE", "0") in ("1", "true", "True")
 
 
-def _enqueue_send(mailplan_id):
+def _enqueue_send(mailplan_id, options=None):
     """
     Enqueue the task to send a MailPlan. Kept as a helper so we can call it
     from controlled places (e.g. transaction.on_commit).
+    `options` are extra apply_async options (queue / priority).
     """
     try:
-        send_mail_task.delay(mailplan_id)
+        # created plans are auto-enqueued once, so the run id is per plan
+        send_mail_task.apply_async(
+            args=(mailplan_id,), kwargs={"run_id": run_id_for("auto", mailplan_id)}, **(options or {})
+        )
         logger.info("Enqueued send_mail_task for MailPlan %s (via guarded signal)", mailplan_id)
     except Exception as exc:
         logger.exception("Failed to enqueue send_mail_task for MailPlan %s: %s", mailplan_id, exc)
 
 
+@receiver(post_save, sender=MailPlan)
+@receiver(post_delete, sender=MailPlan)
+def invalidate_mailplan_response(sender, instance, **kwargs):
+    """Drop the cached API response of a written / deleted plan (see response_cache)."""
+    response_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=MailPlan)
+def sync_mailplan_recipients(sender, instance, update_fields=None, **kwargs):
+    """Keep the Recipient index in step with the plan's recipient field and flow (see recipients.py)."""
+    if update_fields is not None and not SOURCE_FIELDS.intersection(update_fields):
+        return
+    try:
+        recipient_index.sync([instance])
+    except Exception:
+        logger.exception("Failed to sync recipients of MailPlan %s", instance.pk)
+
+
 @receiver(post_save, sender=MailPlan)
 def schedule_mailplan_send(sender, instance, created, **kwargs):
     """
@@ -80,7 +106,8 @@ def schedule_mailplan_send(sender, instance, created, **kwargs):
 
     # Enqueue after transaction commit to ensure the MailPlan exists in DB
     try:
-        transaction.on_commit(lambda: _enqueue_send(instance.id))
+        options = plan_send_options(instance)
+        transaction.on_commit(lambda: _enqueue_send(instance.id, options))
         logger.info("Scheduled enqueue_on_commit for MailPlan %s (auto-enqueue enabled).", instance.id)
     except Exception:
         logger.exception("Failed to schedule enqueue_on_commit for MailPlan %s", instance.id)
@@ -0,0 +1,258 @@
+# backend/mailplans/smtp_pool.py
+"""
+Per-process pool of reusable email backend connections.
+
+Opening an SMTP connection costs a full TCP + EHLO + STARTTLS + AUTH handshake.
+send_mail_task used to pay that price for every single email. This module keeps
+a small number of opened backend instances alive inside each Celery worker
+process and hands them out to tasks:
+
+    from .smtp_pool import pooled_connection
+
+    with pooled_connection() as connection:
+        EmailMessage(..., connection=connection).send()
+
+ - Idle connections are closed once they have been unused for longer than
+   EMAIL_POOL_IDLE_TIMEOUT seconds.
+ - Before a connection that has been idle for more than
+   EMAIL_POOL_HEALTHCHECK_AFTER seconds is reused it is checked with NOOP;
+   stale connections are discarded and a new one is opened transparently.
+ - At most EMAIL_POOL_SIZE connections are open at the same time; callers
+   wait for a free connection when the pool is exhausted.
+ - If the block raises, the connection is discarded instead of being returned,
+   so a broken session is never handed to the next task.
+
+Counters (new connections, reuses, stale discards, ...) are available through
+pool_stats() so reuse vs. reconnect ratios can be monitored.
+"""
+
+import logging
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.smtp import EmailBackend as SMTPBackend
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnectionPool:
+    """
+    Thread-safe pool of opened email backend instances.
+
+    The pool works with any Django email backend. Only the SMTP backend is
+    health-checked: a closed one (no smtplib session) is stale, an open one is
+    checked with NOOP. Other backends (locmem, console, dummy) are always
+    considered healthy.
+    """
+
+    def __init__(self, max_size=4, idle_timeout=60, healthcheck_after=5, backend=None):
+        self.max_size = max(1, int(max_size))
+        self.idle_timeout = float(idle_timeout)
+        self.healthcheck_after = float(healthcheck_after)
+        self.backend = backend
+        # idle connections as (backend_instance, last_used_monotonic)
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._counters = {
+            "created": 0,
+            "reused": 0,
+            "stale": 0,
+            "expired": 0,
+            "discarded": 0,
+            "closed": 0,
+            "waits": 0,
+        }
+
+    # ---------- internal helpers ----------
+
+    def _open_new(self):
+        connection = get_connection(backend=self.backend)
+        connection.open()
+        return connection
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.debug("Ignoring error while closing pooled email connection.", exc_info=True)
+
+    def _is_closed(self, connection):
+        """An SMTP backend whose session was closed (e.g. after a send error)."""
+        return isinstance(connection, SMTPBackend) and connection.connection is None
+
+    def _is_healthy(self, connection):
+        if not isinstance(connection, SMTPBackend):
+            # non-SMTP backends (locmem/console/dummy) have nothing to check
+            return True
+        if connection.connection is None:
+            return False
+        try:
+            code, _ = connection.connection.noop()
+            return code == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    # ---------- public API ----------
+
+    def acquire(self, timeout=None):
+        """
+        Return an opened backend instance, reusing an idle one when possible.
+        Blocks while max_size connections are in use.
+        """
+        to_close = []
+        candidate = None
+        with self._cond:
+            while not self._idle and self._in_use >= self.max_size:
+                self._counters["waits"] += 1
+                if not self._cond.wait(timeout=timeout):
+                    raise TimeoutError("Timed out waiting for a pooled email connection.")
+
+            now = time.monotonic()
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if now - last_used > self.idle_timeout:
+                    self._counters["expired"] += 1
+                    to_close.append(connection)
+                    continue
+                candidate = (connection, now - last_used)
+                break
+            self._in_use += 1
+
+        for connection in to_close:
+            self._close(connection)
+
+        try:
+            if candidate is not None:
+                connection, idle_for = candidate
+                if self._is_closed(connection):
+                    healthy = False
+                else:
+                    healthy = idle_for <= self.healthcheck_after or self._is_healthy(connection)
+                if healthy:
+                    with self._cond:
+                        self._counters["reused"] += 1
+                    return connection
+                logger.info("Pooled email connection is closed or failed the NOOP health check; reconnecting.")
+                with self._cond:
+                    self._counters["stale"] += 1
+                self._close(connection)
+
+            connection = self._open_new()
+            with self._cond:
+                self._counters["created"] += 1
+            return connection
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, connection):
+        """Return a healthy connection to the pool for reuse."""
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def discard(self, connection):
+        """Close a connection that must not be reused (e.g. after a send error)."""
+        with self._cond:
+            self._in_use -= 1
+            self._counters["discarded"] += 1
+            self._cond.notify()
+        self._close(connection)
+
+    def close_all(self):
+        """Close every idle connection (used on worker shutdown)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._counters["closed"] += len(idle)
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._counters)
+            data["idle"] = len(self._idle)
+            data["in_use"] = self._in_use
+            data["max_size"] = self.max_size
+        return data
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the pool for the current process. A new pool is created after a
+    fork so prefork worker children never share sockets with their parent.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = SMTPConnectionPool(
+                    max_size=getattr(settings, "EMAIL_POOL_SIZE", 4),
+                    idle_timeout=getattr(settings, "EMAIL_POOL_IDLE_TIMEOUT", 60),
+                    healthcheck_after=getattr(settings, "EMAIL_POOL_HEALTHCHECK_AFTER", 5),
+                )
+                _pool_pid = pid
+    return _pool
+
+
+@contextmanager
+def pooled_connection():
+    """
+    Context manager yielding a pooled backend connection. When pooling is
+    disabled (EMAIL_POOL_ENABLED=False) a fresh connection is opened and closed
+    around the block, which matches the previous per-send behaviour.
+    """
+    if not getattr(settings, "EMAIL_POOL_ENABLED", True):
+        connection = get_connection()
+        try:
+            connection.open()
+            yield connection
+        finally:
+            connection.close()
+        return
+
+    pool = get_pool()
+    connection = pool.acquire()
+    try:
+        yield connection
+    except BaseException:
+        pool.discard(connection)
+        raise
+    else:
+        pool.release(connection)
+
+
+def reset_pool():
+    """Close and forget this process' pool (it is re-created from the current settings on next use)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and _pool_pid == os.getpid():
+        pool.close_all()
+
+
+def pool_stats():
+    """Counters for the current process' pool (reuse vs. new connections etc.)."""
+    return get_pool().stats()
+
+
+@worker_process_shutdown.connect
+def _close_pool_on_shutdown(**kwargs):
+    if _pool is not None and _pool_pid == os.getpid():
+        logger.info("Closing pooled email connections: %s", _pool.stats())
+        _pool.close_all()
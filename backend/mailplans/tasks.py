@@ -2,84 +2,35 @@
 from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta
-from django.core.mail import EmailMessage, get_connection
-from django.template import Template, Context
+from django.core.mail import EmailMessage
+from django.template import Context
 from django.conf import settings
-
-from .models import MailPlan, EmailLog
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import MailPlan, EmailLog, RenderedBody, ScheduledSend
+from .smtp_pool import pooled_connection
+from .template_cache import get_compiled_template
+from .flow import FlowIR
+from .log_writer import log_writer
+from .retention import archive_email_logs
+from .importer import ImportConflict, run_import
+from .rate_limit import get_limiter, defer_countdown
+from . import async_delivery
+from .idempotency import idempotency, make_key, new_run_id, run_id_for
+from .routing import PLANNING_QUEUE, broker_priority, plan_send_options, request_options, send_options
+from . import metrics
+from . import response_cache
 import logging
 import json
 import os
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 
-def _safe_update_log(log, **kwargs):
-    """Safely update EmailLog fields without breaking task flow."""
-    try:
-        for k, v in kwargs.items():
-            setattr(log, k, v)
-        log.save(update_fields=list(kwargs.keys()))
-    except Exception:
-        logger.exception("Failed to update EmailLog record safely.")
-
-
-def _extract_first_email_node(flow_value):
-    """
-    Given a flow (maybe dict or JSON string), return the first node dict
-    whose type is 'email' OR which contains recipient_email in data.
-    Returns None if not found.
-    """
-    try:
-        if not flow_value:
-            return None
-        flow = flow_value
-        if isinstance(flow_value, str):
-            try:
-                flow = json.loads(flow_value or "{}")
-            except Exception:
-                flow = {}
-        if not isinstance(flow, dict):
-            return None
-        nodes = flow.get("nodes", []) or []
-        for node in nodes:
-            if not isinstance(node, dict):
-                continue
-            node_type = node.get("type")
-            data = node.get("data") or {}
-            if node_type == "email" or data.get("recipient_email") or data.get("recipient"):
-                return {"node": node, "data": data}
-    except Exception:
-        logger.exception("Failed to parse flow to find email node.")
-    return None
-
-
-def _extract_email_node_by_id(flow_value, node_id):
-    """
-    Find a node in flow with the given id and return its dict and data.
-    """
-    try:
-        if not flow_value:
-            return None
-        flow = flow_value
-        if isinstance(flow_value, str):
-            try:
-                flow = json.loads(flow_value or "{}")
-            except Exception:
-                flow = {}
-        if not isinstance(flow, dict):
-            return None
-        nodes = flow.get("nodes", []) or []
-        for node in nodes:
-            if not isinstance(node, dict):
-                continue
-            if node.get("id") == node_id:
-                return {"node": node, "data": node.get("data") or {}}
-    except Exception:
-        logger.exception("Failed to parse flow to find node by id.")
-    return None
-
-
 def _render_with_template(text, context_vars):
     """
     Render a Django template string with context_vars using Template/Context.
@@ -88,8 +39,8 @@ def _render_with_template(text, context_vars):
     try:
         if text is None:
             return ""
-        # ensure text is str
-        tpl = Template(str(text))
+        # compiled templates are cached per process (keyed by a hash of the text)
+        tpl = get_compiled_template(text)
         ctx = Context(context_vars or {})
         return tpl.render(ctx)
     except Exception:
@@ -105,49 +56,20 @@ def _render_with_template(text, context_vars):
             return str(text)
 
 
-@shared_task(bind=True, max_retries=5)
-def send_mail_task(self, mailplan_id, node_id=None):
+def _resolve_message_parts(mp, node_id=None):
     """
-    Celery task to send an email for a given MailPlan ID.
-    Optionally accepts node_id to target a specific email node in the flow.
+    Collect everything needed to build the email for a MailPlan (and optional
+    flow node): recipient, merged template vars, raw subject and content.
+    Node-level values take precedence over the top-level MailPlan fields.
     """
-    # --- EMERGENCY SAFETY LOCK ---
-    # Set environment variable DISABLE_EMAIL_SEND=1 to skip actual sending while debugging.
-    if os.environ.get("DISABLE_EMAIL_SEND", "0") in ("1", "true", "True"):
-        logger.warning(f"[MailPlan:{mailplan_id}] send_mail_task skipped because DISABLE_EMAIL_SEND is set.")
-        try:
-            mp = MailPlan.objects.filter(id=mailplan_id).first()
-            if mp:
-                try:
-                    EmailLog.objects.create(
-                        mailplan=mp,
-                        to_email="(skipped)",
-                        subject="(skipped)",
-                        body="Skipped sending due to DISABLE_EMAIL_SEND flag",
-                        status="skipped",
-                        response_message="send_skipped_by_debug_flag"
-                    )
-                except Exception:
-                    logger.exception("Failed to create skip EmailLog entry for MailPlan %s", mailplan_id)
-        except Exception:
-            logger.exception("Error while recording skip for MailPlan %s", mailplan_id)
-        return {"status": "skipped", "reason": "DISABLE_EMAIL_SEND set"}
-    # --- END SAFETY LOCK ---
+    # Extract node-level data via the compiled flow: prefer provided node_id,
+    # otherwise the first email node
+    flow_ir = FlowIR.for_plan(mp)
+    node = flow_ir.node(node_id) if node_id else None
+    if not node:
+        node = flow_ir.first_email_node()
 
-    try:
-        mp = MailPlan.objects.get(id=mailplan_id)
-    except MailPlan.DoesNotExist:
-        logger.error(f"[MailPlan:{mailplan_id}] Not found.")
-        return {"status": "error", "reason": "MailPlan not found"}
-
-    # Extract node-level data: prefer provided node_id, otherwise find first email node
-    node_info = None
-    if node_id:
-        node_info = _extract_email_node_by_id(mp.flow, node_id)
-    if not node_info:
-        node_info = _extract_first_email_node(mp.flow)
-
-    node_data = node_info.get("data") if node_info else {}
+    node_data = (node.get("data") or {}) if node else {}
 
     # Determine recipient (node-level takes precedence)
     recipient = None
@@ -177,31 +99,17 @@ def send_mail_task(self, mailplan_id, node_id=None):
     raw_subject = (node_data.get("subject") if node_data and node_data.get("subject") else mp.subject) or ""
     raw_content = (node_data.get("body") if node_data and node_data.get("body") else getattr(mp, "content", None)) or ""
 
-    # Create EmailLog entry (best-effort)
-    log = None
-    try:
-        log = EmailLog.objects.create(
-            mailplan=mp,
-            to_email=recipient or '',
-            subject=raw_subject,
-            body=raw_content,
-            status="pending"
-        )
-    except Exception:
-        logger.exception(f"[MailPlan:{mailplan_id}] Failed to create EmailLog.")
-        log = None
+    return {
+        "recipient": recipient,
+        "template_vars": merged_vars,
+        "subject": raw_subject,
+        "content": raw_content,
+    }
 
-    # Render templates
-    try:
-        rendered_subject = _render_with_template(raw_subject, merged_vars)
-        rendered_content = _render_with_template(raw_content, merged_vars)
-    except Exception as e:
-        logger.exception(f"[MailPlan:{mailplan_id}] Template rendering failed: {e}")
-        rendered_subject = raw_subject
-        rendered_content = raw_content
 
-    # Build HTML + plain text fallback
-    html_body = f"""
+def _build_html_body(rendered_subject, rendered_content):
+    """Wrap the rendered content into the standard HTML email layout."""
+    return f"""
     <html>
       <body style="font-family: Arial, sans-serif; background: #f9fafb; padding: 20px;">
         <div style="max-width:600px;margin:auto;background:white;border-radius:10px;
@@ -215,293 +123,1119 @@ def send_mail_task(self, mailplan_id, node_id=None):
     </html>
     """
 
-    text_body = rendered_content if isinstance(rendered_content, str) else str(rendered_content)
 
-    # Store rendered body in EmailLog
-    if log:
-        try:
-            if hasattr(log, "rendered_body"):
-                log.rendered_body = html_body
-            log.subject = rendered_subject
-            log.body = text_body
-            log.save(update_fields=[f for f in ("rendered_body", "subject", "body") if hasattr(log, f)])
-        except Exception:
-            logger.exception(f"[MailPlan:{mailplan_id}] Failed to save rendered content to EmailLog.")
+def _render_message(mailplan_id, raw_subject, raw_content, template_vars):
+    """
+    Render subject and content templates and build the HTML body.
+    Returns (rendered_subject, text_body, html_body).
+    """
+    try:
+        rendered_subject = _render_with_template(raw_subject, template_vars)
+        rendered_content = _render_with_template(raw_content, template_vars)
+    except Exception as e:
+        logger.exception(f"[MailPlan:{mailplan_id}] Template rendering failed: {e}")
+        rendered_subject = raw_subject
+        rendered_content = raw_content
+
+    html_body = _build_html_body(rendered_subject, rendered_content)
+    text_body = rendered_content if isinstance(rendered_content, str) else str(rendered_content)
+    return rendered_subject, text_body, html_body
 
-    # Validate recipient
-    if not recipient:
-        logger.error(f"[MailPlan:{mailplan_id}] No recipient found (node or top-level). Aborting send.")
-        if log:
-            _safe_update_log(log, status="failed", response_message="no_recipient")
-        try:
-            mp.status = "failed"
-            mp.save(update_fields=["status"])
-        except Exception:
-            logger.exception(f"[MailPlan:{mailplan_id}] Failed to update MailPlan status to failed.")
-        return {"status": "failed", "reason": "no_recipient"}
 
-    # Support multiple recipients if node_data/recipient is a list
-    recipients = []
+def _split_recipients(recipient):
+    """Normalize a recipient value (string, comma/newline list or list) into a list."""
     if isinstance(recipient, str):
         # allow comma or newline separated addresses
-        recipients = [r.strip() for r in recipient.replace("\n", ",").split(",") if r.strip()]
-    elif isinstance(recipient, (list, tuple)):
-        recipients = list(recipient)
-    else:
-        recipients = [str(recipient)]
+        return [r.strip() for r in recipient.replace("\n", ",").split(",") if r.strip()]
+    if isinstance(recipient, (list, tuple)):
+        return list(recipient)
+    return [str(recipient)]
+
+
+def _build_email(subject, html_body, recipients, connection):
+    email = EmailMessage(
+        subject=subject,
+        body=html_body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=recipients,
+        connection=connection,
+    )
+    email.content_subtype = "html"
+    return email
 
-    # Send the email
+
+def _is_permanent_failure(exc):
+    """Recipient rejections will fail again on retry; everything else is treated as transient."""
+    return isinstance(exc, smtplib.SMTPRecipientsRefused)
+
+
+def _deliver_slice(messages):
+    """
+    Send messages sequentially over one pooled connection.
+    Returns a list of (sent_count, exception_or_None) in input order.
+    """
+    outcomes = []
     try:
-        connection = get_connection()
-        email = EmailMessage(
-            subject=rendered_subject,
-            body=html_body,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=recipients,
-            connection=connection,
+        with pooled_connection() as connection:
+            for subject, html_body, recipients in messages:
+                started = time.perf_counter()
+                try:
+                    sent_count = connection.send_messages([_build_email(subject, html_body, recipients, connection)])
+                    outcomes.append((sent_count, None))
+                except Exception as exc:
+                    outcomes.append((0, exc))
+                    if not _is_permanent_failure(exc):
+                        # the session may be broken: reopen it for the next message, so
+                        # the pool gets a live session back (a failing open() discards it)
+                        connection.close()
+                        connection.open()
+                metrics.observe_smtp("threads", time.perf_counter() - started)
+    except Exception as exc:
+        # no connection could be opened: every message left in the slice failed
+        outcomes.extend((0, exc) for _ in range(len(messages) - len(outcomes)))
+    return outcomes
+
+
+_async_warned = False
+
+
+def _warn_async_unavailable():
+    global _async_warned
+    if not _async_warned:
+        _async_warned = True
+        logger.warning(
+            "MAILPLAN_DELIVERY_ENGINE=asyncio needs aiosmtplib and the SMTP email backend; "
+            "using the threaded engine instead."
         )
-        email.content_subtype = "html"
 
-        sent_count = email.send(fail_silently=False)
 
-        # Mark as sent
-        if log:
-            _safe_update_log(
-                log,
-                status="sent" if sent_count else "failed",
-                sent_at=timezone.now(),
-                response_message=f"sent_count={sent_count}",
-            )
+def _deliver_messages(messages):
+    """
+    Deliver (subject, html_body, [recipients]) messages and return a list of
+    (sent_count, exception_or_None) in input order.
+
+    Threaded engine (default): up to MAILPLAN_SEND_CONCURRENCY threads are
+    used; each thread takes one pooled SMTP connection and sends its share of
+    the messages over it. The threads never touch the database.
+    With MAILPLAN_DELIVERY_ENGINE = "asyncio" the messages are multiplexed
+    over many SMTP sessions on one event loop instead (see async_delivery).
+    """
+    if not messages:
+        return []
+    if getattr(settings, "MAILPLAN_DELIVERY_ENGINE", "threads") == "asyncio":
+        if async_delivery.available():
+            return async_delivery.deliver_messages(messages)
+        _warn_async_unavailable()
+    concurrency = min(max(1, getattr(settings, "MAILPLAN_SEND_CONCURRENCY", 1)), len(messages))
+    if concurrency == 1:
+        return _deliver_slice(messages)
+
+    slices = [messages[i::concurrency] for i in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mailplan-send") as executor:
+        results = list(executor.map(_deliver_slice, slices))
+
+    # undo the round-robin split to restore input order
+    outcomes = [None] * len(messages)
+    for i, slice_outcomes in enumerate(results):
+        for j, outcome in enumerate(slice_outcomes):
+            outcomes[i + j * concurrency] = outcome
+    return outcomes
+
+
+def _chunked(items, size):
+    size = max(1, int(size or 1))
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def enqueue_sends(pairs, eta=None, run_id=None, queue=None, priority=None, producer=None):
+    """
+    Enqueue delivery for a list of (mailplan_id, node_id) pairs, or
+    (mailplan_id, node_id, run_id) triples. `run_id` is used for pairs that
+    do not carry their own. `queue` / `priority` override the default route
+    (see mailplans/routing.py); `producer` publishes over a connection the
+    caller already holds.
+
+    With MAILPLAN_SEND_BATCH_SIZE > 1 the pairs are grouped into
+    send_mail_batch_task messages of that size (one DB query and one SMTP
+    session per batch); otherwise one send_mail_task is enqueued per pair.
+    Returns the number of Celery messages published.
+    """
+    pairs = [(p[0], p[1], (p[2] if len(p) > 2 else None) or run_id) for p in pairs]
+    if not pairs:
+        return 0
+    options = {"eta": eta} if eta else {}
+    if queue:
+        options["queue"] = queue
+    if priority is not None:
+        options["priority"] = priority
+    if producer is not None:
+        options["producer"] = producer
+    batch_size = getattr(settings, "MAILPLAN_SEND_BATCH_SIZE", 1)
+
+    if batch_size and batch_size > 1:
+        published = 0
+        for chunk in _chunked(pairs, batch_size):
+            chunk = [[mp_id, node_id, None, pair_run_id] for mp_id, node_id, pair_run_id in chunk]
+            send_mail_batch_task.apply_async(args=(chunk,), **options)
+            published += 1
+        return published
+
+    for mp_id, node_id, pair_run_id in pairs:
+        args = (mp_id, node_id) if node_id else (mp_id,)
+        kwargs = {"run_id": pair_run_id} if pair_run_id else {}
+        send_mail_task.apply_async(args=args, kwargs=kwargs, **options)
+    return len(pairs)
+
+
+@shared_task(bind=True, max_retries=5, acks_late=True)
+def send_mail_task(self, mailplan_id, node_id=None, recipients=None, run_id=None, log_keys=None):
+    """
+    Celery task to send an email for a given MailPlan ID.
+    Optionally accepts node_id to target a specific email node in the flow.
 
+    Every recipient address gets its own message and EmailLog row; lists are
+    delivered concurrently (see _deliver_messages). EmailLog rows and the plan
+    status are written in bulk by the log writer once the outcome is known. `recipients` restricts
+    the send to a subset of the node's addresses and is used by retries so
+    only transiently failed addresses are sent again.
+
+    `run_id` names the firing of the plan this send belongs to. Each
+    (plan, node, run, recipient) send carries an idempotency key that is
+    claimed before rendering, so redelivered or duplicated messages do not
+    send twice (see mailplans/idempotency.py). Without a run_id every call is
+    a new run.
+
+    Addresses that fail transiently keep their EmailLog row ("pending") and
+    are retried with `log_keys` (the idempotency keys of those rows): the
+    retry re-delivers the stored message without re-rendering it and updates
+    the same rows (see _resume_deliveries).
+    """
+    # --- EMERGENCY SAFETY LOCK ---
+    # Set environment variable DISABLE_EMAIL_SEND=1 to skip actual sending while debugging.
+    if os.environ.get("DISABLE_EMAIL_SEND", "0") in ("1", "true", "True"):
+        logger.warning(f"[MailPlan:{mailplan_id}] send_mail_task skipped because DISABLE_EMAIL_SEND is set.")
         try:
-            mp.status = "sent" if sent_count else "failed"
-            mp.save(update_fields=["status"])
+            mp = MailPlan.objects.filter(id=mailplan_id).first()
+            if mp:
+                try:
+                    EmailLog.objects.create(
+                        mailplan=mp,
+                        to_email="(skipped)",
+                        subject="(skipped)",
+                        body="Skipped sending due to DISABLE_EMAIL_SEND flag",
+                        status="skipped",
+                        response_message="send_skipped_by_debug_flag"
+                    )
+                except Exception:
+                    logger.exception("Failed to create skip EmailLog entry for MailPlan %s", mailplan_id)
         except Exception:
-            logger.exception(f"[MailPlan:{mailplan_id}] Failed to update MailPlan status.")
+            logger.exception("Error while recording skip for MailPlan %s", mailplan_id)
+        return {"status": "skipped", "reason": "DISABLE_EMAIL_SEND set"}
+    # --- END SAFETY LOCK ---
 
-        logger.info(f"[MailPlan:{mp.id}] Email sent to {recipients}")
-        return {"status": "sent", "mailplan_id": mp.id, "recipient": recipients}
+    if log_keys:
+        return _resume_send(self, mailplan_id, node_id, run_id, log_keys)
 
-    except Exception as exc:
-        # Handle transient failures (SMTP/network)
-        logger.exception(f"[MailPlan:{mailplan_id}] Failed to send email: {exc}")
+    try:
+        with metrics.timed("send_mail_task", "load"):
+            mp = MailPlan.objects.get(id=mailplan_id)
+    except MailPlan.DoesNotExist:
+        logger.error(f"[MailPlan:{mailplan_id}] Not found.")
+        return {"status": "error", "reason": "MailPlan not found"}
 
-        if log:
-            _safe_update_log(log, status="failed", response_message=str(exc))
+    with metrics.timed("send_mail_task", "flow"):
+        parts = _resolve_message_parts(mp, node_id)
+    recipient = parts["recipient"]
+    merged_vars = parts["template_vars"]
+    raw_subject = parts["subject"]
+    raw_content = parts["content"]
+    run_id = run_id or new_run_id("send")
 
-        try:
-            mp.status = "failed"
-            mp.save(update_fields=["status"])
-        except Exception:
-            logger.exception(f"[MailPlan:{mailplan_id}] Failed to update MailPlan to 'failed'.")
+    # Validate recipient
+    if not recipient:
+        logger.error(f"[MailPlan:{mailplan_id}] No recipient found (node or top-level). Aborting send.")
+        rendered_subject, text_body, html_body = _render_message(mailplan_id, raw_subject, raw_content, merged_vars)
+        log_writer.add(EmailLog(
+            mailplan=mp,
+            to_email='',
+            subject=rendered_subject,
+            body=text_body,
+            rendered_id=log_writer.store_body(html_body),
+            status="failed",
+            response_message="no_recipient",
+        ))
+        log_writer.set_plan_status(mp.id, "failed")
+        _flush_logs(mailplan_id)
+        return {"status": "failed", "reason": "no_recipient"}
 
-        # Exponential backoff retry
-        retries = getattr(self.request, "retries", 0)
-        countdown = min(60 * (2 ** retries), 3600)
+    # One message (and one EmailLog row) per address; a retry only targets
+    # the addresses that failed last time.
+    targets = _split_recipients(recipient)
+    if recipients:
+        targets = [r for r in recipients if r]
+    targets = list(dict.fromkeys(targets))
+
+    # Idempotency: drop addresses this run already sent (or is sending) before
+    # doing any rendering or network work.
+    keys = {addr: make_key(mailplan_id, node_id, run_id, addr) for addr in targets}
+    with metrics.timed("send_mail_task", "claim"):
+        _, duplicate_keys = idempotency.claim(list(keys.values()))
+    duplicates = [addr for addr in targets if keys[addr] in duplicate_keys]
+    metrics.count_emails("send_mail_task", "duplicate", len(duplicates))
+    if duplicates:
+        targets = [addr for addr in targets if keys[addr] not in duplicate_keys]
+        logger.info(f"[MailPlan:{mailplan_id}] Skipping {len(duplicates)} duplicate send(s) for run {run_id}.")
+    if not targets:
+        return {"status": "duplicate", "mailplan_id": mp.id, "run_id": run_id, "duplicates": duplicates}
+
+    # Traffic shaping: addresses over the global / per-domain send rate are
+    # re-published with a countdown instead of waiting in this worker.
+    with metrics.timed("send_mail_task", "rate_limit"):
+        targets, deferred, wait = get_limiter().partition(targets)
+    metrics.count_emails("send_mail_task", "deferred", len(deferred))
+    if deferred:
+        idempotency.release([keys[addr] for addr in deferred])
+        countdown = defer_countdown(wait)
+        send_mail_task.apply_async(
+            args=(mailplan_id, node_id), kwargs={"recipients": deferred, "run_id": run_id}, countdown=countdown,
+            **request_options(self.request),
+        )
+        logger.info(f"[MailPlan:{mailplan_id}] Rate limited: {len(deferred)} recipient(s) deferred by {countdown}s.")
+    if not targets:
+        return {"status": "deferred", "mailplan_id": mp.id, "deferred": deferred}
+
+    # Render templates + build HTML / plain text bodies (once for all recipients)
+    with metrics.timed("send_mail_task", "render"):
+        rendered_subject, text_body, html_body = _render_message(mailplan_id, raw_subject, raw_content, merged_vars)
+
+        # EmailLog rows are only built here and written once, with their final
+        # status, by the buffered log writer after delivery. All of them share
+        # one compressed copy of the rendered HTML.
+        body_hash = log_writer.store_body(html_body)
+    logs = [
+        EmailLog(
+            mailplan=mp,
+            to_email=addr,
+            subject=rendered_subject,
+            body=text_body,
+            rendered_id=body_hash,
+            status="pending",
+            idempotency_key=keys[addr],
+            run_id=run_id,
+        )
+        for addr in targets
+    ]
+
+    # Send over pooled (kept-alive) SMTP connections, concurrently for long
+    # lists, MAILPLAN_SEND_LOG_CHUNK addresses at a time. The rows of each
+    # chunk are written as soon as it is delivered: a redelivery of a long
+    # (acks_late) send finds them in EmailLog even once the in-flight claims
+    # of its keys have expired, and does not send those addresses again.
+    sent, retryable, rejected = [], [], []
+    last_exc = None
+    chunk_size = max(1, getattr(settings, "MAILPLAN_SEND_LOG_CHUNK", 200))
+    for start in range(0, len(targets), chunk_size):
+        chunk = list(zip(targets[start:start + chunk_size], logs[start:start + chunk_size]))
+        with metrics.timed("send_mail_task", "smtp"):
+            outcomes = _deliver_messages([(rendered_subject, html_body, [addr]) for addr, _ in chunk])
+
+        now = timezone.now()
+        finished = []
+        for (addr, log), (sent_count, exc) in zip(chunk, outcomes):
+            if sent_count:
+                sent.append(addr)
+                finished.append(keys[addr])
+                log.status = "sent"
+                log.sent_at = now
+                log.response_message = f"sent_count={sent_count}"
+                continue
+            log.response_message = str(exc) if exc else f"sent_count={sent_count}"
+            if exc is not None and not _is_permanent_failure(exc):
+                # the row stays pending (and its key claimed) until the retry updates it
+                retryable.append(addr)
+                last_exc = exc
+            else:
+                log.status = "failed"
+                rejected.append(addr)
+                finished.append(keys[addr])
+            logger.warning(f"[MailPlan:{mailplan_id}] Failed to send email to {addr}: {exc}")
+
+        idempotency.complete(finished)
+        with metrics.timed("send_mail_task", "log_write"):
+            log_writer.add(*[log for _, log in chunk])
+            if start + chunk_size < len(targets):
+                _flush_logs(mailplan_id)
+
+    metrics.count_emails("send_mail_task", "sent", len(sent))
+    metrics.count_emails("send_mail_task", "failed", len(retryable))
+    metrics.count_emails("send_mail_task", "rejected", len(rejected))
+    with metrics.timed("send_mail_task", "log_write"):
+        log_writer.set_plan_status(mp.id, "sent" if sent and not (retryable or rejected) else "failed")
+        # a chunk whose flush failed is still buffered and written here (see log_writer)
+        logged = _flush_logs(mailplan_id)
+
+    if sent:
+        logger.info(f"[MailPlan:{mp.id}] Email sent to {sent}")
+    result = {
+        "status": "sent" if not (retryable or rejected) else ("partial" if sent else "failed"),
+        "mailplan_id": mp.id,
+        "recipient": sent,
+        "failed": retryable + rejected,
+        "deferred": deferred,
+        "duplicates": duplicates,
+        "run_id": run_id,
+    }
+
+    if retryable:
+        # Exponential backoff retry, only for the recipients that failed
+        # transiently. It resumes from the logged rows; if they could not be
+        # written, it falls back to rendering the message again.
+        retry_keys = [keys[addr] for addr in retryable]
+        if logged:
+            kwargs = {"run_id": run_id, "log_keys": retry_keys}
+        else:
+            idempotency.release(retry_keys)
+            kwargs = {"recipients": retryable, "run_id": run_id}
+        if _retry_logged(self, retry_keys, last_exc, args=(mailplan_id, node_id), kwargs=kwargs):
+            logger.error(f"[MailPlan:{mailplan_id}] Max retries exceeded.")
+            return {"status": "failed", "reason": "max_retries_exceeded"}
 
-        try:
-            raise self.retry(exc=exc, countdown=countdown)
-        except self.MaxRetriesExceededError:
+    return result
+
+
+def _resume_send(task, mailplan_id, node_id, run_id, log_keys):
+    """send_mail_task retry: re-deliver the logged rows of `log_keys`."""
+    resumed = _resume_deliveries(log_keys, "send_mail_task")
+    with metrics.timed("send_mail_task", "log_write"):
+        _flush_logs(mailplan_id)
+
+    deferred = [log.idempotency_key for log in resumed["deferred"]]
+    if deferred:
+        countdown = defer_countdown(resumed["wait"])
+        send_mail_task.apply_async(
+            args=(mailplan_id, node_id), kwargs={"run_id": run_id, "log_keys": deferred}, countdown=countdown,
+            **request_options(task.request),
+        )
+        logger.info(f"[MailPlan:{mailplan_id}] Rate limited: {len(deferred)} retried recipient(s) deferred by {countdown}s.")
+
+    failed = resumed["retry"] + resumed["rejected"]
+    result = {
+        "status": "sent" if not failed else ("partial" if resumed["sent"] else "failed"),
+        "mailplan_id": mailplan_id,
+        "recipient": [log.to_email for log in resumed["sent"]],
+        "failed": [log.to_email for log in failed],
+        "deferred": [log.to_email for log in resumed["deferred"]],
+        "skipped": resumed["skipped"],
+        "run_id": run_id,
+    }
+    if resumed["retry"]:
+        retry_keys = [log.idempotency_key for log in resumed["retry"]]
+        kwargs = {"run_id": run_id, "log_keys": retry_keys}
+        if _retry_logged(task, retry_keys, resumed["exc"], args=(mailplan_id, node_id), kwargs=kwargs):
             logger.error(f"[MailPlan:{mailplan_id}] Max retries exceeded.")
             return {"status": "failed", "reason": "max_retries_exceeded"}
+    return result
+
 
+RESUME_FIELDS = ("status", "sent_at", "response_message", "attempts")
 
-# helper to convert flow into graph (unchanged)
-def _flow_to_graph(flow):
+
+def _resume_deliveries(log_keys, task_name):
     """
-    Convert flow dict into adjacency mapping and node map.
+    Retry path of both send tasks: re-deliver the EmailLog rows (by
+    idempotency key) that a transient failure left "pending", straight from
+    their stored subject and rendered body. The plan, its flow and the
+    templates are not loaded again and no new row is written; each row is
+    updated in place with the outcome and its attempt count.
+
+    Returns a dict with lists of rows under "sent", "retry" (failed
+    transiently again, still pending), "rejected" and "deferred" (over the
+    send rate, not attempted), plus "wait" (seconds until the rate limiter
+    has tokens again), "exc" (last transient error) and "skipped" (keys that
+    were already finished or are being retried by another message).
+    Outcomes are counted in the metrics under `task_name`.
     """
-    nodes_map = {}
-    adjacency = {}
-    nodes = flow.get("nodes", []) or []
-    edges = flow.get("edges", []) or []
+    with metrics.timed(task_name, "load"):
+        logs = list(
+            EmailLog.objects.filter(idempotency_key__in=log_keys, status="pending")
+            .defer("body")
+        )
+    with metrics.timed(task_name, "claim"):
+        claimed = set(idempotency.claim_attempts({log.idempotency_key: log.attempts for log in logs}))
+    logs = [log for log in logs if log.idempotency_key in claimed]
+    resumed = {
+        "sent": [], "retry": [], "rejected": [], "deferred": [],
+        "wait": 0.0, "exc": None, "skipped": len(set(log_keys)) - len(logs),
+    }
+    metrics.count_emails(task_name, "duplicate", resumed["skipped"])
+    if not logs:
+        return resumed
+
+    with metrics.timed(task_name, "rate_limit"):
+        granted, resumed["wait"] = get_limiter().grant([log.to_email for log in logs])
+    resumed["deferred"] = [log for pos, log in enumerate(logs) if pos not in granted]
+    idempotency.release_attempts({log.idempotency_key: log.attempts for log in resumed["deferred"]})
+    logs = [log for pos, log in enumerate(logs) if pos in granted]
+
+    # rows of one send share a compressed body: load and decompress each once
+    with metrics.timed(task_name, "load"):
+        bodies = {
+            blob.hash: blob.text
+            for blob in RenderedBody.objects.filter(hash__in={log.rendered_id for log in logs if log.rendered_id})
+        }
+    with metrics.timed(task_name, "smtp"):
+        outcomes = _deliver_messages([
+            (log.subject, bodies.get(log.rendered_id) if log.rendered_id else log.rendered_body, [log.to_email])
+            for log in logs
+        ])
 
-    for n in nodes:
-        nodes_map[n.get("id")] = n
+    now = timezone.now()
+    plan_status = {}
+    for log, (sent_count, exc) in zip(logs, outcomes):
+        log.attempts += 1
+        if sent_count:
+            log.status = "sent"
+            log.sent_at = now
+            log.response_message = f"sent_count={sent_count}"
+            resumed["sent"].append(log)
+            plan_status.setdefault(log.mailplan_id, "sent")
+        else:
+            log.response_message = str(exc) if exc else f"sent_count={sent_count}"
+            if exc is not None and not _is_permanent_failure(exc):
+                resumed["retry"].append(log)
+                resumed["exc"] = exc
+            else:
+                log.status = "failed"
+                resumed["rejected"].append(log)
+            plan_status[log.mailplan_id] = "failed"
+            logger.warning(
+                f"[MailPlan:{log.mailplan_id}] Retry {log.attempts} to {log.to_email} failed: {exc}"
+            )
+        log_writer.update(log, RESUME_FIELDS)
+
+    idempotency.complete([log.idempotency_key for log in resumed["sent"] + resumed["rejected"]])
+    for mp_id, st in plan_status.items():
+        log_writer.set_plan_status(mp_id, st)
+    metrics.count_emails(task_name, "deferred", len(resumed["deferred"]))
+    metrics.count_emails(task_name, "sent", len(resumed["sent"]))
+    metrics.count_emails(task_name, "failed", len(resumed["retry"]))
+    metrics.count_emails(task_name, "rejected", len(resumed["rejected"]))
+    return resumed
 
-    for e in edges:
-        src = e.get("source")
-        tgt = e.get("target")
-        if not src or not tgt:
-            continue
-        adjacency.setdefault(src, []).append(tgt)
 
-    return nodes_map, adjacency
+def _retry_logged(task, log_keys, exc, args, kwargs):
+    """
+    Retry `task` with exponential backoff. When the retries are exhausted the
+    rows still pending for `log_keys` are marked failed and True is returned.
+    """
+    retries = getattr(task.request, "retries", 0)
+    task_name = task.name.rpartition(".")[2]
+    # checked here: retry() re-raises `exc` (not MaxRetriesExceededError) once the limit is hit
+    if task.max_retries is not None and retries >= task.max_retries:
+        EmailLog.objects.filter(idempotency_key__in=log_keys, status="pending").update(status="failed")
+        idempotency.complete(log_keys)
+        metrics.count_emails(task_name, "gave_up", len(log_keys))
+        return True
+    metrics.count_retry(task_name)
+    raise task.retry(args=args, kwargs=kwargs, exc=exc, countdown=min(60 * (2 ** retries), 3600))
+
+
+def _normalize_pairs(pairs):
+    """
+    Accept [(id, node_id)], [[id, node_id]] (JSON), [id, node_id, [recipients]]
+    (retries of a subset of recipients), [id, node_id, recipients, run_id] or
+    bare ids.
+    Returns a list of (mailplan_id, node_id, recipients_or_None, run_id_or_None).
+    """
+    normalized = []
+    for item in pairs or []:
+        if isinstance(item, (list, tuple)):
+            mp_id = item[0]
+            node_id = item[1] if len(item) > 1 else None
+            recipients = item[2] if len(item) > 2 else None
+            run_id = item[3] if len(item) > 3 else None
+        else:
+            mp_id, node_id, recipients, run_id = item, None, None, None
+        try:
+            normalized.append((int(mp_id), node_id or None, list(recipients) if recipients else None, run_id or None))
+        except (TypeError, ValueError):
+            logger.warning("send_mail_batch_task: ignoring invalid pair %r", item)
+    return normalized
 
 
-def _duration_seconds(duration, unit):
-    if not duration:
-        return 0
-    unit = (unit or "").lower()
+def _flush_logs(label):
+    """Best-effort flush of the buffered EmailLog/MailPlan writes of this task; False if it failed."""
     try:
-        dur_val = int(duration)
+        log_writer.flush()
     except Exception:
+        logger.exception(f"[MailPlan:{label}] Failed to write EmailLog rows / plan status.")
+        return False
+    return True
+
+
+@shared_task(bind=True, max_retries=5, acks_late=True)
+def send_mail_batch_task(self, pairs, log_keys=None):
+    """
+    Send many (mailplan_id, node_id) emails in one task.
+
+    All MailPlans are loaded with a single query, every message is rendered up
+    front (one message per recipient address) and the messages are delivered
+    over pooled SMTP sessions (see _deliver_messages). The EmailLog rows are
+    then written with their outcome in one bulk INSERT via the log writer. Only recipients whose delivery failed transiently are retried,
+    with exponential backoff; the retry carries their rows' `log_keys` and
+    re-delivers the stored messages (see _resume_deliveries).
+    """
+    if log_keys:
+        return _resume_batch(self, log_keys)
+
+    pairs = _normalize_pairs(pairs)
+    if not pairs:
+        return {"status": "empty", "sent": 0, "failed": 0}
+
+    with metrics.timed("send_mail_batch_task", "load"):
+        plans = MailPlan.objects.in_bulk({mp_id for mp_id, _, _, _ in pairs})
+
+    # --- EMERGENCY SAFETY LOCK (see send_mail_task) ---
+    if os.environ.get("DISABLE_EMAIL_SEND", "0") in ("1", "true", "True"):
+        logger.warning("send_mail_batch_task skipped %s sends because DISABLE_EMAIL_SEND is set.", len(pairs))
         try:
-            dur_val = float(duration)
-            dur_val = int(dur_val)
+            EmailLog.objects.bulk_create([
+                EmailLog(
+                    mailplan=plans[mp_id],
+                    to_email="(skipped)",
+                    subject="(skipped)",
+                    body="Skipped sending due to DISABLE_EMAIL_SEND flag",
+                    status="skipped",
+                    response_message="send_skipped_by_debug_flag",
+                )
+                for mp_id, _, _, _ in pairs if mp_id in plans
+            ])
         except Exception:
-            dur_val = 0
-    if unit == "minutes":
-        return dur_val * 60
-    if unit == "hours":
-        return dur_val * 3600
-    if unit == "days":
-        return dur_val * 86400
-    # fallback to seconds when numeric provided
-    return dur_val
+            logger.exception("Failed to create skip EmailLog entries for batch.")
+        return {"status": "skipped", "reason": "DISABLE_EMAIL_SEND set"}
+    # --- END SAFETY LOCK ---
+
+    missing = [mp_id for mp_id, _, _, _ in pairs if mp_id not in plans]
+    if missing:
+        logger.error("send_mail_batch_task: MailPlans not found: %s", missing)
+
+    # Resolve recipients and claim idempotency keys for the whole batch (one
+    # cache round trip + one DB query) before anything is rendered
+    resolved = []  # (mailplan_id, node_id, run_id, parts, [(addr, key)])
+    all_keys = []
+    for mp_id, node_id, only_recipients, run_id in pairs:
+        mp = plans.get(mp_id)
+        if mp is None:
+            continue
+        run_id = run_id or new_run_id("send")
+        with metrics.timed("send_mail_batch_task", "flow"):
+            parts = _resolve_message_parts(mp, node_id)
+        targets = _split_recipients(parts["recipient"]) if parts["recipient"] else []
+        if only_recipients:
+            targets = only_recipients
+        keyed = [(addr, make_key(mp_id, node_id, run_id, addr)) for addr in dict.fromkeys(targets)]
+        all_keys.extend(key for _, key in keyed)
+        resolved.append((mp_id, node_id, run_id, parts, keyed))
+    with metrics.timed("send_mail_batch_task", "claim"):
+        _, duplicate_keys = idempotency.claim(all_keys)
+    duplicates = 0
+
+    # Render everything before touching the network
+    items = []  # (mailplan_id, node_id, log, recipient_or_None, subject, html_body)
+    for mp_id, node_id, run_id, parts, keyed in resolved:
+        mp = plans[mp_id]
+        if keyed:
+            fresh = [(addr, key) for addr, key in keyed if key not in duplicate_keys]
+            duplicates += len(keyed) - len(fresh)
+            if not fresh:
+                continue
+        else:
+            fresh = [(None, None)]
+        with metrics.timed("send_mail_batch_task", "render"):
+            rendered_subject, text_body, html_body = _render_message(
+                mp_id, parts["subject"], parts["content"], parts["template_vars"]
+            )
+            body_hash = log_writer.store_body(html_body)
+        for addr, key in fresh:
+            log = EmailLog(
+                mailplan=mp,
+                to_email=addr or "",
+                subject=rendered_subject,
+                body=text_body,
+                rendered_id=body_hash,
+                status="pending" if addr else "failed",
+                response_message=None if addr else "no_recipient",
+                idempotency_key=key,
+                run_id=run_id,
+            )
+            items.append((mp_id, node_id, log, addr, rendered_subject, html_body))
+    metrics.count_emails("send_mail_batch_task", "duplicate", duplicates)
+    if duplicates:
+        logger.info("send_mail_batch_task: skipped %s duplicate send(s).", duplicates)
+
+    plan_status = {}
+    for mp_id, _, _, addr, _, _ in items:
+        if not addr:
+            plan_status[mp_id] = "failed"
+
+    deliverable = [item for item in items if item[3]]
+
+    # Traffic shaping (see send_mail_task): over-rate recipients go back to the
+    # queue with a countdown and get no EmailLog row yet.
+    with metrics.timed("send_mail_batch_task", "rate_limit"):
+        granted, wait = get_limiter().grant([item[3] for item in deliverable])
+    metrics.count_emails("send_mail_batch_task", "deferred", len(deliverable) - len(granted))
+    deferred = {}  # (mailplan_id, node_id, run_id) -> [recipients]
+    for pos, (mp_id, node_id, log, addr, _, _) in enumerate(deliverable):
+        if pos not in granted:
+            deferred.setdefault((mp_id, node_id, log.run_id), []).append(addr)
+    if deferred:
+        idempotency.release([item[2].idempotency_key for pos, item in enumerate(deliverable) if pos not in granted])
+        deliverable = [item for pos, item in enumerate(deliverable) if pos in granted]
+        kept = {id(item) for item in deliverable}
+        items = [item for item in items if not item[3] or id(item) in kept]
+        countdown = defer_countdown(wait)
+        send_mail_batch_task.apply_async(
+            args=([[mp_id, node_id, addrs, run_id] for (mp_id, node_id, run_id), addrs in deferred.items()],),
+            countdown=countdown,
+            **request_options(self.request),
+        )
+        logger.info("send_mail_batch_task: rate limited, %s recipient(s) deferred by %ss.",
+                    sum(len(a) for a in deferred.values()), countdown)
+    with metrics.timed("send_mail_batch_task", "smtp"):
+        outcomes = _deliver_messages([(subject, html_body, [addr]) for _, _, _, addr, subject, html_body in deliverable])
+
+    now = timezone.now()
+    retry = {}  # (mailplan_id, node_id, run_id) -> [recipients]
+    finished_keys, retry_keys = [], []
+    outcome_counts = {"sent": 0, "failed": 0, "rejected": 0}
+    last_exc = None
+    for (mp_id, node_id, log, addr, _, _), (sent_count, exc) in zip(deliverable, outcomes):
+        if sent_count:
+            outcome_counts["sent"] += 1
+            log.status = "sent"
+            log.sent_at = now
+            log.response_message = f"sent_count={sent_count}"
+            plan_status.setdefault(mp_id, "sent")
+            finished_keys.append(log.idempotency_key)
+            continue
+        logger.warning("[MailPlan:%s] Batch send to %s failed for node %s: %s", mp_id, addr, node_id, exc)
+        log.response_message = str(exc) if exc else f"sent_count={sent_count}"
+        plan_status[mp_id] = "failed"
+        if exc is not None and not _is_permanent_failure(exc):
+            # the row stays pending (and its key claimed) until the retry updates it
+            outcome_counts["failed"] += 1
+            retry.setdefault((mp_id, node_id, log.run_id), []).append(addr)
+            retry_keys.append(log.idempotency_key)
+            last_exc = exc
+        else:
+            outcome_counts["rejected"] += 1
+            log.status = "failed"
+            finished_keys.append(log.idempotency_key)
+    idempotency.complete(finished_keys)
+
+    for status, count in outcome_counts.items():
+        metrics.count_emails("send_mail_batch_task", status, count)
+
+    # one bulk INSERT for all rows (with final status) + one UPDATE per plan status
+    with metrics.timed("send_mail_batch_task", "log_write"):
+        log_writer.add(*[item[2] for item in items])
+        for mp_id, st in plan_status.items():
+            log_writer.set_plan_status(mp_id, st)
+        logged = _flush_logs("batch")
+
+    sent = sum(1 for item in items if item[2].status == "sent")
+    result = {
+        "status": "done",
+        "sent": sent,
+        "failed": len(items) - sent,
+        "deferred": sum(len(a) for a in deferred.values()),
+        "duplicates": duplicates,
+        "missing": missing,
+    }
+    logger.info("send_mail_batch_task finished: %s", result)
+
+    if retry:
+        if logged:
+            args, kwargs = ([],), {"log_keys": retry_keys}
+        else:
+            # the rows were not written: retry the full send for these recipients
+            idempotency.release(retry_keys)
+            retry_pairs = [[mp_id, node_id, addrs, run_id] for (mp_id, node_id, run_id), addrs in retry.items()]
+            args, kwargs = (retry_pairs,), {}
+        if _retry_logged(self, retry_keys, last_exc, args=args, kwargs=kwargs):
+            logger.error("send_mail_batch_task: max retries exceeded for %s recipient(s)", len(retry_keys))
+            result["reason"] = "max_retries_exceeded"
+    return result
+
+
+def _resume_batch(task, log_keys):
+    """send_mail_batch_task retry: re-deliver the logged rows of `log_keys`."""
+    resumed = _resume_deliveries(log_keys, "send_mail_batch_task")
+    with metrics.timed("send_mail_batch_task", "log_write"):
+        _flush_logs("batch")
+
+    deferred = [log.idempotency_key for log in resumed["deferred"]]
+    if deferred:
+        countdown = defer_countdown(resumed["wait"])
+        send_mail_batch_task.apply_async(
+            args=([],), kwargs={"log_keys": deferred}, countdown=countdown, **request_options(task.request),
+        )
+        logger.info("send_mail_batch_task: rate limited, %s retried recipient(s) deferred by %ss.",
+                    len(deferred), countdown)
+
+    result = {
+        "status": "done",
+        "sent": len(resumed["sent"]),
+        "failed": len(resumed["retry"]) + len(resumed["rejected"]),
+        "deferred": len(deferred),
+        "skipped": resumed["skipped"],
+    }
+    logger.info("send_mail_batch_task retry finished: %s", result)
+    if resumed["retry"]:
+        retry_keys = [log.idempotency_key for log in resumed["retry"]]
+        if _retry_logged(task, retry_keys, resumed["exc"], args=([],), kwargs={"log_keys": retry_keys}):
+            logger.error("send_mail_batch_task: max retries exceeded for %s recipient(s)", len(retry_keys))
+            result["reason"] = "max_retries_exceeded"
+    return result
 
 
 @shared_task(bind=True)
-def execute_flow_task(self, mailplan_id):
+def execute_flow_task(self, mailplan_id, run_id=None):
     """
     Traverse the saved flow and schedule send_mail_task calls
-    respecting Delay nodes. This runs once per trigger.
-
-    The implementation schedules send_mail_task.apply_async with ETA when there
-    is an accumulated delay; otherwise it enqueues immediate send.
+    respecting Delay nodes. This runs once per trigger; `run_id` identifies
+    that trigger and is handed to every send it schedules (idempotency).
+
+    The send offsets come from the schedule stored with the compiled flow
+    (a topological pass done once at save time, see flow.compute_schedule),
+    so flows with many converging delay branches schedule completely and
+    deterministically; cycles are detected and reported. Traversal size
+    (nodes, edges, sends) and lookup time (elapsed_ms) are returned in the
+    task result.
+
+    Email nodes without delay are handed to enqueue_sends() right away
+    (batched into send_mail_batch_task messages when MAILPLAN_SEND_BATCH_SIZE
+    > 1). Delayed email nodes are written to the ScheduledSend table in bulk
+    and published by dispatch_scheduled_sends once they are due.
     """
     try:
-        mp = MailPlan.objects.get(id=mailplan_id)
+        with metrics.timed("execute_flow_task", "load"):
+            mp = MailPlan.objects.get(id=mailplan_id)
     except MailPlan.DoesNotExist:
         logger.error("MailPlan %s not found", mailplan_id)
         return
 
-    flow_val = getattr(mp, "flow", {}) or {}
-    if isinstance(flow_val, str):
-        try:
-            flow_val = json.loads(flow_val or "{}")
-        except Exception:
-            flow_val = {}
-
-    if not isinstance(flow_val, dict):
-        logger.warning("Flow for MailPlan %s is not a dict, aborting execute_flow_task", mailplan_id)
-        return
+    run_id = run_id or new_run_id("flow")
+    with metrics.timed("execute_flow_task", "flow"):
+        flow_ir = FlowIR.for_plan(mp)
 
-    nodes_map, adjacency = _flow_to_graph(flow_val)
-
-    # find a start node: preference: node with type 'start' else any trigger node
-    start_id = None
-    for nid, n in nodes_map.items():
-        if (n.get("type") == "start") or (n.get("id") == "start"):
-            start_id = nid
-            break
-    if not start_id:
-        # find any trigger node
-        for nid, n in nodes_map.items():
-            if n.get("type") == "trigger":
-                start_id = nid
-                break
+    # start node precomputed by the flow compiler: 'start' node, else any trigger node
+    start_id = flow_ir.start
 
     if not start_id:
         logger.warning("No start or trigger node found for MailPlan %s; fallback to scheduling immediate send", mailplan_id)
         # fallback: call send_mail_task directly (no node)
         try:
-            send_mail_task.delay(mp.id)
+            send_mail_task.apply_async(args=(mp.id,), kwargs={"run_id": run_id}, **plan_send_options(mp))
         except Exception as e:
             logger.exception("Fallback send failed: %s", e)
         return
 
     logger.info("execute_flow_task: starting traversal for MailPlan %s from node %s", mailplan_id, start_id)
 
-    # DFS traversal from start: follow all paths and schedule sends at email nodes
-    stack = [(start_id, 0)]  # (node_id, accumulated_seconds)
-    visited = set()
-    max_steps = 5000
-    steps = 0
-
-    while stack:
-        if steps > max_steps:
-            logger.warning("Flow traversal exceeded max steps for MailPlan %s", mailplan_id)
-            break
-        steps += 1
+    # Distinct arrival offsets for every email node reachable from start,
+    # precomputed when the flow was compiled (recomputed only for stale IRs)
+    started = time.perf_counter()
+    schedule = flow_ir.schedule
+    elapsed = time.perf_counter() - started
+    traversal = {
+        "nodes": schedule["nodes"],
+        "edges": schedule["edges"],
+        "sends": sum(len(v) for v in schedule["offsets"].values()),
+        "cycle_nodes": schedule["cycle_nodes"],
+        "elapsed_ms": round(elapsed * 1000, 3),
+    }
+    metrics.observe_stage("execute_flow_task", "traversal", elapsed)
+    metrics.observe_traversal(traversal["nodes"], traversal["edges"], traversal["sends"])
+    if schedule["cycle_nodes"]:
+        logger.warning(
+            "Flow for MailPlan %s contains a cycle; not scheduling nodes %s",
+            mailplan_id, schedule["cycle_nodes"]
+        )
 
-        node_id, acc_seconds = stack.pop()
-        node = nodes_map.get(node_id)
+    due_sends = {}  # accumulated_seconds -> [(mailplan_id, node_id)]
+    for node_id, offsets in schedule["offsets"].items():
+        node = flow_ir.node(node_id)
         if not node:
             continue
+        for acc_seconds in offsets:
+            # group sends by their delay so they can be published in batches
+            due_sends.setdefault(max(acc_seconds, 0), []).append((mp.id, node.get("id")))
 
-        logger.debug("Visiting node %s (type=%s) acc_seconds=%s", node_id, node.get("type"), acc_seconds)
+    now = timezone.now()
 
-        # If this node is a delay node, add its duration
-        if node.get("type") == "delay" or (node.get("data") and ("duration" in node.get("data") or "unit" in node.get("data"))):
-            data = node.get("data") or {}
-            dur = data.get("duration") or 0
-            unit = data.get("unit") or "hours"
-            add_seconds = _duration_seconds(dur, unit)
-            old_acc = acc_seconds
-            acc_seconds = acc_seconds + add_seconds
+    # immediate sends are enqueued right away
+    immediate = due_sends.pop(0, [])
+    if immediate:
+        try:
+            with metrics.timed("execute_flow_task", "publish"):
+                enqueue_sends(immediate, run_id=run_id, **plan_send_options(mp))
+            logger.info(
+                "Scheduled %s immediate send(s) for MailPlan %s: nodes=%s",
+                len(immediate), mp.id, [n for _, n in immediate]
+            )
+        except Exception as e:
+            logger.exception("Failed to schedule sends for MailPlan %s nodes %s: %s", mp.id, immediate, e)
+
+    # delayed sends become ScheduledSend rows (one bulk INSERT) picked up by
+    # dispatch_scheduled_sends when due, instead of Celery ETA messages
+    delayed = [
+        ScheduledSend(mailplan=mp, node_id=node_id, due_at=now + timedelta(seconds=acc_seconds), run_id=run_id)
+        for acc_seconds in sorted(due_sends)
+        for _, node_id in due_sends[acc_seconds]
+    ]
+    if delayed:
+        try:
+            with metrics.timed("execute_flow_task", "store_delayed"):
+                ScheduledSend.objects.bulk_create(delayed, batch_size=1000)
             logger.info(
-                "Delay node %s adds %s seconds (unit=%s duration=%s). acc_seconds: %s -> %s",
-                node_id, add_seconds, unit, dur, old_acc, acc_seconds
+                "Stored %s delayed send(s) for MailPlan %s (offsets=%s seconds)",
+                len(delayed), mp.id, sorted(due_sends)
             )
+        except Exception as e:
+            logger.exception("Failed to store delayed sends for MailPlan %s: %s", mp.id, e)
 
-    # If this node is an email node -> schedule send with the current acc_seconds
-        if node.get("type") == "email" or (node.get("data") and (node.get("data").get("recipient_email") or node.get("data").get("recipient"))):
-            # compute ETA for clarity
-            try:
-                if acc_seconds and acc_seconds > 0:
-                    eta_time = timezone.now() + timedelta(seconds=acc_seconds)
-                    # schedule using ETA (timezone-aware)
-                    send_mail_task.apply_async(args=(mp.id, node.get("id")), eta=eta_time)
-                    logger.info(
-                        "Scheduled send_mail_task for MailPlan %s node %s with ETA %s (after %s seconds)",
-                        mp.id, node.get("id"), eta_time.isoformat(), acc_seconds
-                    )
-                else:
-                    # immediate enqueue
-                    send_mail_task.delay(mp.id, node.get("id"))
-                    logger.info(
-                        "Scheduled immediate send_mail_task for MailPlan %s node %s",
-                        mp.id, node.get("id")
-                    )
-            except Exception as e:
-                logger.exception("Failed to schedule send for MailPlan %s node %s: %s", mp.id, node.get("id"), e)
-
-        # push child nodes with updated accumulated seconds
-        targets = adjacency.get(node_id, []) or []
-        for tgt in targets:
-            key = (tgt, acc_seconds)
-            if key in visited:
-                continue
-            visited.add(key)
-            stack.append((tgt, acc_seconds))
+    logger.info("execute_flow_task: finished scheduling for MailPlan %s (traversal=%s)", mailplan_id, traversal)
+    return {"status": "scheduled_flow", "mailplan_id": mp.id, "run_id": run_id, "traversal": traversal}
 
-    logger.info("execute_flow_task: finished scheduling for MailPlan %s (steps=%s)", mailplan_id, steps)
-    return {"status": "scheduled_flow", "mailplan_id": mp.id}
+
+def _claim_and_publish(queryset, limit, publish, **updates):
+    """
+    Claim up to `limit` MailPlan ids from `queryset` (rows locked with
+    FOR UPDATE SKIP LOCKED, only ids are read), apply `updates` to them with a
+    single UPDATE and call publish(ids) - all in one transaction, so a failed
+    publish leaves the plans unclaimed for the next tick.
+    """
+    with transaction.atomic():
+        ids = list(queryset.select_for_update(skip_locked=True).values_list("id", flat=True)[:limit])
+        if ids:
+            MailPlan.objects.filter(id__in=ids).update(**updates, **MailPlan.touched())
+            response_cache.invalidate(*ids)
+            publish(ids)
+    return ids
+
+
+def _publish_flow_executions(ids):
+    chunk_size = getattr(settings, "MAILPLAN_SCHEDULER_PUBLISH_CHUNK", 50)
+    # after_1_day fires once per plan, so the run id only depends on the plan
+    runs = [(mp_id, run_id_for("after_1_day", mp_id)) for mp_id in ids]
+    if len(runs) == 1:
+        execute_flow_task.apply_async(args=runs[0], queue=PLANNING_QUEUE)
+    else:
+        # one celery.starmap message per chunk instead of one message per plan
+        execute_flow_task.chunks(runs, chunk_size).apply_async(queue=PLANNING_QUEUE)
+
+
+ROUTING_FIELDS = ("trigger_type", "send_queue", "priority", "recipient_email")
+
+
+def _enqueue_routed(sends, routing, producer=None):
+    """
+    Enqueue (mailplan_id, node_id, run_id) sends grouped by the queue/priority
+    of their plan. `routing` maps mailplan_id -> ROUTING_FIELDS values.
+    """
+    groups = {}
+    for send in sends:
+        options = send_options(*routing[send[0]])
+        groups.setdefault((options["queue"], options["priority"]), []).append(send)
+    published = 0
+    for (queue, priority), group in groups.items():
+        published += enqueue_sends(group, queue=queue, priority=priority, producer=producer)
+    return published
+
+
+def publish_trigger_batch(run_id, sends, flows):
+    """
+    Publish the work of one bulk trigger (MailPlanViewSet.bulk_trigger), all
+    with run id `run_id`:
+      - `sends`: mailplan_id -> ROUTING_FIELDS values of plans sent right away,
+        enqueued like enqueue_sends (batched per queue/priority)
+      - `flows`: mailplan_id -> priority of plans whose flow has delay nodes,
+        published as execute_flow_task chunks (one celery.starmap message per
+        MAILPLAN_SCHEDULER_PUBLISH_CHUNK plans) per priority
+    Every message goes through one producer, i.e. one broker connection.
+    Returns the number of Celery messages published.
+    """
+    chunk_size = getattr(settings, "MAILPLAN_SCHEDULER_PUBLISH_CHUNK", 50)
+    published = 0
+    with execute_flow_task.app.producer_or_acquire() as producer:
+        if sends:
+            published += _enqueue_routed([(mp_id, None, run_id) for mp_id in sends], sends, producer=producer)
+        by_priority = {}
+        for mp_id, priority in flows.items():
+            by_priority.setdefault(broker_priority(priority), []).append((mp_id, run_id))
+        for priority, runs in by_priority.items():
+            options = {"queue": PLANNING_QUEUE, "priority": priority, "producer": producer}
+            if len(runs) == 1:
+                execute_flow_task.apply_async(args=runs[0], **options)
+                published += 1
+            else:
+                execute_flow_task.chunks(runs, chunk_size).apply_async(**options)
+                published += -(-len(runs) // chunk_size)
+    return published
+
+
+def _publish_scheduled_sends(ids, now):
+    routing = {row[0]: row[1:] for row in MailPlan.objects.filter(id__in=ids).values_list("id", *ROUTING_FIELDS)}
+    return _enqueue_routed([(mp_id, None, run_id_for("scheduled", mp_id, now.isoformat())) for mp_id in ids], routing)
 
 
 @shared_task
 def schedule_due_mailplans():
     """
-    Periodic task that finds MailPlans ready to send:
-      - trigger_type='scheduled' and scheduled_time <= now
-      - trigger_type='after_1_day' created 24h ago
-    Enqueues each for delivery.
+    Periodic task that finds MailPlans ready to send and fires each exactly once:
+      - status='scheduled' and scheduled_time <= now, not yet triggered for
+        that scheduled_time (last_triggered_at watermark)
+      - trigger_type='after_1_day' created 24h ago and never triggered; these
+        are moved to status='scheduled' like a manual flow trigger
+    Plans are claimed atomically in chunks of MAILPLAN_SCHEDULER_CHUNK_SIZE
+    (ids only, rows locked with SKIP LOCKED) and at most
+    MAILPLAN_SCHEDULER_MAX_PER_TICK plans of each kind are handled per run.
     """
     now = timezone.now()
+    chunk_size = getattr(settings, "MAILPLAN_SCHEDULER_CHUNK_SIZE", 500)
+    max_per_tick = getattr(settings, "MAILPLAN_SCHEDULER_MAX_PER_TICK", 5000)
+
+    # Scheduled mails (served by the (status, scheduled_time) index)
+    due_scheduled = (
+        MailPlan.objects.filter(status="scheduled", scheduled_time__lte=now)
+        .filter(Q(last_triggered_at__isnull=True) | Q(last_triggered_at__lt=F("scheduled_time")))
+        .order_by("scheduled_time")
+    )
+    scheduled_count = 0
+    started = time.perf_counter()
+    while scheduled_count < max_per_tick:
+        limit = min(chunk_size, max_per_tick - scheduled_count)
+        # grouped into send_mail_batch_task messages when MAILPLAN_SEND_BATCH_SIZE > 1
+        ids = _claim_and_publish(
+            due_scheduled, limit,
+            lambda ids: _publish_scheduled_sends(ids, now),
+            last_triggered_at=now,
+        )
+        scheduled_count += len(ids)
+        if len(ids) < limit:
+            break
+    metrics.observe_stage("schedule_due_mailplans", "scheduled", time.perf_counter() - started)
+    metrics.count_scheduled("scheduled", scheduled_count)
 
-    # Scheduled mails
-    scheduled_plans = MailPlan.objects.filter(status="scheduled", scheduled_time__lte=now)
-
-    for mp in scheduled_plans:
-        send_mail_task.delay(mp.id)
-
-    # After 1 day mails
+    # After 1 day mails (served by the (trigger_type, status, created_at) index)
     one_day_ago = now - timedelta(days=1)
-    day_later_plans = MailPlan.objects.filter(
+    due_day_later = MailPlan.objects.filter(
         trigger_type="after_1_day",
         status="active",
         created_at__lte=one_day_ago,
-    )
-
-    for mp in day_later_plans:
-        try:
-            execute_flow_task.delay(mp.id)
-        except Exception:
-            send_mail_task.delay(mp.id)
+        last_triggered_at__isnull=True,
+    ).order_by("created_at")
+    one_day_count = 0
+    started = time.perf_counter()
+    while one_day_count < max_per_tick:
+        limit = min(chunk_size, max_per_tick - one_day_count)
+        ids = _claim_and_publish(
+            due_day_later, limit, _publish_flow_executions,
+            status="scheduled", last_triggered_at=now,
+        )
+        one_day_count += len(ids)
+        if len(ids) < limit:
+            break
+    metrics.observe_stage("schedule_due_mailplans", "after_1_day", time.perf_counter() - started)
+    metrics.count_scheduled("after_1_day", one_day_count)
 
     logger.info(
-        f"schedule_due_mailplans ran: {scheduled_plans.count()} scheduled, {day_later_plans.count()} after_1_day."
+        f"schedule_due_mailplans ran: {scheduled_count} scheduled, {one_day_count} after_1_day."
     )
 
-    return {"scheduled_sent": scheduled_plans.count(), "one_day_triggered": day_later_plans.count()}
+    return {"scheduled_sent": scheduled_count, "one_day_triggered": one_day_count}
+
+
+@shared_task
+def dispatch_scheduled_sends():
+    """
+    Periodic task that publishes delayed sends whose due_at has passed.
+
+    Due ScheduledSend rows are claimed in chunks of MAILPLAN_DISPATCH_CHUNK_SIZE
+    with SELECT ... FOR UPDATE SKIP LOCKED, so several beat/worker instances can
+    run this concurrently without claiming the same rows. Each chunk is
+    published and deleted inside one transaction: if publishing fails the rows
+    stay pending for the next run. At most MAILPLAN_DISPATCH_MAX_CHUNKS chunks
+    are handled per run to keep each tick bounded.
+    """
+    now = timezone.now()
+    chunk_size = getattr(settings, "MAILPLAN_DISPATCH_CHUNK_SIZE", 500)
+    max_chunks = getattr(settings, "MAILPLAN_DISPATCH_MAX_CHUNKS", 20)
+    dispatched = 0
+    published = 0
+    # the plan's routing fields come along so sends go to the plan's queue
+    fields = ("id", "mailplan_id", "node_id", "run_id") + tuple(f"mailplan__{f}" for f in ROUTING_FIELDS)
+
+    for _ in range(max_chunks):
+        with transaction.atomic():
+            rows = list(
+                # of=("self",): only the ScheduledSend rows are locked, not the joined plans
+                ScheduledSend.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(due_at__lte=now)
+                .order_by("due_at")
+                .values_list(*fields)[:chunk_size]
+            )
+            if not rows:
+                break
+            published += _enqueue_routed(
+                [(mp_id, node_id, run_id) for _, mp_id, node_id, run_id, *_ in rows],
+                {row[1]: row[4:] for row in rows},
+            )
+            ScheduledSend.objects.filter(id__in=[row[0] for row in rows]).delete()
+        dispatched += len(rows)
+        if len(rows) < chunk_size:
+            break
+
+    if dispatched:
+        logger.info("dispatch_scheduled_sends: dispatched %s due send(s) in %s message(s).", dispatched, published)
+    return {"dispatched": dispatched, "messages": published}
+
+
+@shared_task
+def archive_email_logs_task():
+    """
+    Daily retention job: archive EmailLog rows older than
+    MAILPLAN_LOG_RETENTION_DAYS to a gzip NDJSON file and delete them in
+    batches (see mailplans.retention). Disabled when the setting is 0.
+    """
+    days = getattr(settings, "MAILPLAN_LOG_RETENTION_DAYS", 90)
+    if not days:
+        return {"skipped": True}
+    try:
+        summary = archive_email_logs(days=days)
+    except Exception:
+        logger.exception("EmailLog archive run failed; nothing was deleted after the failure point.")
+        raise
+    logger.info("archive_email_logs_task: %s", summary)
+    return summary
+
+
+@shared_task(bind=True, acks_late=True)
+def import_mailplans_task(self, job_id):
+    """
+    Run (or resume) a bulk ImportJob, see mailplans.importer. The task id is
+    the job's runner token, so a message redelivered after a worker crash
+    picks the job up again from its last committed chunk, while a duplicate
+    resume request finds the job owned and exits.
+    """
+    try:
+        job = run_import(job_id, runner=self.request.id)
+    except ImportConflict:
+        return {"job": job_id, "skipped": True}
+    if job is None:
+        logger.info("import_mailplans_task: job %s is done or owned by another run.", job_id)
+        return {"job": job_id, "skipped": True}
+    return {"job": job_id, "imported": job.imported_rows, "failed": job.failed_rows}
@@ -0,0 +1,148 @@
+# backend/mailplans/template_cache.py
+"""
+Process-local LRU cache of compiled Django templates.
+
+_render_with_template used to build a new django.template.Template (lex +
+parse) for the subject and the body of every email. Plan content rarely
+changes, so compiled templates are cached here keyed by a hash of their text.
+Rendering then only costs Template.render(), independent of template size.
+
+ - The cache is bounded (MAILPLAN_TEMPLATE_CACHE_SIZE entries) with LRU eviction.
+ - Hits, misses and evictions are counted; see cache_stats().
+ - With MAILPLAN_TEMPLATE_CACHE_PREWARM enabled, each Celery worker process
+   compiles the templates of active/scheduled plans when it starts.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from celery.signals import worker_process_init
+from django.conf import settings
+from django.template import Template
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledTemplateCache:
+    """Thread-safe, bounded LRU mapping of template text hash -> compiled Template."""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = max(1, int(maxsize))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        """
+        Return the compiled Template for text, compiling and caching it on a miss.
+        Compilation errors propagate (and nothing is cached).
+        """
+        text = str(text)
+        key = self.key_for(text)
+        with self._lock:
+            tpl = self._data.get(key)
+            if tpl is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return tpl
+            self.misses += 1
+
+        # compile outside the lock; a concurrent miss just compiles twice
+        tpl = Template(text)
+
+        with self._lock:
+            self._data[key] = tpl
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return tpl
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+template_cache = CompiledTemplateCache(getattr(settings, "MAILPLAN_TEMPLATE_CACHE_SIZE", 512))
+
+
+def get_compiled_template(text):
+    return template_cache.get(text)
+
+
+def cache_stats():
+    return template_cache.stats()
+
+
+def _plan_template_texts(mp):
+    """Yield every subject/body template string used by a MailPlan and its flow nodes."""
+    yield mp.subject
+    yield mp.content
+    flow = mp.flow if isinstance(mp.flow, dict) else {}
+    for node in flow.get("nodes", []) or []:
+        if not isinstance(node, dict):
+            continue
+        data = node.get("data") or {}
+        if not isinstance(data, dict):
+            continue
+        yield data.get("subject")
+        yield data.get("body")
+
+
+def prewarm(limit=None):
+    """
+    Compile the templates of active/scheduled MailPlans into the cache.
+    Returns the number of templates compiled or refreshed.
+    """
+    from .models import MailPlan
+
+    limit = limit or template_cache.maxsize
+    warmed = 0
+    plans = (
+        MailPlan.objects.filter(status__in=("active", "scheduled"))
+        .only("subject", "content", "flow")
+        .order_by("-created_at")
+    )
+    for mp in plans.iterator(chunk_size=200):
+        for text in _plan_template_texts(mp):
+            if not text:
+                continue
+            try:
+                template_cache.get(text)
+                warmed += 1
+            except Exception:
+                logger.debug("Skipping template that fails to compile during prewarm.", exc_info=True)
+            if warmed >= limit:
+                return warmed
+    return warmed
+
+
+@worker_process_init.connect
+def _prewarm_on_worker_start(**kwargs):
+    if not getattr(settings, "MAILPLAN_TEMPLATE_CACHE_PREWARM", False):
+        return
+    try:
+        warmed = prewarm()
+        logger.info("Template cache prewarmed with %s template(s).", warmed)
+    except Exception:
+        logger.exception("Template cache prewarm failed.")
@@ -1,3 +1,1213 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import smtplib
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.template import Context, TemplateSyntaxError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from backend.celery import WORKER_PROFILES, app as celery_app
+
+try:
+    import aiosmtplib
+except ImportError:  # optional dependency
+    aiosmtplib = None
+
+from .benchmarks import compare
+from . import async_delivery, importer, tasks
+from .flow import FlowIR, FlowValidationError, compile_flow, parse_delay, validate_flow
+from . import log_writer as log_writer_module
+from .log_writer import EmailLogWriter
+from .models import (
+    EmailLog, ImportJob, MailPlan, MailPlanRecipient, Recipient, RenderedBody, ScheduledSend, TriggerBatch,
+)
+from .recipients import recipient_index
+from .rate_limit import defer_countdown
+from .retention import purge_orphan_bodies
+from .routing import DEFAULT_PRIORITY, broker_priority, queue_for
+
+from .smtp_pool import SMTPConnectionPool, pool_stats, reset_pool
+from . import template_cache as template_cache_module
+from .template_cache import CompiledTemplateCache, cache_stats, get_compiled_template
+from .idempotency import idempotency
+from .tasks import (
+    _deliver_slice, dispatch_scheduled_sends, enqueue_sends, execute_flow_task, schedule_due_mailplans,
+    send_mail_batch_task, send_mail_task,
+)
+
+SMTP_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+
+
+class FakeSMTP:
+    """Stand-in for smtplib.SMTP: counts sessions and fails the sends listed in `fail_on`."""
+    sessions = 0
+    sends = 0
+    fail_on = set()
+
+    def __init__(self, host=None, port=None, **kwargs):
+        type(self).sessions += 1
+        self.open = True
+
+    @classmethod
+    def reset(cls, fail_on=()):
+        cls.sessions = 0
+        cls.sends = 0
+        cls.fail_on = set(fail_on)
+
+    def sendmail(self, from_addr, to_addrs, msg, *args, **kwargs):
+        index = type(self).sends
+        type(self).sends += 1
+        if index in self.fail_on:
+            self.open = False
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return {}
+
+    def noop(self):
+        if not self.open:
+            raise smtplib.SMTPServerDisconnected("not connected")
+        return 250, b"OK"
+
+    def ehlo(self, *args):
+        return 250, b"OK"
+
+    def starttls(self, *args, **kwargs):
+        return 220, b"OK"
+
+    def login(self, *args):
+        return 235, b"OK"
+
+    def quit(self):
+        self.open = False
+
+    def close(self):
+        self.open = False
+
+
+@override_settings(EMAIL_BACKEND=SMTP_BACKEND, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+                   EMAIL_HOST_USER="", EMAIL_HOST_PASSWORD="",
+                   EMAIL_POOL_ENABLED=True, EMAIL_POOL_SIZE=1, MAILPLAN_SEND_CONCURRENCY=1)
+@mock.patch("django.core.mail.backends.smtp.smtplib.SMTP", FakeSMTP)
+class SMTPConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        FakeSMTP.reset()
+        reset_pool()
+
+    def tearDown(self):
+        reset_pool()
+
+    def test_closed_smtp_backend_is_replaced_on_acquire(self):
+        pool = SMTPConnectionPool(max_size=1, healthcheck_after=60, backend=SMTP_BACKEND)
+        connection = pool.acquire()
+        connection.close()  # what a send error leaves behind
+        pool.release(connection)
+
+        connection = pool.acquire()
+        self.assertIsNotNone(connection.connection)
+        self.assertEqual(FakeSMTP.sessions, 2)
+        self.assertEqual(pool.stats()["stale"], 1)
+        self.assertEqual(pool.stats()["reused"], 0)
+
+    def test_failed_noop_counts_as_stale(self):
+        pool = SMTPConnectionPool(max_size=1, healthcheck_after=0, backend=SMTP_BACKEND)
+        connection = pool.acquire()
+        connection.connection.open = False  # server dropped the idle session
+        pool.release(connection)
+
+        self.assertIsNotNone(pool.acquire().connection)
+        self.assertEqual(pool.stats()["stale"], 1)
+
+    def test_open_backend_is_reused(self):
+        pool = SMTPConnectionPool(max_size=1, healthcheck_after=0, backend=SMTP_BACKEND)
+        pool.release(pool.acquire())
+        pool.acquire()
+        self.assertEqual(FakeSMTP.sessions, 1)
+        self.assertEqual(pool.stats()["reused"], 1)
+
+    def test_transient_send_error_reopens_pooled_session(self):
+        FakeSMTP.reset(fail_on={2})
+        messages = [("Subject", "<p>hi</p>", [f"r{i}@example.com"]) for i in range(5)]
+        outcomes = _deliver_slice(messages)
+        self.assertEqual([sent for sent, _ in outcomes], [1, 1, 0, 1, 1])
+        self.assertIsInstance(outcomes[2][1], smtplib.SMTPServerDisconnected)
+        self.assertEqual(FakeSMTP.sessions, 2)  # the first session and one reconnect
+
+        outcomes = _deliver_slice(messages[:3])
+        self.assertEqual([sent for sent, _ in outcomes], [1, 1, 1])
+        self.assertEqual(FakeSMTP.sessions, 2)  # the reopened session was reused
+        stats = pool_stats()
+        self.assertEqual((stats["created"], stats["reused"], stats["stale"]), (1, 1, 0))
+
+
+class FakeAsyncSMTP:
+    """
+    Stand-in for aiosmtplib.SMTP. The recipient address picks the outcome:
+    "slow-*" is sent late, "refused-*" is rejected, "drop-*" loses the session.
+    """
+    instances = []
+    connect_failures = 0
+    completed = []
+
+    def __init__(self):
+        type(self).instances.append(self)
+        self.is_connected = False
+        self.closed = False
+
+    @classmethod
+    def reset(cls, connect_failures=0):
+        cls.instances = []
+        cls.connect_failures = connect_failures
+        cls.completed = []
+
+    async def connect(self):
+        if type(self).connect_failures:
+            type(self).connect_failures -= 1
+            raise aiosmtplib.SMTPConnectError("connection refused")
+        self.is_connected = True
+
+    async def send_message(self, message, sender=None, recipients=None):
+        to = recipients[0]
+        if to.startswith("slow-"):
+            await asyncio.sleep(0.05)
+        elif to.startswith("refused-"):
+            raise aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(550, "no such user", to)])
+        elif to.startswith("drop-"):
+            self.is_connected = False
+            raise aiosmtplib.SMTPServerDisconnected("Connection lost")
+        type(self).completed.append(to)
+        return {}, "OK"
+
+    async def quit(self):
+        self.close()
+
+    def close(self):
+        self.is_connected = False
+        self.closed = True
+
+
+@skipIf(async_delivery.aiosmtplib is None, "aiosmtplib is not installed")
+@mock.patch.object(async_delivery.AsyncSMTPEngine, "_new_client", lambda self: FakeAsyncSMTP())
+class AsyncSMTPEngineTests(SimpleTestCase):
+    def setUp(self):
+        FakeAsyncSMTP.reset()
+
+    def engine(self, max_sessions):
+        engine = async_delivery.AsyncSMTPEngine(max_sessions=max_sessions)
+        self.addCleanup(engine.close)
+        return engine
+
+    @staticmethod
+    def messages(*addresses):
+        return [("Subject", "<p>hi</p>", [address]) for address in addresses]
+
+    def test_outcomes_are_in_input_order(self):
+        engine = self.engine(max_sessions=4)
+        outcomes = engine.deliver(self.messages("slow-a@example.com", "b@example.com", "refused-c@example.com",
+                                                "d@example.com"), timeout=5)
+        self.assertEqual(FakeAsyncSMTP.completed, ["b@example.com", "d@example.com", "slow-a@example.com"])
+        self.assertEqual([sent for sent, _ in outcomes], [1, 1, 0, 1])
+        self.assertEqual([exc is None for _, exc in outcomes], [True, True, False, True])
+
+    def test_recipient_refusal_keeps_the_session(self):
+        engine = self.engine(max_sessions=1)
+        outcomes = engine.deliver(self.messages("refused-a@example.com", "b@example.com"), timeout=5)
+
+        sent, exc = outcomes[0]
+        self.assertEqual(sent, 0)
+        self.assertIsInstance(exc, smtplib.SMTPRecipientsRefused)
+        self.assertEqual(exc.recipients, {"refused-a@example.com": (550, "no such user")})
+        self.assertEqual(outcomes[1], (1, None))
+        self.assertEqual(len(FakeAsyncSMTP.instances), 1)
+        self.assertFalse(FakeAsyncSMTP.instances[0].closed)
+        self.assertEqual({k: engine.stats[k] for k in ("created", "reused", "discarded")},
+                         {"created": 1, "reused": 1, "discarded": 0})
+
+    def test_transient_error_closes_the_session_and_frees_its_slot(self):
+        engine = self.engine(max_sessions=1)
+        [(sent, exc)] = engine.deliver(self.messages("drop-a@example.com"), timeout=5)
+        self.assertEqual(sent, 0)
+        self.assertIsInstance(exc, aiosmtplib.SMTPServerDisconnected)
+        self.assertTrue(FakeAsyncSMTP.instances[0].closed)
+
+        # with the only slot leaked this would block until the timeout
+        self.assertEqual(engine.deliver(self.messages("b@example.com"), timeout=5), [(1, None)])
+        self.assertEqual(len(FakeAsyncSMTP.instances), 2)
+        self.assertEqual((engine.stats["discarded"], engine.stats["failed"]), (1, 1))
+
+    def test_failed_connect_frees_its_slot(self):
+        FakeAsyncSMTP.reset(connect_failures=1)
+        engine = self.engine(max_sessions=1)
+        [(sent, exc)] = engine.deliver(self.messages("a@example.com"), timeout=5)
+        self.assertEqual(sent, 0)
+        self.assertIsInstance(exc, aiosmtplib.SMTPConnectError)
+
+        self.assertEqual(engine.deliver(self.messages("b@example.com"), timeout=5), [(1, None)])
+        self.assertEqual((engine.stats["created"], engine.stats["failed"]), (1, 1))
+
+
+class APITestMixin:
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user("tester", "tester@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_plan(self, **fields):
+        values = {"name": "Plan", "subject": "Hi", "content": "<p>Hi</p>",
+                  "trigger_type": "button_click", "recipient_email": "to@example.com"}
+        values.update(fields)
+        return MailPlan.objects.create(**values)
+
+
+class TriggerIdempotencyTests(APITestMixin, TestCase):
+    def test_failed_trigger_can_be_retried_with_the_same_key(self):
+        mp = self.make_plan()
+        url = f"/api/mailplans/{mp.id}/trigger/"
+        headers = {"HTTP_IDEMPOTENCY_KEY": "retry-me"}
+        broken = mock.Mock(side_effect=ConnectionError("broker down"))
+        with mock.patch("mailplans.views.send_mail_task") as send, \
+                mock.patch("mailplans.views.execute_flow_task") as flow:
+            send.apply_async = send.apply = flow.apply_async = broken
+            response = self.client.post(url, {"confirm": True}, format="json", **headers)
+        self.assertEqual(response.status_code, 503)
+
+        with mock.patch("mailplans.views.send_mail_task") as send:
+            response = self.client.post(url, {"confirm": True}, format="json", **headers)
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn("duplicate", response.data)
+        send.apply_async.assert_called_once()
+
+        response = self.client.post(url, {"confirm": True}, format="json", **headers)
+        self.assertTrue(response.data["duplicate"])
+
+
+@override_settings(MAILPLAN_RENDERED_BODY_GRACE_SECONDS=3600)
+class PurgeOrphanBodiesTests(APITestMixin, TestCase):
+    def body(self, text, age):
+        blob = RenderedBody.from_text(text)
+        blob.last_used_at = timezone.now() - timedelta(seconds=age)
+        blob.save()
+        return blob
+
+    def test_only_orphans_unused_for_the_grace_period_are_deleted(self):
+        old_orphan = self.body("old orphan", 7200)
+        fresh_orphan = self.body("fresh orphan", 60)
+        referenced = self.body("referenced", 7200)
+        EmailLog.objects.create(mailplan=self.make_plan(), to_email="a@example.com", subject="s",
+                                body="", rendered=referenced, status="sent")
+
+        self.assertEqual(purge_orphan_bodies(), 1)
+        remaining = set(RenderedBody.objects.values_list("pk", flat=True))
+        self.assertEqual(remaining, {fresh_orphan.pk, referenced.pk})
+        self.assertNotIn(old_orphan.pk, remaining)
+
+    def test_body_reused_by_the_log_writer_is_not_purged(self):
+        blob = self.body("reused later", 7200)
+        writer = EmailLogWriter(max_pending=1000, max_age=1000)
+        self.assertEqual(writer.store_body("reused later"), blob.pk)
+        writer.flush()
+
+        blob.refresh_from_db()
+        self.assertGreater(blob.last_used_at, timezone.now() - timedelta(seconds=60))
+        self.assertEqual(purge_orphan_bodies(), 0)
+
+
+class EmailLogWriterTests(APITestMixin, TestCase):
+    def log(self, mp, to_email="a@example.com", **fields):
+        fields.setdefault("status", "sent")
+        return EmailLog(mailplan=mp, to_email=to_email, subject="s", body="", **fields)
+
+    def test_flushes_when_the_buffer_is_full(self):
+        mp = self.make_plan()
+        writer = EmailLogWriter(max_pending=2, max_age=1000)
+        writer.add(self.log(mp))
+        self.assertEqual(EmailLog.objects.count(), 0)
+        writer.add(self.log(mp, "b@example.com"))
+        self.assertEqual(EmailLog.objects.count(), 2)
+        self.assertEqual(writer.pending(), 0)
+
+    def test_flushes_when_the_oldest_write_is_too_old(self):
+        mp = self.make_plan()
+        writer = EmailLogWriter(max_pending=1000, max_age=5)
+        with mock.patch("mailplans.log_writer.time.monotonic", return_value=100.0):
+            writer.add(self.log(mp))
+        self.assertEqual(EmailLog.objects.count(), 0)
+        with mock.patch("mailplans.log_writer.time.monotonic", return_value=106.0):
+            writer.maybe_flush()
+        self.assertEqual(EmailLog.objects.count(), 1)
+
+    def test_update_of_an_unsaved_log_is_carried_by_its_insert(self):
+        mp = self.make_plan()
+        writer = EmailLogWriter(max_pending=1000, max_age=1000)
+        log = self.log(mp, status="pending")
+        writer.add(log)
+        log.status = "failed"
+        writer.update(log, ["status"])
+        self.assertEqual(writer.pending(), 1)
+        writer.flush()
+        self.assertEqual(list(EmailLog.objects.values_list("status", flat=True)), ["failed"])
+
+        saved = EmailLog.objects.get()
+        saved.status = "sent"
+        writer.update(saved, ["status"])
+        writer.flush()
+        self.assertEqual(EmailLog.objects.get().status, "sent")
+
+    def test_plan_statuses_are_written_with_one_update_per_status(self):
+        plans = [self.make_plan() for _ in range(3)]
+        writer = EmailLogWriter(max_pending=1000, max_age=1000)
+        writer.set_plan_status(plans[0].id, "sent")
+        writer.set_plan_status(plans[1].id, "sent")
+        writer.set_plan_status(plans[2].id, "failed")
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(writer.flush(), 2)
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "mailplans_mailplan"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(
+            dict(MailPlan.objects.values_list("id", "status")),
+            {plans[0].id: "sent", plans[1].id: "sent", plans[2].id: "failed"},
+        )
+
+    def test_cached_plan_responses_are_invalidated_after_commit(self):
+        mp = self.make_plan()
+        writer = EmailLogWriter(max_pending=1000, max_age=1000)
+        writer.set_plan_status(mp.id, "sent")
+        with mock.patch("mailplans.log_writer.response_cache.invalidate") as invalidate:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                writer.flush()
+            invalidate.assert_not_called()
+            for callback in callbacks:
+                callback()
+        invalidate.assert_called_once_with(mp.id)
+
+    def test_buffer_is_flushed_after_every_task(self):
+        from celery.signals import task_postrun
+
+        writer = EmailLogWriter(max_pending=1000, max_age=1000)
+        writer.add(self.log(self.make_plan()))
+        with mock.patch.object(log_writer_module, "log_writer", writer):
+            task_postrun.send(sender=None, task_id="t1", task=None)
+        self.assertEqual(EmailLog.objects.count(), 1)
+
+    def test_failed_flush_keeps_the_writes_for_the_next_one(self):
+        mp = self.make_plan()
+        writer = EmailLogWriter(max_pending=1000, max_age=1000, max_retries=1)
+        writer.store_body("<p>Hi</p>")
+        writer.add(self.log(mp))
+        writer.set_plan_status(mp.id, "sent")
+        real_write = writer._write
+        with mock.patch.object(writer, "_write", side_effect=DatabaseError("deadlock detected")):
+            with self.assertRaises(DatabaseError):
+                writer.flush()
+        self.assertEqual(writer.pending(), 2)
+        self.assertEqual(EmailLog.objects.count(), 0)
+
+        with mock.patch.object(writer, "_write", side_effect=real_write):
+            writer.flush()
+        self.assertEqual(EmailLog.objects.count(), 1)
+        self.assertEqual(RenderedBody.objects.count(), 1)
+        self.assertEqual(MailPlan.objects.get(pk=mp.pk).status, "sent")
+
+    def test_writes_are_dropped_after_too_many_failed_flushes(self):
+        writer = EmailLogWriter(max_pending=1000, max_age=1000, max_retries=1)
+        writer.add(self.log(self.make_plan()))
+        with mock.patch.object(writer, "_write", side_effect=DatabaseError("bad row")):
+            for _ in range(2):
+                with self.assertRaises(DatabaseError):
+                    writer.flush()
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(writer.stats["dropped"], 1)
+
+
+@mock.patch("mailplans.views.publish_trigger_batch", return_value=1)
+class BulkTriggerTests(APITestMixin, TestCase):
+    url = "/api/mailplans/bulk_trigger/"
+
+    def test_idempotency_key_is_scoped_to_the_caller(self, publish):
+        mine, theirs = self.make_plan(), self.make_plan()
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create_user("other", "o@example.com", "pw"))
+        headers = {"HTTP_IDEMPOTENCY_KEY": "release-42"}
+
+        first = self.client.post(self.url, {"ids": [mine.id], "confirm": True}, format="json", **headers)
+        second = other.post(self.url, {"ids": [theirs.id], "confirm": True}, format="json", **headers)
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertNotEqual(first.data["batch_id"], second.data["batch_id"])
+        self.assertEqual(second.data["plan_ids"], [theirs.id])
+
+        again = self.client.post(self.url, {"ids": [mine.id], "confirm": True}, format="json", **headers)
+        self.assertTrue(again.data["duplicate"])
+        self.assertEqual(publish.call_count, 2)
+
+    def test_failed_publish_restores_the_plans(self, publish):
+        triggered_at = timezone.now() - timedelta(days=3)
+        plans = [self.make_plan(status="paused"), self.make_plan(status="sent", last_triggered_at=triggered_at)]
+        publish.side_effect = ConnectionError("broker down")
+        response = self.client.post(self.url, {"ids": [mp.id for mp in plans], "confirm": True},
+                                    format="json", HTTP_IDEMPOTENCY_KEY="k")
+        self.assertEqual(response.status_code, 503)
+        restored = {mp.id: (mp.status, mp.last_triggered_at) for mp in MailPlan.objects.filter(id__in=[p.id for p in plans])}
+        self.assertEqual(restored, {plans[0].id: ("paused", None), plans[1].id: ("sent", triggered_at)})
+        self.assertFalse(TriggerBatch.objects.exists())
+
+        publish.side_effect = None
+        response = self.client.post(self.url, {"ids": [mp.id for mp in plans], "confirm": True},
+                                    format="json", HTTP_IDEMPOTENCY_KEY="k")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(TriggerBatch.objects.get().messages, 1)
+        self.assertEqual(set(MailPlan.objects.values_list("status", flat=True)), {"sent"})
+
+    def test_filter_selects_by_choice_values(self, publish):
+        paused = self.make_plan(status="paused", name="release 1.2", priority=7)
+        self.make_plan(status="active", name="release 1.3", priority=7)
+        response = self.client.post(self.url, {"filter": {"status": "paused", "priority": "7", "name": "release"},
+                                               "confirm": True}, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["plan_ids"], [paused.id])
+
+    def test_filter_rejects_unknown_choice_values(self, publish):
+        self.make_plan(status="paused")
+        for bad in ({"status": "draft"}, {"send_queue": "urgent"}, {"priority": 12}, {"colour": "red"}):
+            response = self.client.post(self.url, {"filter": bad, "confirm": True}, format="json")
+            self.assertEqual(response.status_code, 400, bad)
+            self.assertIn("filter", response.data)
+        publish.assert_not_called()
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    @override_settings(DEBUG=False, MAILPLAN_METRICS_TOKEN="")
+    def test_hidden_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(DEBUG=False, MAILPLAN_METRICS_TOKEN="s3cret")
+    def test_requires_the_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer nope").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertIn(response.status_code, (200, 503))  # 503: prometheus_client not installed
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def test_flags_cases_slower_than_the_tolerance(self):
+        baseline = {"results": {"a": {"median_ms": 10.0}, "b": {"median_ms": 10.0}, "c": {"median_ms": 10.0}}}
+        current = {"results": {"a": {"median_ms": 12.0}, "b": {"median_ms": 13.0},
+                               "c": {"median_ms": 5.0}, "d": {"median_ms": 1.0}}}
+        status = {row["name"]: row["status"] for row in compare(current, baseline, tolerance=0.25)}
+        self.assertEqual(status, {"a": "ok", "b": "regression", "c": "faster", "d": "new"})
+
+
+def node(node_id, node_type, **data):
+    return {"id": node_id, "type": node_type, "data": data}
+
+
+def edge(source, target):
+    return {"id": f"{source}-{target}", "source": source, "target": target}
+
+
+class FlowValidationTests(SimpleTestCase):
+    def assertInvalid(self, flow, fragment, **limits):
+        with self.assertRaises(FlowValidationError) as ctx:
+            validate_flow(flow, **limits)
+        self.assertTrue(any(fragment in error for error in ctx.exception.errors), ctx.exception.errors)
+
+    def test_delay_units_and_rounding(self):
+        self.assertEqual(parse_delay(2, "hours"), 7200)
+        self.assertEqual(parse_delay("1.5", "min"), 90)
+        self.assertEqual(parse_delay(1, "W"), 604800)
+        self.assertEqual(parse_delay(0.0004, "seconds"), 0)
+        self.assertEqual(parse_delay(0.6, "seconds"), 1)
+        for duration, unit in ((-1, "hours"), ("soon", "hours"), (True, "hours"), (None, "days"), (1, "fortnights")):
+            with self.assertRaises(ValueError):
+                parse_delay(duration, unit)
+
+    def test_rejects_cycles(self):
+        flow = {"nodes": [node("s", "start"), node("a", "email", recipient_email="a@example.com"),
+                          node("d", "delay", duration=1, unit="hours")],
+                "edges": [edge("s", "a"), edge("a", "d"), edge("d", "a")]}
+        self.assertInvalid(flow, "cycle")
+
+    def test_rejects_unreachable_email_nodes(self):
+        flow = {"nodes": [node("s", "start"), node("a", "email", recipient_email="a@example.com"),
+                          node("b", "email", recipient_email="b@example.com")],
+                "edges": [edge("s", "a")]}
+        self.assertInvalid(flow, "not reachable from the start node: b")
+
+    def test_rejects_structural_errors(self):
+        self.assertInvalid("{not json", "not valid JSON")
+        self.assertInvalid({"nodes": {}}, "must be lists")
+        self.assertInvalid({"nodes": [node("s", "start"), node("s", "email")]}, "Duplicate node id")
+        self.assertInvalid({"nodes": [node("s", "start")], "edges": [edge("s", "ghost")]}, "unknown node(s): ghost")
+        self.assertInvalid({"nodes": [node("s", "start"), node("d", "delay", duration=400, unit="days")],
+                            "edges": [edge("s", "d")]}, "exceeds the maximum", max_delay=365 * 86400)
+        self.assertInvalid({"nodes": [node("s", "start"), node("t", "start")]}, "more than one start node")
+        self.assertInvalid({"nodes": [node("s", "start")] * 3}, "at most 2", max_nodes=2)
+
+    def test_schedule_offsets_follow_every_path(self):
+        # s -> d1 (1h) -> a ; s -> d2 (1 day) -> a ; a -> d3 (30 min) -> b
+        flow = {"nodes": [node("s", "start"),
+                          node("d1", "delay", duration=1, unit="hours"),
+                          node("d2", "delay", duration=1, unit="days"),
+                          node("a", "email", recipient_email="a@example.com"),
+                          node("d3", "delay", duration=30, unit="minutes"),
+                          node("b", "email", recipient_email="b@example.com")],
+                "edges": [edge("s", "d1"), edge("s", "d2"), edge("d1", "a"), edge("d2", "a"),
+                          edge("a", "d3"), edge("d3", "b")]}
+        ir = validate_flow(flow)
+        offsets = {key: sorted(value) for key, value in ir["schedule"]["offsets"].items()}
+        self.assertEqual(offsets, {"a": [3600, 86400], "b": [5400, 88200]})
+        self.assertTrue(ir["has_delay"])
+        self.assertEqual(ir["schedule"], compile_flow(flow)["schedule"])
+
+
+class FlowIRTests(SimpleTestCase):
+    def test_stored_ir_of_a_changed_flow_is_not_used(self):
+        flow = {"nodes": [node("s", "start"), node("d", "delay", duration=1, unit="hours"),
+                          node("a", "email", recipient_email="a@example.com")],
+                "edges": [edge("s", "d"), edge("d", "a")]}
+        stored = compile_flow(flow)
+        # same node count: the delay changed and the email is now sent right away
+        flow["nodes"][1]["data"]["duration"] = 3
+        flow["edges"] = [edge("s", "a"), edge("s", "d")]
+
+        flow_ir = FlowIR(flow, stored)
+        self.assertEqual(flow_ir.adjacency, {"s": ["a", "d"]})
+        self.assertEqual(flow_ir.delays, {"d": 10800})
+        self.assertEqual(flow_ir.schedule["offsets"], {"a": [0]})
+        self.assertNotEqual(flow_ir.version, stored["hash"])
+
+    def test_first_email_node_may_have_no_id(self):
+        first = {"type": "email", "data": {"subject": "First", "recipient_email": "a@example.com"}}
+        flow = {"nodes": [node("s", "start"), first, node("b", "email", subject="Second")], "edges": []}
+        flow_ir = FlowIR(flow, compile_flow(flow))
+        self.assertIs(flow_ir.first_email_node(), first)
+        self.assertEqual(flow_ir.email_nodes, ["b"])
+
+
+class MailPlanFlowAPITests(APITestMixin, TestCase):
+    def test_invalid_flow_is_rejected_and_valid_flow_stores_the_schedule(self):
+        plan = {"name": "Flow", "subject": "Hi", "content": "<p>Hi</p>", "trigger_type": "button_click"}
+        cyclic = {"nodes": [node("s", "start"), node("a", "email", recipient_email="a@example.com")],
+                  "edges": [edge("s", "a"), edge("a", "a")]}
+        response = self.client.post("/api/mailplans/", {**plan, "flow": cyclic}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("flow", response.data)
+
+        flow = {"nodes": [node("s", "start"), node("d", "delay", duration=2, unit="h"),
+                          node("a", "email", recipient_email="a@example.com")],
+                "edges": [edge("s", "d"), edge("d", "a")]}
+        response = self.client.post("/api/mailplans/", {**plan, "flow": flow}, format="json")
+        self.assertEqual(response.status_code, 201)
+        mp = MailPlan.objects.get(pk=response.data["id"])
+        self.assertEqual(mp.flow_ir["schedule"]["offsets"], {"a": [7200]})
+
+
+class ConditionalRequestTests(APITestMixin, TestCase):
+    def test_save_bumps_the_version_without_reading_it_back(self):
+        mp = self.make_plan()
+        self.assertEqual(mp.version, 1)
+        with CaptureQueriesContext(connection) as ctx:
+            mp.save()
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "mailplans_mailplan" ' in q["sql"]])
+        with self.assertNumQueries(1):
+            self.assertEqual(mp.version, 2)
+        mp.save(update_fields=["name"])
+        self.assertEqual(MailPlan.objects.get(pk=mp.pk).version, 3)
+        self.assertEqual(mp.version, 3)
+
+    def test_if_none_match_answers_304_until_the_plan_changes(self):
+        mp = self.make_plan()
+        url = f"/api/mailplans/{mp.id}/"
+        first = self.client.get(url)
+        self.assertEqual(first["ETag"], f'"{mp.id}-v1"')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+
+        self.client.patch(url, {"name": "Renamed"}, format="json")
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed["ETag"], f'"{mp.id}-v2"')
+        self.assertEqual(changed.data["name"], "Renamed")
+
+    def test_if_match_refuses_stale_updates_with_412(self):
+        mp = self.make_plan()
+        url = f"/api/mailplans/{mp.id}/"
+        etag = self.client.get(url)["ETag"]
+        MailPlan.objects.filter(pk=mp.pk).update(**MailPlan.touched())  # e.g. the scheduler
+
+        stale = self.client.patch(url, {"name": "Mine"}, format="json", HTTP_IF_MATCH=etag)
+        self.assertEqual(stale.status_code, 412)
+        self.assertEqual(stale["ETag"], f'"{mp.id}-v2"')
+        self.assertEqual(MailPlan.objects.get(pk=mp.pk).name, "Plan")
+
+        fresh = self.client.patch(url, {"name": "Mine"}, format="json", HTTP_IF_MATCH=stale["ETag"])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(fresh["ETag"], f'"{mp.id}-v3"')
+
+    def test_cached_detail_is_served_and_invalidated_on_write(self):
+        from .response_cache import detail_cache
+
+        mp = self.make_plan()
+        url = f"/api/mailplans/{mp.id}/"
+        with mock.patch.object(detail_cache, "alias", "default"):
+            etag = self.client.get(url)["ETag"]
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            mp.name = "Changed"
+            mp.save()
+            response = self.client.get(url)
+            self.assertEqual(response.data["name"], "Changed")
+            self.assertNotEqual(response["ETag"], etag)
+
+
+class ImportTests(TestCase):
+    def write_rows(self, rows):
+        fh = tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False)
+        with fh:
+            for row in rows:
+                fh.write(row if isinstance(row, str) else json.dumps(row))
+                fh.write("\n")
+        self.addCleanup(os.remove, fh.name)
+        return ImportJob.objects.create(format="ndjson", source_path=fh.name, chunk_size=2)
+
+    def plan_row(self, i, **extra):
+        return {"name": f"Imported {i}", "subject": "Hi", "content": "<p>Hi</p>",
+                "trigger_type": "button_click", "recipients": [f"user{i}@example.com"], **extra}
+
+    def test_resume_after_a_crash_does_not_duplicate_plans(self):
+        job = self.write_rows([self.plan_row(i) for i in range(1, 6)])
+        real_commit = importer._commit_chunk
+        calls = []
+
+        def crash_on_second_chunk(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("worker lost")
+            return real_commit(*args, **kwargs)
+
+        with mock.patch.object(importer, "_commit_chunk", side_effect=crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                importer.run_import(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.committed_rows, job.imported_rows), ("failed", 2, 2))
+        self.assertTrue(importer.can_resume(job))
+
+        job = importer.run_import(job.id)
+        self.assertEqual((job.status, job.committed_rows, job.imported_rows), ("done", 5, 5))
+        names = sorted(MailPlan.objects.values_list("name", flat=True))
+        self.assertEqual(names, [f"Imported {i}" for i in range(1, 6)])
+
+    def test_invalid_rows_are_collected_and_skipped(self):
+        job = self.write_rows([
+            self.plan_row(1),
+            "{not json",
+            self.plan_row(3, trigger_type="nope"),
+            self.plan_row(4, recipients=[]),
+            self.plan_row(5),
+        ])
+        with self.settings(MAILPLAN_IMPORT_MAX_ERRORS=2):
+            job = importer.run_import(job.id)
+        self.assertEqual((job.status, job.imported_rows, job.failed_rows), ("done", 2, 3))
+        # all rejected rows are counted, only MAILPLAN_IMPORT_MAX_ERRORS are kept
+        self.assertEqual([e["row"] for e in job.errors], [2, 3])
+        self.assertIn("trigger_type", job.errors[1]["errors"])
+        self.assertEqual(MailPlan.objects.count(), 2)
+
+    def test_a_live_runner_keeps_the_job(self):
+        job = self.write_rows([self.plan_row(i) for i in range(1, 4)])
+        self.assertIsNotNone(importer.claim(job.id, "worker-a"))
+
+        self.assertIsNone(importer.run_import(job.id, runner="worker-b"))
+        self.assertEqual(MailPlan.objects.count(), 0)
+        # the same runner (a redelivered task message) may pick it up again
+        self.assertIsNotNone(importer.claim(job.id, "worker-a"))
+
+    def test_a_run_that_lost_its_claim_stops_at_the_next_chunk(self):
+        job = self.write_rows([self.plan_row(i) for i in range(1, 6)])
+
+        def taken_over(j):
+            if j.committed_rows == 2:
+                importer.claim(job.id, "worker-b", force=True)
+
+        with self.assertRaises(importer.ImportConflict):
+            importer.run_import(job.id, runner="worker-a", progress=taken_over)
+        job.refresh_from_db()
+        self.assertEqual((job.runner, job.status, job.committed_rows), ("worker-b", "running", 2))
+        self.assertEqual(MailPlan.objects.count(), 2)
+
+
+class RecipientIndexTests(APITestMixin, TestCase):
+    def test_list_pages_unique_recipients(self):
+        self.make_plan(recipient_email="a@example.com")
+        self.make_plan(recipient_email="A@example.com, b@example.com")
+        self.make_plan(recipient_email="c@example.com")
+
+        response = self.client.get("/api/recipients/", {"page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["page_count"], 2)
+        self.assertEqual([r["email"] for r in response.data["recipients"]], ["a@example.com", "b@example.com"])
+        rest = self.client.get(response.data["next"])
+        self.assertEqual([r["email"] for r in rest.data["recipients"]], ["c@example.com"])
+
+    def test_list_response_keys(self):
+        # the documented shape (README, "API changes"); `count` was replaced by `page_count`
+        self.make_plan(recipient_email="a@example.com")
+        response = self.client.get("/api/recipients/")
+        self.assertEqual(set(response.data), {"next", "previous", "page_count", "recipients"})
+        self.assertEqual(response.data["recipients"], [{"email": "a@example.com", "name": "", "plan": "Plan"}])
+
+    def test_recipients_no_plan_sends_to_are_pruned(self):
+        mp = self.make_plan(recipient_email="old@example.com, shared@example.com")
+        self.make_plan(recipient_email="shared@example.com")
+        mp.recipient_email = "new@example.com"
+        mp.save()
+        self.assertEqual(
+            sorted(Recipient.objects.values_list("email", flat=True)),
+            ["new@example.com", "shared@example.com"],
+        )
+
+    def test_sync_recreates_a_recipient_pruned_under_it(self):
+        mp = self.make_plan(recipient_email="a@example.com, b@example.com")
+        MailPlanRecipient.objects.filter(mailplan=mp).delete()
+        real_lock = recipient_index._lock_ids
+        calls = []
+
+        def pruned_first(addresses):
+            if not calls:
+                # a concurrent prune() commits after the upsert, before the lookup
+                Recipient.objects.filter(email="b@example.com").delete()
+            calls.append(addresses)
+            return real_lock(addresses)
+
+        with mock.patch.object(recipient_index, "_lock_ids", side_effect=pruned_first):
+            recipient_index.sync([mp])
+        self.assertEqual(
+            sorted(MailPlanRecipient.objects.filter(mailplan=mp).values_list("recipient__email", flat=True)),
+            ["a@example.com", "b@example.com"],
+        )
+        self.assertEqual(calls[1], ["b@example.com"])
+
+
+class GenerateLoadTests(TestCase):
+    def test_seeded_logs_use_plan_recipients_and_delete_counts_plans(self):
+        out = io.StringIO()
+        call_command("generate_load", plans=5, logs=40, recipients=2, depth=1, fanout=1, delay_ratio=0,
+                     prefix="load-", stdout=out)
+        plans = MailPlan.objects.filter(name__startswith="load-")
+        self.assertEqual(plans.count(), 5)
+        for mp in plans:
+            addresses = set(mp.recipient_links.values_list("recipient__email", flat=True))
+            for to_email in EmailLog.objects.filter(mailplan=mp).values_list("to_email", flat=True):
+                self.assertIn(to_email.lower(), addresses)
+
+        call_command("generate_load", prefix="load-", delete=True, stdout=out)
+        self.assertIn("Deleted 5 plans, 40 email logs", out.getvalue())
+        self.assertFalse(MailPlan.objects.filter(name__startswith="load-").exists())
+
+
+class DeferCountdownTests(SimpleTestCase):
+    def test_short_waits_get_jitter_above_the_wait(self):
+        for _ in range(50):
+            self.assertTrue(2.0 <= defer_countdown(2.0) <= 3.0)
+        self.assertGreaterEqual(defer_countdown(0), 1.0)
+
+    @override_settings(MAILPLAN_RATE_LIMIT_MAX_DEFER=30)
+    def test_long_waits_are_capped_below_the_limit(self):
+        countdowns = {defer_countdown(3600) for _ in range(50)}
+        self.assertTrue(all(22.5 <= c <= 30 for c in countdowns))
+        self.assertGreater(len(countdowns), 1)
+
+
+def transient(addresses):
+    """_deliver_messages stand-in: SMTPServerDisconnected for `addresses`, sent otherwise."""
+    def deliver(messages):
+        return [
+            (0, smtplib.SMTPServerDisconnected("Connection unexpectedly closed")) if to[0] in addresses else (1, None)
+            for _, _, to in messages
+        ]
+    return deliver
+
+
+class SendTaskMixin(APITestMixin):
+    def setUp(self):
+        super().setUp()
+        idempotency.cache.clear()
+
+    def deliveries(self, deliver):
+        """Record the recipients of every _deliver_messages call."""
+        calls = []
+
+        def record(messages):
+            calls.append([to[0] for _, _, to in messages])
+            return deliver(messages)
+        return calls, mock.patch("mailplans.tasks._deliver_messages", side_effect=record)
+
+
+class SendRetryTests(SendTaskMixin, TestCase):
+    def test_retry_resends_only_failed_recipients_from_the_log(self):
+        mp = self.make_plan(recipient_email="a@example.com, b@example.com")
+        failing = {"b@example.com"}
+
+        def deliver(messages):
+            outcome = transient(set(failing))(messages)
+            failing.clear()  # the retry goes through
+            return outcome
+
+        calls, patch = self.deliveries(deliver)
+        with patch, mock.patch("mailplans.tasks._render_message", wraps=tasks._render_message) as render:
+            send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "retry-run"})
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(calls, [["a@example.com", "b@example.com"], ["b@example.com"]])
+        logs = dict(EmailLog.objects.values_list("to_email", "attempts"))
+        self.assertEqual(logs, {"a@example.com": 1, "b@example.com": 2})
+        self.assertEqual(set(EmailLog.objects.values_list("status", flat=True)), {"sent"})
+
+    def test_rows_are_failed_after_the_last_retry(self):
+        mp = self.make_plan(recipient_email="a@example.com")
+        calls, patch = self.deliveries(transient({"a@example.com"}))
+        with patch, mock.patch("mailplans.tasks.metrics.count_emails") as count_emails:
+            send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "gave-up-run"})
+
+        self.assertEqual(len(calls), send_mail_task.max_retries + 1)
+        log = EmailLog.objects.get()
+        self.assertEqual((log.status, log.attempts), ("failed", send_mail_task.max_retries + 1))
+        count_emails.assert_any_call("send_mail_task", "gave_up", 1)
+
+
+@mock.patch("mailplans.tasks.enqueue_sends", return_value=1)
+class ScheduledSendTests(APITestMixin, TestCase):
+    def test_delayed_flow_nodes_are_stored_with_their_due_time(self, enqueue_sends):
+        flow = {"nodes": [node("s", "start"), node("a", "email", recipient_email="a@example.com"),
+                          node("d", "delay", duration=2, unit="hours"),
+                          node("b", "email", recipient_email="b@example.com"),
+                          node("d2", "delay", duration=1, unit="days"),
+                          node("c", "email", recipient_email="c@example.com")],
+                "edges": [edge("s", "a"), edge("s", "d"), edge("d", "b"), edge("b", "d2"), edge("d2", "c")]}
+        mp = self.make_plan(flow=flow)
+        before = timezone.now()
+        result = execute_flow_task.apply(args=(mp.id, "flow-run")).get()
+        after = timezone.now()
+
+        self.assertEqual(result["traversal"]["sends"], 3)
+        self.assertEqual(enqueue_sends.call_args.args[0], [(mp.id, "a")])
+        rows = {row.node_id: row for row in ScheduledSend.objects.filter(mailplan=mp)}
+        self.assertEqual(set(rows), {"b", "c"})
+        for node_id, offset in (("b", 7200), ("c", 7200 + 86400)):
+            self.assertEqual(rows[node_id].run_id, "flow-run")
+            self.assertTrue(before + timedelta(seconds=offset) <= rows[node_id].due_at
+                            <= after + timedelta(seconds=offset))
+
+    def test_dispatch_publishes_due_rows_once(self, enqueue_sends):
+        mp = self.make_plan()
+        now = timezone.now()
+        due = [ScheduledSend.objects.create(mailplan=mp, node_id=f"n{i}", run_id="r",
+                                            due_at=now - timedelta(minutes=i + 1)) for i in range(3)]
+        later = ScheduledSend.objects.create(mailplan=mp, node_id="later", run_id="r",
+                                             due_at=now + timedelta(hours=1))
+
+        result = dispatch_scheduled_sends()
+        self.assertEqual(result["dispatched"], 3)
+        published = [send for call in enqueue_sends.call_args_list for send in call.args[0]]
+        # oldest due first; claimed rows are removed in the publishing transaction
+        self.assertEqual(published, [(mp.id, row.node_id, "r") for row in reversed(due)])
+        self.assertEqual(list(ScheduledSend.objects.values_list("pk", flat=True)), [later.pk])
+
+        self.assertEqual(dispatch_scheduled_sends(), {"dispatched": 0, "messages": 0})
+        self.assertEqual(enqueue_sends.call_count, 1)
+
+    def test_rows_stay_pending_when_publishing_fails(self, enqueue_sends):
+        mp = self.make_plan()
+        ScheduledSend.objects.create(mailplan=mp, node_id="a", run_id="r", due_at=timezone.now())
+        enqueue_sends.side_effect = ConnectionError("broker down")
+        with self.assertRaises(ConnectionError):
+            dispatch_scheduled_sends()
+        self.assertEqual(ScheduledSend.objects.count(), 1)
+
+
+@mock.patch("mailplans.tasks.enqueue_sends", return_value=1)
+class SchedulerTests(APITestMixin, TestCase):
+    def test_scheduled_plan_fires_once_per_scheduled_time(self, enqueue_sends):
+        mp = self.make_plan(status="scheduled", scheduled_time=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(schedule_due_mailplans()["scheduled_sent"], 1)
+        self.assertEqual(schedule_due_mailplans()["scheduled_sent"], 0)
+        self.assertEqual(enqueue_sends.call_count, 1)
+        self.assertEqual(enqueue_sends.call_args.args[0][0][0], mp.id)
+        mp.refresh_from_db()
+        self.assertGreaterEqual(mp.last_triggered_at, mp.scheduled_time)
+
+        # rescheduled: the watermark is behind the new time, so it fires again
+        first_fire = mp.last_triggered_at
+        MailPlan.objects.filter(pk=mp.pk).update(scheduled_time=timezone.now())
+        self.assertEqual(schedule_due_mailplans()["scheduled_sent"], 1)
+        mp.refresh_from_db()
+        self.assertGreater(mp.last_triggered_at, first_fire)
+        self.assertEqual(enqueue_sends.call_count, 2)
+
+    def test_after_1_day_plan_fires_once(self, enqueue_sends):
+        mp = self.make_plan(trigger_type="after_1_day")
+        MailPlan.objects.filter(pk=mp.pk).update(created_at=timezone.now() - timedelta(days=2))
+        with mock.patch("mailplans.tasks._publish_flow_executions") as publish:
+            self.assertEqual(schedule_due_mailplans()["one_day_triggered"], 1)
+            self.assertEqual(schedule_due_mailplans()["one_day_triggered"], 0)
+        publish.assert_called_once_with([mp.id])
+        mp.refresh_from_db()
+        self.assertEqual(mp.status, "scheduled")
+        self.assertIsNotNone(mp.last_triggered_at)
+
+
+class SendIdempotencyTests(SendTaskMixin, TestCase):
+    def test_same_send_twice_delivers_and_logs_once(self):
+        mp = self.make_plan(recipient_email="a@example.com")
+        calls, patch = self.deliveries(transient(set()))
+        with patch:
+            send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "same-run"})
+            second = send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "same-run"}).get()
+            # claims expired from the cache: the EmailLog key still catches it
+            idempotency.cache.clear()
+            third = send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "same-run"}).get()
+        self.assertEqual(calls, [["a@example.com"]])
+        self.assertEqual((second["status"], third["status"]), ("duplicate", "duplicate"))
+        self.assertEqual(EmailLog.objects.count(), 1)
+
+        send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "next-run"})
+        self.assertEqual(EmailLog.objects.count(), 2)
+
+    def test_duplicate_log_rows_are_dropped_on_insert(self):
+        mp = self.make_plan()
+        writer = EmailLogWriter(max_pending=1000, max_age=1000)
+        for _ in range(2):
+            writer.add(EmailLog(mailplan=mp, to_email="a@example.com", subject="s", body="",
+                                status="sent", idempotency_key="k" * 40))
+            writer.flush()
+        self.assertEqual(EmailLog.objects.filter(idempotency_key="k" * 40).count(), 1)
+
+    @override_settings(MAILPLAN_SEND_LOG_CHUNK=2)
+    def test_redelivery_after_a_crash_skips_logged_chunks(self):
+        mp = self.make_plan(recipient_email="a@example.com, b@example.com, c@example.com")
+        crashed = []
+
+        def crash_on_second_chunk(messages):
+            if not crashed and messages[0][2] == ["c@example.com"]:
+                crashed.append(True)
+                # the first chunk is already in EmailLog
+                self.assertEqual(EmailLog.objects.count(), 2)
+                raise SystemError("worker lost")
+            return transient(set())(messages)
+
+        calls, patch = self.deliveries(crash_on_second_chunk)
+        with patch:
+            send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "long-run"})
+            # acks_late redelivery after the in-flight claims expired
+            idempotency.cache.clear()
+            send_mail_task.apply(args=(mp.id,), kwargs={"run_id": "long-run"})
+        self.assertEqual(calls, [["a@example.com", "b@example.com"], ["c@example.com"], ["c@example.com"]])
+        self.assertEqual(
+            sorted(EmailLog.objects.values_list("to_email", flat=True)),
+            ["a@example.com", "b@example.com", "c@example.com"],
+        )
+
+
+class SendBatchTests(SendTaskMixin, TestCase):
+    @override_settings(MAILPLAN_SEND_BATCH_SIZE=2)
+    def test_due_plans_are_sent_in_batches_once_each(self):
+        plans = [self.make_plan(recipient_email=f"user{i}@example.com") for i in range(5)]
+        with mock.patch.object(send_mail_batch_task, "apply_async") as apply_async:
+            self.assertEqual(enqueue_sends([(mp.id, None) for mp in plans], run_id="batch-run"), 3)
+        batches = [call.kwargs["args"][0] for call in apply_async.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual([pair[0] for batch in batches for pair in batch], [mp.id for mp in plans])
+
+        calls, patch = self.deliveries(transient(set()))
+        with patch:
+            for batch in batches:
+                send_mail_batch_task.apply(args=(batch,))
+            # a redelivered batch message sends nothing again
+            send_mail_batch_task.apply(args=(batches[0],))
+        self.assertEqual([call for call in calls if call], [
+            ["user0@example.com", "user1@example.com"],
+            ["user2@example.com", "user3@example.com"],
+            ["user4@example.com"],
+        ])
+        self.assertEqual(
+            sorted(EmailLog.objects.values_list("mailplan_id", "status")),
+            [(mp.id, "sent") for mp in plans],
+        )
+        self.assertEqual(set(MailPlan.objects.values_list("status", flat=True)), {"sent"})
+
+
+class MailPlanListTests(APITestMixin, TestCase):
+    def test_cursor_pages_step_through_plans_sharing_a_created_at(self):
+        plans = [self.make_plan(name=f"Plan {i}") for i in range(5)]
+        MailPlan.objects.update(created_at=timezone.now())
+
+        pages, url = [], "/api/mailplans/?page_size=2&fields=id"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(set(response.data), {"next", "previous", "results"})
+            pages.append([row["id"] for row in response.data["results"]])
+            url = response.data["next"]
+        self.assertEqual(pages, [[plans[4].id, plans[3].id], [plans[2].id, plans[1].id], [plans[0].id]])
+
+        back = self.client.get(response.data["previous"])
+        self.assertEqual([row["id"] for row in back.data["results"]], pages[1])
+
+    def test_fields_and_exclude_pick_the_returned_fields(self):
+        self.make_plan()
+        rows = self.client.get("/api/mailplans/", {"fields": "name,id,status"}).data["results"]
+        self.assertEqual(list(rows[0]), ["id", "name", "status"])
+
+        row = self.client.get("/api/mailplans/", {"exclude": "flow,template_vars"}).data["results"][0]
+        self.assertNotIn("flow", row)
+        self.assertNotIn("template_vars", row)
+        self.assertIn("subject", row)
+
+        row = self.client.get("/api/mailplans/", {"fields": "id,recipient_email"}).data["results"][0]
+        self.assertEqual(row["recipient_email"], "to@example.com")
+        flow = {"nodes": [node("s", "start"), node("a", "email", recipient_email="flow@example.com")],
+                "edges": [edge("s", "a")]}
+        mp = self.make_plan(flow=flow)
+        row = self.client.get("/api/mailplans/", {"fields": "id,recipient_email"}).data["results"][0]
+        self.assertEqual((row["id"], row["recipient_email"]), (mp.id, "flow@example.com"))
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get("/api/mailplans/", {"fields": "id,password"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", str(response.data["fields"]))
+        self.assertEqual(self.client.get("/api/mailplans/", {"exclude": "nope"}).status_code, 400)
+
+
+class TemplateCacheTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(template_cache_module, "template_cache", CompiledTemplateCache(maxsize=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        compile_patch = mock.patch.object(template_cache_module, "Template", wraps=template_cache_module.Template)
+        self.compiles = compile_patch.start()
+        self.addCleanup(compile_patch.stop)
+
+    def compiled(self):
+        return [c.args[0] for c in self.compiles.call_args_list]
+
+    def test_hits_reuse_the_compiled_template(self):
+        first = get_compiled_template("Hi {{ name }}")
+        self.assertIs(get_compiled_template("Hi {{ name }}"), first)
+        self.assertEqual(first.render(Context({"name": "Ann"})), "Hi Ann")
+        self.assertEqual(self.compiled(), ["Hi {{ name }}"])
+        stats = cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_ratio"]), (1, 1, 0.5))
+
+    def test_least_recently_used_entry_is_evicted_past_maxsize(self):
+        get_compiled_template("a")
+        get_compiled_template("b")
+        get_compiled_template("a")  # "b" is now the least recently used
+        get_compiled_template("c")  # evicts "b"
+        get_compiled_template("a")
+        get_compiled_template("b")  # recompiled, evicts "c"
+        get_compiled_template("c")  # recompiled, evicts "a"
+        self.assertEqual(self.compiled(), ["a", "b", "c", "b", "c"])
+        stats = cache_stats()
+        self.assertEqual(
+            {k: stats[k] for k in ("size", "maxsize", "hits", "misses", "evictions")},
+            {"size": 2, "maxsize": 2, "hits": 2, "misses": 5, "evictions": 3},
+        )
+
+    def test_compile_errors_are_not_cached(self):
+        with self.assertRaises(TemplateSyntaxError):
+            get_compiled_template("{% if %}")
+        self.assertEqual(cache_stats()["size"], 0)
+
+
+class RenderedBodyTests(APITestMixin, TestCase):
+    def test_text_round_trips_through_zlib(self):
+        text = "<p>Hallo Jürgen 👋</p>" * 200
+        blob = RenderedBody.from_text(text)
+        self.assertEqual(blob.size, len(text.encode("utf-8")))
+        self.assertLess(len(blob.data), blob.size)
+        self.assertEqual(blob.hash, RenderedBody.hash_text(text))
+        blob.save()
+        self.assertEqual(RenderedBody.objects.get(pk=blob.hash).text, text)
+
+    def test_identical_bodies_share_one_row(self):
+        mp = self.make_plan()
+        writer = EmailLogWriter(max_pending=1000, max_age=1000)
+        for to_email, text in [("a@example.com", "<p>same</p>"), ("b@example.com", "<p>same</p>"),
+                               ("c@example.com", "<p>other</p>")]:
+            rendered_id = writer.store_body(text)
+            writer.add(EmailLog(mailplan=mp, to_email=to_email, subject="s", body="", status="sent",
+                                rendered_id=rendered_id))
+        writer.flush()
+        # a later flush referencing the same body does not add a row either
+        writer.add(EmailLog(mailplan=mp, to_email="d@example.com", subject="s", body="", status="sent",
+                            rendered_id=writer.store_body("<p>same</p>")))
+        writer.flush()
+
+        self.assertEqual(RenderedBody.objects.count(), 2)
+        logs = EmailLog.objects.filter(mailplan=mp).order_by("to_email")
+        self.assertEqual(len({log.rendered_id for log in logs}), 2)
+        self.assertEqual([log.rendered_html for log in logs],
+                         ["<p>same</p>", "<p>same</p>", "<p>other</p>", "<p>same</p>"])
+
+    def test_compact_command_moves_legacy_bodies_into_shared_rows(self):
+        mp = self.make_plan()
+        texts = ["<p>one</p>", "<p>two</p>", "<p>one</p>", "<p>one</p>", "<p>two</p>"]
+        legacy = [
+            EmailLog.objects.create(mailplan=mp, to_email=f"r{i}@example.com", subject="s", body="",
+                                    status="sent", rendered_body=text)
+            for i, text in enumerate(texts)
+        ]
+        shared = RenderedBody.from_text("<p>one</p>")
+        shared.save()
+        compacted = EmailLog.objects.create(
+            mailplan=mp, to_email="new@example.com", subject="s", body="", status="sent", rendered=shared
+        )
+
+        out = io.StringIO()
+        call_command("compact_rendered_bodies", "--chunk-size", "2", stdout=out)
+
+        self.assertIn("Done: 5 EmailLog rows", out.getvalue())
+        self.assertEqual(RenderedBody.objects.count(), 2)
+        for log, text in zip(legacy, texts):
+            log.refresh_from_db()
+            self.assertIsNone(log.rendered_body)
+            self.assertEqual(log.rendered_id, RenderedBody.hash_text(text))
+            self.assertEqual(log.rendered_html, text)
+        compacted.refresh_from_db()
+        self.assertEqual(compacted.rendered_html, "<p>one</p>")
+
+
+class RoutingTests(SimpleTestCase):
+    @override_settings(MAILPLAN_TRANSACTIONAL_MAX_RECIPIENTS=3)
+    def test_queue_for(self):
+        self.assertEqual(queue_for("button_click"), "transactional")
+        self.assertEqual(queue_for("on_signup", recipients=3), "transactional")
+        self.assertEqual(queue_for("on_signup", recipients=4), "bulk")
+        self.assertEqual(queue_for("scheduled"), "bulk")
+        self.assertEqual(queue_for("after_1_day"), "bulk")
+        # an explicit send_queue wins over the trigger and the recipient count
+        self.assertEqual(queue_for("scheduled", "transactional", recipients=1000), "transactional")
+        self.assertEqual(queue_for("button_click", "bulk"), "bulk")
+
+    @override_settings(CELERY_BROKER_URL="redis://localhost:6379/0")
+    def test_broker_priority_is_inverted_for_redis(self):
+        self.assertEqual([broker_priority(p) for p in (0, 5, 9)], [9, 4, 0])
+        self.assertEqual([broker_priority(p) for p in (-3, 42, "7")], [9, 0, 2])
+        self.assertEqual(broker_priority(None), 9 - DEFAULT_PRIORITY)
+
+    @override_settings(CELERY_BROKER_URL="amqp://guest@localhost//")
+    def test_broker_priority_is_kept_for_amqp(self):
+        self.assertEqual([broker_priority(p) for p in (0, 5, 9, 42, "x")], [0, 5, 9, 9, DEFAULT_PRIORITY])
+
+    def test_workers_poll_their_queues_round_robin(self):
+        # strict priority polling would starve scheduler/celery in the 'all' profile
+        self.assertNotIn("queue_order_strategy", celery_app.conf.broker_transport_options)
+        self.assertEqual(WORKER_PROFILES["all"]["queues"],
+                         ["transactional", "bulk", "planning", "scheduler", "celery"])
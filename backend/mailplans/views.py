@@ -2,48 +2,128 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Value, When
+from django.db.models.fields.json import KeyTransform
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
-from .models import MailPlan
-from .serializers import MailPlanSerializer
-from .tasks import send_mail_task, execute_flow_task
+from .models import MailPlan, TriggerBatch
+from .pagination import MailPlanCursorPagination
+from .serializers import BulkTriggerSerializer, MailPlanListSerializer, MailPlanSerializer, select_fields
+from .tasks import ROUTING_FIELDS, execute_flow_task, publish_trigger_batch, send_mail_task
+from .flow import FlowIR
+from .idempotency import idempotency, new_run_id, run_id_for
+from .routing import plan_planning_options, plan_send_options
+from . import response_cache
+from .response_cache import body_etag, detail_cache, etag_for, etag_matches
 import logging
-import json
 
 logger = logging.getLogger(__name__)
 
 
-def flow_has_delay(flow_value):
-    try:
-        if not flow_value:
-            return False
-        flow = flow_value
-        if isinstance(flow_value, str):
-            try:
-                flow = json.loads(flow_value or "{}")
-            except Exception:
-                flow = {}
-        if not isinstance(flow, dict):
-            return False
-        nodes = flow.get("nodes", []) or []
-        for node in nodes:
-            if not isinstance(node, dict):
-                continue
-            ntype = (node.get("type") or "").lower()
-            data = node.get("data") or {}
-            if ntype in ("delay", "wait", "delay_node"):
-                return True
-            if any(k in data for k in ("duration", "delay_minutes", "delay_seconds", "delay_hours", "unit")):
-                return True
-        return False
-    except Exception:
-        logger.exception("Error while checking flow for delay nodes.")
-        return False
+def _with_etag(response, etag):
+    response["ETag"] = etag
+    # clients may keep the body but must revalidate it (If-None-Match) before reuse
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _not_modified(etag):
+    return _with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
 
 
 class MailPlanViewSet(viewsets.ModelViewSet):
-    queryset = MailPlan.objects.all().order_by('-created_at')
+    queryset = MailPlan.objects.all().order_by('-created_at', '-id')
     serializer_class = MailPlanSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MailPlanCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        """
+        GET /api/mailplans/?fields=id,name,status&exclude=flow&page_size=50&cursor=...
+
+        Cursor-paginated (see MailPlanCursorPagination). `fields` / `exclude`
+        pick the returned fields; only their columns are selected, with
+        .values() rows serialized by MailPlanListSerializer, so lists that
+        leave out flow / template_vars never load those JSON columns.
+        """
+        fields = select_fields(request.query_params, list(MailPlanSerializer().fields))
+        # created_at and id are always read: the cursor position is built from them
+        columns = {'id', 'created_at'} | {name for name in fields if name != 'recipient_email'}
+        queryset = self.filter_queryset(self.get_queryset())
+        if 'recipient_email' in fields:
+            columns.add('recipient_email')
+            queryset = queryset.annotate(ir_recipient=KeyTransform('recipient', 'flow_ir'))
+            columns.add('ir_recipient')
+        rows = queryset.values(*columns)
+
+        page = self.paginate_queryset(rows)
+        serializer = MailPlanListSerializer(page if page is not None else rows, many=True, fields=fields)
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        etag = body_etag(response.data)
+        if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+            return _not_modified(etag)
+        return _with_etag(response, etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        GET /api/mailplans/{id}/ with a strong ETag ("<id>-v<version>").
+
+        If-None-Match is answered with 304 from the response cache, or from a
+        version-only query when the cache is off or cold, before the plan is
+        loaded or serialized. Full responses are put into the cache.
+        """
+        pk = str(kwargs.get(self.lookup_url_kwarg or self.lookup_field, ''))
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if not pk.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+
+        cached = detail_cache.get(pk)
+        if cached is not None:
+            etag, data = cached
+            if etag_matches(if_none_match, etag):
+                return _not_modified(etag)
+            return _with_etag(Response(data), etag)
+
+        if if_none_match:
+            version = self.filter_queryset(self.get_queryset()).filter(pk=pk).values_list('version', flat=True).first()
+            if version is not None and etag_matches(if_none_match, etag_for(pk, version)):
+                return _not_modified(etag_for(pk, version))
+
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        etag = etag_for(instance.pk, instance.version)
+        detail_cache.set(instance.pk, etag, data)
+        return _with_etag(Response(data), etag)
+
+    def update(self, request, *args, **kwargs):
+        """
+        PUT / PATCH with optional optimistic concurrency: when If-Match is
+        sent, the row is locked and the update is refused with 412 (and the
+        current ETag) unless the plan is still at that version.
+        """
+        partial = kwargs.pop('partial', False)
+        if_match = request.META.get('HTTP_IF_MATCH')
+        with transaction.atomic():
+            instance = self.get_object()
+            if if_match:
+                instance = self.get_queryset().select_for_update().get(pk=instance.pk)
+                current = etag_for(instance.pk, instance.version)
+                if not etag_matches(if_match, current):
+                    return _with_etag(Response(
+                        {"error": "MailPlan was modified since it was read (If-Match does not match).",
+                         "etag": current},
+                        status=status.HTTP_412_PRECONDITION_FAILED,
+                    ), current)
+            serializer = self.get_serializer(instance, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            self.perform_update(serializer)
+        return _with_etag(Response(serializer.data), etag_for(instance.pk, instance.version))
 
     def perform_create(self, serializer):
         """
@@ -71,6 +151,11 @@ class MailPlanViewSet(viewsets.ModelViewSet):
           - OR send header: X-MANUAL-TRIGGER: "1"
 
         This prevents accidental triggers from UI redirects or other code.
+
+        An optional Idempotency-Key header makes retried requests safe: the
+        same key for the same plan maps to the same run, so a duplicate
+        request is answered without enqueueing again, and the sends of that
+        run are deduplicated per recipient.
         """
         mp = self.get_object()
 
@@ -105,51 +190,224 @@ class MailPlanViewSet(viewsets.ModelViewSet):
             request.META.get('REMOTE_ADDR'), request.META.get('HTTP_REFERER')
         )
 
-        flow_val = getattr(mp, "flow", {}) or {}
+        idem_key = (request.META.get('HTTP_IDEMPOTENCY_KEY') or '').strip()
+        marker = None
+        if idem_key:
+            run_id = run_id_for("trigger", mp.id, idem_key)
+            marker = f"mailplan:trigger:{run_id}"
+            if not idempotency.cache.add(marker, 1, idempotency.ttl):
+                idempotency.stats["duplicates_cache"] += 1
+                logger.info("Duplicate trigger for MailPlan %s ignored (Idempotency-Key %s).", mp.id, idem_key)
+                return Response({"message": "Duplicate trigger ignored.", "run_id": run_id, "duplicate": True},
+                                status=status.HTTP_200_OK)
+        else:
+            run_id = new_run_id("trigger")
+
+        # fire-once watermark shared with schedule_due_mailplans
+        mp.last_triggered_at = timezone.now()
 
         try:
-            if flow_has_delay(flow_val):
-                execute_flow_task.delay(mp.id)
+            if FlowIR.for_plan(mp).has_delay:
+                execute_flow_task.apply_async(args=(mp.id,), kwargs={"run_id": run_id}, **plan_planning_options(mp))
                 try:
                     mp.status = 'scheduled'
-                    mp.save(update_fields=['status'])
+                    mp.save(update_fields=['status', 'last_triggered_at'])
                 except Exception:
                     logger.exception("Failed to update MailPlan status to scheduled after enqueueing flow.")
                 logger.info("Enqueued execute_flow_task for MailPlan %s (contains delay nodes).", mp.id)
-                return Response({"message": "Flow enqueued; will honor delay nodes."}, status=status.HTTP_202_ACCEPTED)
+                return Response({"message": "Flow enqueued; will honor delay nodes.", "run_id": run_id}, status=status.HTTP_202_ACCEPTED)
             else:
-                send_mail_task.delay(mp.id)
+                send_mail_task.apply_async(args=(mp.id,), kwargs={"run_id": run_id}, **plan_send_options(mp))
                 try:
                     mp.status = 'sent'
-                    mp.save(update_fields=['status'])
+                    mp.save(update_fields=['status', 'last_triggered_at'])
                 except Exception:
                     logger.exception("Failed to update MailPlan status to sent after enqueueing send_mail_task.")
                 logger.info("Enqueued send_mail_task for MailPlan %s (no delay nodes).", mp.id)
-                return Response({"message": "Mail send enqueued (no delays in flow)."}, status=status.HTTP_202_ACCEPTED)
+                return Response({"message": "Mail send enqueued (no delays in flow).", "run_id": run_id}, status=status.HTTP_202_ACCEPTED)
         except Exception as exc:
             logger.exception("Trigger processing failed for MailPlan %s: %s", mp.id, exc)
 
         # fallback behavior unchanged...
         try:
-            execute_flow_task.delay(mp.id)
+            execute_flow_task.apply_async(args=(mp.id,), kwargs={"run_id": run_id}, **plan_planning_options(mp))
             try:
                 mp.status = 'scheduled'
-                mp.save(update_fields=['status'])
+                mp.save(update_fields=['status', 'last_triggered_at'])
             except Exception:
                 logger.exception("Failed to update MailPlan status to scheduled in fallback.")
-            return Response({"message": "Flow enqueued (fallback)."}, status=status.HTTP_202_ACCEPTED)
+            return Response({"message": "Flow enqueued (fallback).", "run_id": run_id}, status=status.HTTP_202_ACCEPTED)
         except Exception as exc2:
             logger.warning("Fallback enqueue execute_flow_task failed for MailPlan %s: %s", mp.id, exc2)
 
         try:
-            send_mail_task.apply(args=(mp.id,))
+            send_mail_task.apply(args=(mp.id,), kwargs={"run_id": run_id})
             try:
                 mp.status = 'sent'
-                mp.save(update_fields=['status'])
+                mp.save(update_fields=['status', 'last_triggered_at'])
             except Exception:
                 logger.exception("Failed to update MailPlan status to sent in final fallback.")
-            return Response({"message": "Sent synchronously (final fallback)"}, status=status.HTTP_200_OK)
+            return Response({"message": "Sent synchronously (final fallback)", "run_id": run_id}, status=status.HTTP_200_OK)
         except Exception as exc3:
             logger.exception("Final synchronous send failed for MailPlan %s: %s", mp.id, exc3)
+            if marker:
+                # nothing was enqueued: let a retry with the same Idempotency-Key try again
+                try:
+                    idempotency.cache.delete(marker)
+                except Exception:
+                    logger.exception("Could not clear the trigger marker of MailPlan %s.", mp.id)
             return Response({"error": "Unable to enqueue or send at this time."},
                             status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @action(detail=False, methods=['post'])
+    def bulk_trigger(self, request):
+        """
+        POST /api/mailplans/bulk_trigger/
+            {"ids": [1, 2, ...], "confirm": true}
+            {"filter": {"status": "paused", "name": "release"}, "confirm": true}
+
+        Triggers many button_click plans in one request, like POST
+        /api/mailplans/{id}/trigger/ does for one: the plans are read in one
+        query, their status ('scheduled' for flows with delay nodes, 'sent'
+        otherwise) and last_triggered_at are set with one UPDATE, and the
+        Celery messages (send batches, execute_flow_task chunks) are published
+        over one broker connection. The messages are published once the
+        status update and the batch are committed; if publishing fails, the
+        plans get their previous status back and the batch is dropped.
+
+        Every send of the batch shares one run id, returned as `batch_id`;
+        GET /api/mailplans/bulk_trigger/{batch_id}/ reports its progress.
+        Ids that do not exist or are not button_click plans are listed in
+        `rejected`. With an Idempotency-Key header (scoped to the caller) a
+        retried request returns the batch of the first one instead of
+        triggering again.
+        """
+        params = BulkTriggerSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+
+        header_confirm = request.META.get('HTTP_X_MANUAL_TRIGGER') in ('1', 'true', 'True')
+        if not (data['confirm'] or header_confirm):
+            return Response(
+                {"error": "Manual trigger requires explicit confirmation ('confirm': true in JSON body or header X-MANUAL-TRIGGER: 1)."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        idem_key = (request.META.get('HTTP_IDEMPOTENCY_KEY') or '').strip()
+        run_id = run_id_for("bulk", request.user.pk, idem_key) if idem_key else new_run_id("bulk")
+        if idem_key:
+            existing = TriggerBatch.objects.filter(run_id=run_id).first()
+            if existing is not None:
+                logger.info("Duplicate bulk trigger ignored (Idempotency-Key %s).", idem_key)
+                return Response(self._batch_summary(existing, duplicate=True), status=status.HTTP_200_OK)
+
+        # one query: trigger type, routing fields and the compiled has_delay flag of every plan
+        limit = getattr(settings, 'MAILPLAN_BULK_TRIGGER_MAX', 1000)
+        fields = ('id', 'has_delay') + ROUTING_FIELDS + ('status', 'last_triggered_at')
+        plans = MailPlan.objects.annotate(has_delay=KeyTransform('has_delay', 'flow_ir'))
+        if 'ids' in data:
+            wanted = list(dict.fromkeys(data['ids']))
+            rows = plans.filter(id__in=wanted).values_list(*fields)
+        else:
+            rows = plans.filter(trigger_type='button_click', **data['filter']).order_by('id').values_list(*fields)[:limit + 1]
+        found = {row[0]: row for row in rows}
+        if 'ids' not in data:
+            if len(found) > limit:
+                return Response({"error": f"The filter selects more than {limit} plans; narrow it down."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            wanted = list(found)
+
+        rejected = {}
+        for mp_id in wanted:
+            if mp_id not in found:
+                rejected[mp_id] = "Not found."
+            elif found[mp_id][2] != 'button_click':
+                rejected[mp_id] = "Manual trigger is allowed only for plans with trigger_type='button_click'."
+        accepted = [mp_id for mp_id in wanted if mp_id not in rejected]
+        if not accepted:
+            return Response({"error": "No plan to trigger.", "rejected": rejected}, status=status.HTTP_400_BAD_REQUEST)
+
+        # (id, has_delay, trigger_type, send_queue, priority, recipient_email, status, last_triggered_at)
+        flows = {mp_id: found[mp_id][4] for mp_id in accepted if found[mp_id][1]}
+        sends = {mp_id: found[mp_id][2:6] for mp_id in accepted if mp_id not in flows}
+        previous = {mp_id: found[mp_id][6:] for mp_id in accepted}
+        try:
+            with transaction.atomic():
+                MailPlan.objects.filter(id__in=accepted).update(
+                    status=Case(When(id__in=list(flows), then=Value('scheduled')), default=Value('sent')),
+                    # fire-once watermark shared with schedule_due_mailplans
+                    last_triggered_at=timezone.now(),
+                    **MailPlan.touched(),
+                )
+                response_cache.invalidate(*accepted)
+                batch = TriggerBatch.objects.create(
+                    run_id=run_id, plan_ids=accepted, flow_plans=len(flows),
+                    created_by=request.user if request.user.is_authenticated else None,
+                )
+        except IntegrityError:
+            # a concurrent request with the same Idempotency-Key created the batch first
+            existing = get_object_or_404(TriggerBatch, run_id=run_id)
+            return Response(self._batch_summary(existing, duplicate=True), status=status.HTTP_200_OK)
+        except Exception as exc:
+            logger.exception("Bulk trigger of %s plans failed: %s", len(accepted), exc)
+            return Response({"error": "Unable to enqueue at this time."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        # published after the commit, so workers never see uncommitted statuses
+        try:
+            batch.messages = publish_trigger_batch(run_id, sends, flows)
+        except Exception as exc:
+            logger.exception("Publishing bulk trigger %s failed: %s", run_id, exc)
+            self._undo_bulk_trigger(batch, previous)
+            return Response({"error": "Unable to enqueue at this time."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        TriggerBatch.objects.filter(pk=batch.pk).update(messages=batch.messages)
+
+        logger.info(
+            "Bulk trigger %s by user %s: %s plans (%s flows) in %s messages, %s rejected.",
+            run_id, getattr(request.user, 'id', None), len(accepted), len(flows), batch.messages, len(rejected),
+        )
+        summary = self._batch_summary(batch)
+        summary["rejected"] = rejected
+        return Response(summary, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'bulk_trigger/(?P<batch_id>[\w-]+)')
+    def bulk_trigger_status(self, request, batch_id=None):
+        """GET /api/mailplans/bulk_trigger/{batch_id}/ - aggregate progress of a bulk trigger."""
+        batch = get_object_or_404(TriggerBatch, run_id=batch_id)
+        return Response({**self._batch_summary(batch), **batch.progress()})
+
+    @staticmethod
+    def _undo_bulk_trigger(batch, previous):
+        """
+        Give the plans of a batch whose publish failed their previous status and
+        last_triggered_at back, and drop the batch, so the request can be retried
+        (with the same Idempotency-Key, sends that did go out are deduplicated).
+        """
+        by_status, by_triggered = {}, {}
+        for mp_id, (old_status, old_triggered) in previous.items():
+            by_status.setdefault(old_status, []).append(mp_id)
+            by_triggered.setdefault(old_triggered, []).append(mp_id)
+        try:
+            with transaction.atomic():
+                MailPlan.objects.filter(id__in=list(previous)).update(
+                    status=Case(*[When(id__in=ids, then=Value(st)) for st, ids in by_status.items()]),
+                    last_triggered_at=Case(*[When(id__in=ids, then=Value(at)) for at, ids in by_triggered.items()],
+                                           output_field=MailPlan._meta.get_field('last_triggered_at')),
+                    **MailPlan.touched(),
+                )
+                response_cache.invalidate(*previous)
+                batch.delete()
+        except Exception:
+            logger.exception("Could not restore the plans of failed bulk trigger %s.", batch.run_id)
+
+    @staticmethod
+    def _batch_summary(batch, duplicate=False):
+        summary = {
+            "batch_id": batch.run_id,
+            "plan_ids": batch.plan_ids,
+            "flow_plans": batch.flow_plans,
+            "messages": batch.messages,
+            "created_at": batch.created_at,
+        }
+        if duplicate:
+            summary["duplicate"] = True
+        return summary
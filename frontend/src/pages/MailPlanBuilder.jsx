@@ -24,6 +24,8 @@ export default function MailPlanBuilder() {
     { id: 'start', position: { x: 300, y: 200 }, data: { label: 'Start' }, type: 'start' },
   ])
   const [edges, setEdges] = useState([])
+  // ETag of the loaded plan: sent as If-Match so a save cannot overwrite someone else's changes
+  const [etag, setEtag] = useState(null)
   const [selectedNode, setSelectedNode] = useState(null)
 
   // Defensive loader: uses data.flow if present, otherwise build a simple flow from top-level fields
@@ -33,6 +35,7 @@ export default function MailPlanBuilder() {
     api.get(`/mailplans/${id}/`)
       .then(res => {
         const data = res.data || {}
+        setEtag(res.headers?.etag || null)
 
         // Try to find a flow field under common keys
         let flow = null
@@ -188,13 +191,17 @@ export default function MailPlanBuilder() {
 
       if (id) {
         // use PATCH so partial updates are safer (backend may accept PUT too)
-        await api.patch(`/mailplans/${id}/`, payload)
+        await api.patch(`/mailplans/${id}/`, payload, etag ? { headers: { 'If-Match': etag } } : undefined)
       } else {
         await api.post('/mailplans/', payload)
       }
       alert('Saved')
       navigate('/mailplans')
     } catch (err) {
+      if (err?.response?.status === 412) {
+        alert('This mail plan was changed elsewhere since you opened it. Reload the page to get the latest version before saving.')
+        return
+      }
       console.error('Save failed', err?.response?.data || err.message)
       alert('Save failed: ' + JSON.stringify(err?.response?.data || err?.message))
     }
@@ -3,8 +3,14 @@ import api from '../services/api'
 import { useNavigate } from 'react-router-dom'
 import { useAuth } from '../services/auth'
 
+// only the columns the table shows: the flow / template_vars JSON is not loaded
+const LIST_FIELDS = 'id,name,recipient_email,trigger_type,status'
+const PAGE_SIZE = 50
+
 export default function MailPlanList() {
   const [plans, setPlans] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [loadingIds, setLoadingIds] = useState([]) // track which plans are being triggered
   const navigate = useNavigate()
   const { logout } = useAuth()
@@ -13,15 +19,45 @@ export default function MailPlanList() {
     loadPlans()
   }, [])
 
+  // cursor of the `next` page link returned by the API (null on the last page)
+  const cursorFrom = (url) => {
+    if (!url) return null
+    try {
+      return new URL(url, window.location.origin).searchParams.get('cursor')
+    } catch {
+      return null
+    }
+  }
+
+  const fetchPage = (cursor) =>
+    api.get('/mailplans/', { params: { fields: LIST_FIELDS, page_size: PAGE_SIZE, ...(cursor ? { cursor } : {}) } })
+
   const loadPlans = () => {
-    api.get('/mailplans/')
+    fetchPage(null)
       .then(res => {
-        if (Array.isArray(res.data)) setPlans(res.data)
-        else setPlans(res.data.results || [])
+        if (Array.isArray(res.data)) {
+          setPlans(res.data)
+          setNextCursor(null)
+        } else {
+          setPlans(res.data.results || [])
+          setNextCursor(cursorFrom(res.data.next))
+        }
       })
       .catch(err => console.error('Error fetching mail plans', err))
   }
 
+  const loadMore = () => {
+    if (!nextCursor || loadingMore) return
+    setLoadingMore(true)
+    fetchPage(nextCursor)
+      .then(res => {
+        setPlans(prev => [...prev, ...(res.data.results || [])])
+        setNextCursor(cursorFrom(res.data.next))
+      })
+      .catch(err => console.error('Error fetching mail plans', err))
+      .finally(() => setLoadingMore(false))
+  }
+
   const handleLogout = () => {
     logout()
     navigate('/login')
@@ -39,17 +75,8 @@ export default function MailPlanList() {
     }
   }
 
+  // the API already reports the first email node's recipient as recipient_email
   function getRecipientFromFlow(plan) {
-    try {
-      const flow = plan.flow || {}
-      const nodes = flow.nodes || []
-      for (const node of nodes) {
-        const data = node.data || {}
-        if (node.type === 'email' || data.recipient_email) {
-          return data.recipient_email
-        }
-      }
-    } catch {}
     return plan.recipient_email || ''
   }
 
@@ -173,6 +200,18 @@ export default function MailPlanList() {
           </tbody>
         </table>
       </div>
+
+      {nextCursor && (
+        <div className="mt-4 text-center">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="px-3 py-1 rounded border text-blue-600 hover:bg-gray-50"
+          >
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
     </div>
   )
 }